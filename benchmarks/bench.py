@@ -0,0 +1,628 @@
+"""Time each stage of the transcription pipeline on fixed inputs
+
+Run from the repository root::
+
+    python -m benchmarks.bench [--output results.json] [--compare old.json]
+
+Every stage runs against synthetic, seeded fixtures and local stand-ins
+(an HTTP server on localhost for downloads, moto for S3), so results are
+comparable between commits on the same machine. Each stage records its
+median and minimum wall time, peak RSS of the process so far, and, for
+stages that process audio, the real-time factor in audio seconds per wall
+second.
+
+The ``cli_import`` stage times importing the command line in a fresh
+interpreter and fails the run when that import exceeds ``--import-budget``
+or pulls in a heavy dependency that only some commands need.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from typing import Callable, Dict, List, Optional
+
+from benchmarks import fixtures
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+# Imported only by the code paths that use them, never by the command line
+# itself, so that --help and argument errors come back at once
+DEFERRED_MODULES = [
+    "boto3",
+    "faster_whisper",
+    "jinja2",
+    "numpy",
+    "omegaconf",
+    "pytubefix",
+    "requests",
+    "torch",
+    "whisper",
+]
+
+_IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import unchecked_transcript.cli
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "seconds": elapsed,
+    "modules": sorted(name for name in sys.modules if "." not in name),
+}))
+"""
+
+
+def _peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure(
+    name: str,
+    func: Callable[[], object],
+    repeat: int,
+    audio_seconds: Optional[float] = None,
+    setup: Optional[Callable[[], None]] = None,
+) -> Dict[str, object]:
+    """Time a stage
+
+    :param name: stage name
+    :type name: str
+    :param func: the work to time
+    :type func: Callable[[], object]
+    :param repeat: number of timed runs
+    :type repeat: int
+    :param audio_seconds: length of the audio the stage processes
+    :type audio_seconds: float, optional
+    :param setup: untimed work to run before each timed run
+    :type setup: Callable[[], None], optional
+    :return: the stage record
+    :rtype: Dict[str, object]
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    record = {
+        "stage": name,
+        "repeat": repeat,
+        "wall_median": statistics.median(times),
+        "wall_min": min(times),
+        "peak_rss_bytes": _peak_rss(),
+    }
+    if audio_seconds:
+        record["audio_seconds"] = audio_seconds
+        record["rtf"] = audio_seconds / record["wall_median"]
+    print(
+        f"{name:<24} {record['wall_median'] * 1000:>10.2f} ms"
+        + (f"  {record['rtf']:>8.1f}x real time" if audio_seconds else ""),
+        file=sys.stderr,
+    )
+    return record
+
+
+def import_stages(args: argparse.Namespace) -> List[Dict[str, object]]:
+    """Benchmark importing the command line in a fresh interpreter
+
+    :param args: command line arguments
+    :type args: argparse.Namespace
+    :return: stage records; the record has a "failures" key listing deferred
+        modules that were imported and a blown time budget, if any
+    :rtype: List[Dict[str, object]]
+    """
+    probes = []
+
+    def probe() -> None:
+        result = subprocess.run(
+            [sys.executable, "-c", _IMPORT_PROBE],
+            cwd=REPO_ROOT,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        probes.append(json.loads(result.stdout))
+
+    record = measure("cli_import", probe, args.repeat)
+    import_seconds = statistics.median(p["seconds"] for p in probes)
+    record["import_seconds"] = import_seconds
+    imported = set(probes[-1]["modules"])
+    failures = [
+        f"{module} imported by unchecked_transcript.cli"
+        for module in DEFERRED_MODULES
+        if module in imported
+    ]
+    if import_seconds > args.import_budget:
+        failures.append(
+            f"import took {import_seconds:.3f}s,"
+            f" over the {args.import_budget:.3f}s budget"
+        )
+    record["failures"] = failures
+    for failure in failures:
+        print(f"cli_import: {failure}", file=sys.stderr)
+    return [record]
+
+
+def _youtube_fixture(srt: str):
+    from unchecked_transcript.mediacontent import YouTubeVideo
+
+    # Skip __init__, which would contact YouTube
+    video = YouTubeVideo.__new__(YouTubeVideo)
+    video.source_url = "https://www.youtube.com/watch?v=aaaaaaaaaaa"
+    video.youtube_id = "aaaaaaaaaaa"
+    video.pytube_object = fixtures.StubYouTube(srt)
+    return video
+
+
+def _podcast_fixture(url: str):
+    from unchecked_transcript.mediacontent import PodcastEpisode
+
+    return PodcastEpisode(
+        audio_url=url,
+        episode_title="Benchmark episode",
+        episode_url="https://example.org/episode",
+        podcast_title="Benchmark podcast",
+    )
+
+
+def text_stages(args: argparse.Namespace) -> List[Dict[str, object]]:
+    """Benchmark the stages that work on text
+
+    :param args: command line arguments
+    :type args: argparse.Namespace
+    :return: stage records
+    :rtype: List[Dict[str, object]]
+    """
+    from unchecked_transcript.transcription import Transcription
+
+    segments = fixtures.make_segments(args.segments)
+    srt = fixtures.make_srt(segments)
+    video = _youtube_fixture(srt)
+    audio_seconds = segments[-1]["end"]
+    records = [
+        measure(
+            "parse_srt",
+            lambda: video._parse_srt("en"),  # pylint: disable=W0212
+            args.repeat,
+            audio_seconds=audio_seconds,
+        )
+    ]
+
+    transcription = Transcription(video)
+    records.append(
+        measure(
+            "condense_segments",
+            transcription.condense_segments,
+            args.repeat,
+            audio_seconds=audio_seconds,
+        )
+    )
+    records.append(
+        measure(
+            "render_youtube", transcription.html, args.repeat, audio_seconds
+        )
+    )
+
+    podcast = Transcription(_podcast_fixture("http://127.0.0.1/unused"))
+    podcast._result = {  # pylint: disable=protected-access
+        "text": "".join(segment["text"] for segment in segments),
+        "segments": segments,
+    }
+    records.append(
+        measure("render_podcast", podcast.html, args.repeat, audio_seconds)
+    )
+    return records
+
+
+def template_stages(
+    args: argparse.Namespace, workdir: str
+) -> List[Dict[str, object]]:
+    """Benchmark rendering one short item, with and without shared templates
+
+    ``render_item_cold`` builds a new Jinja environment and compiles the
+    template for every item, as each render did before templates were
+    shared; ``render_item_shared`` reuses the process-wide environment;
+    ``template_bytecode`` loads the template into a new environment from
+    a warm bytecode cache, as a new process would.
+
+    :param args: command line arguments
+    :type args: argparse.Namespace
+    :param workdir: scratch directory
+    :type workdir: str
+    :return: stage records
+    :rtype: List[Dict[str, object]]
+    """
+    import jinja2
+
+    from unchecked_transcript.transcription import (
+        Transcription,
+        get_jinja_env,
+    )
+
+    segments = fixtures.make_segments(args.item_segments)
+    item = Transcription(_youtube_fixture(fixtures.make_srt(segments)))
+    template_name = item._media_content.html_template  # pylint: disable=W0212
+    records = [
+        measure(
+            "render_item_cold",
+            item.html,
+            args.repeat,
+            setup=get_jinja_env.cache_clear,
+        ),
+        measure("render_item_shared", item.html, args.repeat),
+    ]
+
+    bytecode_cache = jinja2.FileSystemBytecodeCache(
+        os.path.join(workdir, "templates")
+    )
+    os.makedirs(bytecode_cache.directory)
+
+    def load_template() -> None:
+        jinja2.Environment(
+            loader=jinja2.PackageLoader("unchecked_transcript"),
+            autoescape=jinja2.select_autoescape(),
+            bytecode_cache=bytecode_cache,
+        ).get_template(template_name)
+
+    load_template()
+    records.append(measure("template_bytecode", load_template, args.repeat))
+    return records
+
+
+def page_stages(args: argparse.Namespace) -> List[Dict[str, object]]:
+    """Compare inline and compact pages for a long transcript
+
+    Each YouTube and podcast page is rendered with the inline template,
+    which has a CSS rule per line, and with the minified compact template.
+    Records have a "page_bytes" key; the compact record fails if its page
+    is not smaller.
+
+    :param args: command line arguments
+    :type args: argparse.Namespace
+    :return: stage records
+    :rtype: List[Dict[str, object]]
+    """
+    from unchecked_transcript.transcription import Transcription
+
+    segments = fixtures.make_segments(args.page_segments)
+    youtube = Transcription(_youtube_fixture(fixtures.make_srt(segments)))
+    podcast = Transcription(_podcast_fixture("http://127.0.0.1/unused"))
+    podcast._result = {  # pylint: disable=protected-access
+        "text": "".join(segment["text"] for segment in segments),
+        "segments": segments,
+    }
+
+    records = []
+    for name, transcription in (("youtube", youtube), ("podcast", podcast)):
+        sizes = {}
+        for mode in ("inline", "compact"):
+            compact = mode == "compact"
+
+            def render(transcription=transcription, compact=compact) -> str:
+                return "".join(transcription.html_chunks(compact=compact))
+
+            # Condense once, untimed; the page reuses the result
+            sizes[mode] = len(render().encode("utf-8"))
+            record = measure(f"page_{name}_{mode}", render, args.repeat)
+            record["page_bytes"] = sizes[mode]
+            records.append(record)
+        failures = []
+        if sizes["compact"] >= sizes["inline"]:
+            failures.append(
+                f"compact page is {sizes['compact']} bytes,"
+                f" inline {sizes['inline']}"
+            )
+        records[-1]["failures"] = failures
+        print(
+            f"page_{name}: {sizes['inline']} bytes inline,"
+            f" {sizes['compact']} compact"
+            f" ({sizes['compact'] / sizes['inline']:.0%})",
+            file=sys.stderr,
+        )
+        for failure in failures:
+            print(f"page_{name}_compact: {failure}", file=sys.stderr)
+    return records
+
+
+def audio_stages(
+    args: argparse.Namespace, workdir: str
+) -> List[Dict[str, object]]:
+    """Benchmark downloading and transcribing a synthetic audio file
+
+    :param args: command line arguments
+    :type args: argparse.Namespace
+    :param workdir: scratch directory
+    :type workdir: str
+    :return: stage records
+    :rtype: List[Dict[str, object]]
+    """
+    from unchecked_transcript.backends import backend_settings, get_backend
+    from unchecked_transcript.transcription import (
+        InProcessEngine,
+        Transcription,
+        set_engine,
+    )
+
+    served = os.path.join(workdir, "served")
+    os.makedirs(served)
+    if args.audio:
+        name = os.path.basename(args.audio)
+        os.symlink(os.path.abspath(args.audio), os.path.join(served, name))
+    else:
+        name = "fixture.wav"
+        fixtures.write_audio(os.path.join(served, name), args.audio_seconds)
+    audio_seconds = _audio_duration(os.path.join(served, name))
+
+    records = []
+    with fixtures.LocalHTTPServer(served) as server:
+        episodes = []
+
+        def new_episode() -> None:
+            episodes.append(_podcast_fixture(server.url(name)))
+
+        records.append(
+            measure(
+                "download",
+                lambda: episodes[-1].audio_file,
+                args.repeat,
+                audio_seconds=audio_seconds,
+                setup=new_episode,
+            )
+        )
+
+        backend = get_backend(
+            **backend_settings(name=args.backend, model_name=args.model)
+        )
+        records.append(measure("model_load", lambda: backend.model, 1))
+        set_engine(InProcessEngine(backend))
+        transcriptions = []
+
+        def new_transcription() -> None:
+            transcriptions.append(Transcription(episodes[-1]))
+
+        records.append(
+            measure(
+                "transcribe",
+                lambda: transcriptions[-1].segments,
+                args.audio_repeat,
+                audio_seconds=audio_seconds,
+                setup=new_transcription,
+            )
+        )
+        set_engine(None)
+    return records
+
+
+def _audio_duration(path: str) -> float:
+    try:
+        with wave.open(path) as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError):
+        from whisper.audio import SAMPLE_RATE, load_audio
+
+        return len(load_audio(path)) / SAMPLE_RATE
+
+
+def upload_stages(args: argparse.Namespace) -> List[Dict[str, object]]:
+    """Benchmark uploading a rendered page to a stand-in S3
+
+    :param args: command line arguments
+    :type args: argparse.Namespace
+    :return: stage records, empty if moto is not installed
+    :rtype: List[Dict[str, object]]
+    """
+    try:
+        from moto import mock_aws
+    except ImportError:
+        print("moto is not installed; skipping upload", file=sys.stderr)
+        return []
+
+    from unchecked_transcript import get_config
+    from unchecked_transcript.transcription import Transcription
+    from unchecked_transcript.upload_html import (
+        get_s3_client,
+        upload_html,
+        upload_pages,
+    )
+
+    segments = fixtures.make_segments(args.segments)
+    page = Transcription(_youtube_fixture(fixtures.make_srt(segments))).html()
+    with mock_aws():
+        # The shared client has to be created inside the stand-in
+        get_s3_client.cache_clear()
+        get_s3_client().create_bucket(Bucket=get_config().bucket)
+        records = [
+            measure(
+                "upload_html",
+                lambda: upload_html(page, folder="benchmark", force=True),
+                args.repeat,
+            ),
+            measure(
+                "upload_html_unchanged",
+                lambda: upload_html(page, folder="benchmark"),
+                args.repeat,
+            ),
+        ]
+        batch = [(page, f"benchmark/{index}") for index in range(16)]
+        records.append(
+            measure(
+                "upload_pages_16",
+                lambda: upload_pages(batch, force=True),
+                args.repeat,
+            )
+        )
+        get_s3_client.cache_clear()
+        return records
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(
+    old: Dict[str, object], new: Dict[str, object], max_regression: float
+) -> bool:
+    """Print the change in each stage's median time between two runs
+
+    :param old: earlier results
+    :type old: Dict[str, object]
+    :param new: later results
+    :type new: Dict[str, object]
+    :param max_regression: largest acceptable slowdown, as a fraction
+    :type max_regression: float
+    :return: True if no stage slowed down by more than ``max_regression``
+    :rtype: bool
+    """
+    old_stages = {stage["stage"]: stage for stage in old["stages"]}
+    ok = True
+    print(f"{'stage':<24} {old['commit']:>12} {new['commit']:>12}  change")
+    for stage in new["stages"]:
+        before = old_stages.get(stage["stage"])
+        if before is None:
+            continue
+        change = stage["wall_median"] / before["wall_median"] - 1
+        flag = ""
+        if change > max_regression:
+            flag = "  REGRESSION"
+            ok = False
+        print(
+            f"{stage['stage']:<24} {before['wall_median'] * 1000:>10.2f}ms"
+            f" {stage['wall_median'] * 1000:>10.2f}ms  {change:+.1%}{flag}"
+        )
+    return ok
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    """Parse the command line
+
+    :param argv: arguments, without the program name
+    :type argv: List[str]
+    :return: parsed arguments
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--segments",
+        type=int,
+        default=5000,
+        help="caption segments in the text fixtures",
+    )
+    parser.add_argument(
+        "--item-segments",
+        type=int,
+        default=200,
+        help="caption segments in the short item for the template stages",
+    )
+    parser.add_argument(
+        "--page-segments",
+        type=int,
+        default=20000,
+        help="caption segments in the long transcript for the page stages",
+    )
+    parser.add_argument(
+        "--audio-seconds",
+        type=float,
+        default=30.0,
+        help="length of the synthetic audio clip",
+    )
+    parser.add_argument(
+        "--audio", help="transcribe this clip instead of synthetic audio"
+    )
+    parser.add_argument("--audio-repeat", type=int, default=1)
+    parser.add_argument("--backend", help="transcription backend")
+    parser.add_argument("--model", default="tiny", help="model name")
+    parser.add_argument(
+        "--skip-audio",
+        action="store_true",
+        help="skip the download and transcription stages",
+    )
+    parser.add_argument(
+        "--import-budget",
+        type=float,
+        default=0.5,
+        help="fail when importing the command line takes longer (seconds)",
+    )
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", help="compare against this results JSON")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="fail when a stage is this fraction slower than --compare",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None) -> int:
+    """Run the benchmarks
+
+    :param argv: arguments, defaults to sys.argv[1:]
+    :type argv: List[str], optional
+    :return: process exit status
+    :rtype: int
+    """
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    commit = _git_commit()
+    with tempfile.TemporaryDirectory() as workdir:
+        stages = import_stages(args)
+
+        # The package reads config.yml from the working directory
+        fixtures.write_config(workdir)
+        os.chdir(workdir)
+        sys.path.insert(0, REPO_ROOT)
+
+        stages.extend(text_stages(args))
+        stages.extend(template_stages(args, workdir))
+        stages.extend(page_stages(args))
+        if not args.skip_audio:
+            stages.extend(audio_stages(args, workdir))
+        stages.extend(upload_stages(args))
+        os.chdir(REPO_ROOT)
+
+    results = {
+        "commit": commit,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": vars(args),
+        "stages": stages,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+    if any(stage.get("failures") for stage in stages):
+        return 1
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            if not compare(json.load(file), results, args.max_regression):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
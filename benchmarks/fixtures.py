@@ -0,0 +1,204 @@
+"""Synthetic inputs and local stand-ins for the benchmarks"""
+
+import functools
+import http.server
+import math
+import os
+import random
+import struct
+import threading
+import wave
+from typing import Dict, List
+
+SAMPLE_RATE = 16000
+
+WORDS = (
+    "the library open access archive metadata digital collection "
+    "preservation scholarly repository copyright license catalog record "
+    "publisher author reader search discovery annotation transcript"
+).split()
+
+
+def write_config(directory: str) -> str:
+    """Write a config.yml that keeps the benchmarks off real services
+
+    The result, media, and template bytecode caches are turned off so that
+    every run measures the work rather than a cache hit; the AWS values
+    only need to satisfy the stand-in S3.
+
+    :param directory: directory to write config.yml in
+    :type directory: str
+    :return: path to the config file
+    :rtype: str
+    """
+    path = os.path.join(directory, "config.yml")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(
+            "aws_access_key_id: benchmark\n"
+            "aws_secret_access_key: benchmark\n"
+            "region_name: us-east-1\n"
+            "bucket: benchmark-bucket\n"
+            "podcast_base_folder: unchecked-transcript\n"
+            "youtube_base_folder: annotated-video\n"
+            "result_cache_max_mb: 0\n"
+            "media_cache_max_mb: 0\n"
+            'template_cache_dir: ""\n'
+        )
+    return path
+
+
+def make_segments(count: int, seed: int = 1) -> List[Dict[str, object]]:
+    """Make caption-like segments of two to six seconds each
+
+    :param count: number of segments
+    :type count: int
+    :param seed: random seed, so runs are comparable
+    :type seed: int, optional
+    :return: segments with "start", "end", and "text" keys
+    :rtype: List[Dict[str, object]]
+    """
+    rng = random.Random(seed)
+    segments = []
+    start = 0.0
+    for _ in range(count):
+        end = start + rng.uniform(2.0, 6.0)
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 14)))
+        if rng.random() < 0.3:
+            text += "."
+        segments.append(
+            {"start": round(start, 3), "end": round(end, 3), "text": text}
+        )
+        start = end
+    return segments
+
+
+def _srt_time(seconds: float) -> str:
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+
+def make_srt(segments: List[Dict[str, object]]) -> str:
+    """Render segments in SubRip format
+
+    :param segments: segments with "start", "end", and "text" keys
+    :type segments: List[Dict[str, object]]
+    :return: SRT document
+    :rtype: str
+    """
+    blocks = []
+    for index, segment in enumerate(segments, start=1):
+        timecode = (
+            f"{_srt_time(segment['start'])} --> {_srt_time(segment['end'])}"
+        )
+        blocks.append(f"{index}\n{timecode}\n{segment['text']}")
+    return "\n\n".join(blocks) + "\n"
+
+
+def write_audio(path: str, seconds: float, seed: int = 1) -> str:
+    """Write a 16 kHz mono WAV of speech-like bursts separated by silence
+
+    Bursts are amplitude-modulated tones with a little noise, one to four
+    seconds long, followed by up to a second and a half of near silence.
+
+    :param path: file to write
+    :type path: str
+    :param seconds: length of the audio
+    :type seconds: float
+    :param seed: random seed, so runs are comparable
+    :type seed: int, optional
+    :return: the path written
+    :rtype: str
+    """
+    rng = random.Random(seed)
+    total = int(seconds * SAMPLE_RATE)
+    frames = bytearray()
+    position = 0
+    while position < total:
+        burst = int(rng.uniform(1.0, 4.0) * SAMPLE_RATE)
+        pitch = rng.uniform(110, 240)
+        for index in range(min(burst, total - position)):
+            phase = 2 * math.pi * index / SAMPLE_RATE
+            envelope = 0.5 + 0.5 * math.sin(4 * phase)
+            value = envelope * math.sin(pitch * phase)
+            value += rng.uniform(-0.05, 0.05)
+            frames += struct.pack("<h", int(value * 12000))
+        position += burst
+        pause = int(rng.uniform(0.2, 1.5) * SAMPLE_RATE)
+        pause = min(pause, total - position)
+        if pause > 0:
+            frames += b"\x00\x00" * pause
+            position += pause
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(bytes(frames[: total * 2]))
+    return path
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class LocalHTTPServer:
+    """Serve a directory over HTTP on localhost, in a background thread"""
+
+    directory: str
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        handler = functools.partial(_QuietHandler, directory=directory)
+        self._server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), handler
+        )
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+
+    def url(self, name: str) -> str:
+        """Get the URL of a file in the served directory
+
+        :param name: file name
+        :type name: str
+        :return: the file's URL
+        :rtype: str
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/{name}"
+
+    def __enter__(self) -> "LocalHTTPServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class StubCaptionTrack:
+    """Stand-in for a pytubefix caption track"""
+
+    def __init__(self, srt: str) -> None:
+        self._srt = srt
+
+    def generate_srt_captions(self) -> str:
+        """Return the SRT document, as pytubefix does after a download
+
+        :return: SRT document
+        :rtype: str
+        """
+        return self._srt
+
+
+class StubYouTube:
+    """Stand-in for a pytubefix.YouTube object with English captions"""
+
+    title = "Benchmark video"
+    author = "Benchmark channel"
+
+    def __init__(self, srt: str) -> None:
+        self.captions = {"en": StubCaptionTrack(srt)}
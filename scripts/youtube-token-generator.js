@@ -1,9 +1,30 @@
 const { generate } = require("youtube-po-token-generator");
-generate().then(
-  (token) => {
-    console.log(JSON.stringify(token));
-  },
-  (error) => {
-    console.error(error);
-  }
-);
+const readline = require("readline");
+
+// With --serve, stay running and answer each line on stdin with one line
+// of JSON, so the caller pays for Node's startup only once.
+if (process.argv.includes("--serve")) {
+  const lines = readline.createInterface({ input: process.stdin });
+  let queue = Promise.resolve();
+  lines.on("line", () => {
+    queue = queue.then(() =>
+      generate().then(
+        (token) => {
+          console.log(JSON.stringify(token));
+        },
+        (error) => {
+          console.log(JSON.stringify({ error: String(error) }));
+        }
+      )
+    );
+  });
+} else {
+  generate().then(
+    (token) => {
+      console.log(JSON.stringify(token));
+    },
+    (error) => {
+      console.error(error);
+    }
+  );
+}
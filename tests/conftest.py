@@ -0,0 +1,36 @@
+"""Shared fixtures: a throwaway config.yml and fresh per-process caches"""
+
+import pytest
+
+from unchecked_transcript import get_aws_session, get_config
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """Run the test in a directory with a config.yml for local stand-ins
+
+    The result, media, PCM, and template caches are turned off and the AWS
+    values only need to satisfy moto.
+
+    :return: the loaded configuration
+    :rtype: omegaconf.DictConfig
+    """
+    (tmp_path / "config.yml").write_text(
+        "aws_access_key_id: testing\n"
+        "aws_secret_access_key: testing\n"
+        "region_name: us-east-1\n"
+        "bucket: test-bucket\n"
+        "podcast_base_folder: unchecked-transcript\n"
+        "youtube_base_folder: annotated-video\n"
+        "result_cache_max_mb: 0\n"
+        "media_cache_max_mb: 0\n"
+        "pcm_cache_max_mb: 0\n"
+        'template_cache_dir: ""\n',
+        encoding="utf-8",
+    )
+    monkeypatch.chdir(tmp_path)
+    get_config.cache_clear()
+    get_aws_session.cache_clear()
+    yield get_config()
+    get_config.cache_clear()
+    get_aws_session.cache_clear()
@@ -0,0 +1,25 @@
+"""Manifest entries and batch processing"""
+
+import re
+
+from unchecked_transcript.batch import make_media_content
+
+PODCAST_ENTRY = {
+    "type": "podcast",
+    "audio_url": "http://localhost/episode.mp3",
+    "episode_title": "An Episode",
+    "episode_url": "http://localhost/episode",
+    "podcast_title": "A Podcast",
+}
+
+
+def test_slug_fixes_the_folder(config):
+    media_content = make_media_content({**PODCAST_ENTRY, "slug": "episode-1"})
+
+    assert media_content.s3_path == "unchecked-transcript/episode-1"
+
+
+def test_folder_is_timestamped_without_a_slug(config):
+    path = make_media_content(PODCAST_ENTRY).s3_path
+
+    assert re.fullmatch(r"unchecked-transcript/\d{8}T\d{6}-.*episode", path)
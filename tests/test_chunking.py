@@ -0,0 +1,28 @@
+"""Chunked transcription of long audio"""
+
+import pytest
+
+pytest.importorskip("whisper")
+
+from unchecked_transcript.chunking import (  # noqa: E402
+    ChunkedTranscriber,
+)
+
+
+class _Engine:
+    identity = "whisper:base:float32:beam=None"
+    concurrency = 2
+
+
+def test_identity_includes_chunk_settings():
+    engine = _Engine()
+    identities = {
+        engine.identity,
+        ChunkedTranscriber(engine).identity,
+        ChunkedTranscriber(engine, chunk_seconds=300).identity,
+        ChunkedTranscriber(engine, overlap_seconds=2).identity,
+    }
+
+    assert len(identities) == 4
+    identity = ChunkedTranscriber(engine).identity
+    assert identity == f"{engine.identity}:chunk=600/5"
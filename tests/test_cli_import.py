@@ -0,0 +1,32 @@
+"""Importing the command line without its heavy dependencies"""
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.bench import DEFERRED_MODULES, REPO_ROOT
+
+PROBE = """
+import json, sys
+import unchecked_transcript.cli
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+@pytest.fixture(scope="module")
+def imported_modules():
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=REPO_ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    return set(json.loads(result.stdout))
+
+
+@pytest.mark.parametrize("module", DEFERRED_MODULES)
+def test_cli_import_defers(imported_modules, module):
+    assert module not in imported_modules
@@ -0,0 +1,141 @@
+"""Grouping segments into paragraphs"""
+
+import random
+import time
+
+import numpy as np
+import pytest
+
+from unchecked_transcript.captions import CaptionTrack
+from unchecked_transcript.condense import condense
+
+
+def _condense_by_loop(segments, min_length=23.0):
+    # Transcription.condense_segments before the condense module, kept as
+    # the reference for the duration policy
+    condensed_transcript = []
+    start_times = []
+    condensed_entry = None
+    last_index = len(segments) - 1
+    for index, entry in enumerate(segments):
+        start = float(entry.get("start"))
+        duration = float(entry.get("end") - start)
+        text = entry.get("text", "").replace("\n", " ").lstrip()
+        if condensed_entry is None:
+            condensed_entry = {
+                "start": start,
+                "start_display": time.strftime(
+                    "%H:%M:%S", time.gmtime(entry.get("start", 0))
+                ),
+                "text": text,
+                "duration": duration,
+            }
+        else:
+            condensed_entry["duration"] += duration
+            condensed_entry["text"] += " " + text
+        if condensed_entry["duration"] >= min_length or index == last_index:
+            start_times.append(condensed_entry["start"])
+            condensed_transcript.append(condensed_entry)
+            condensed_entry = None
+    return condensed_transcript, start_times
+
+
+def _random_segments(rng, count, ticks=10):
+    # Times on a grid of 1 / ticks seconds, so that group totals often land
+    # exactly on the minimum length, where rounding decides the group
+    segments = []
+    tick = 0
+    for index in range(count):
+        length = rng.randint(1, 6 * ticks)
+        segments.append(
+            {
+                "start": tick / ticks,
+                "end": (tick + length) / ticks,
+                "text": f" word{index}",
+            }
+        )
+        tick += length + rng.choice([0, 0, rng.randint(0, ticks)])
+    return segments
+
+
+@pytest.mark.parametrize("ticks", [10, 100])
+@pytest.mark.parametrize("seed", range(300))
+def test_duration_policy_matches_the_loop(seed, ticks):
+    rng = random.Random(seed)
+    segments = _random_segments(rng, rng.randint(1, 400), ticks)
+
+    assert condense(segments) == _condense_by_loop(segments)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_segments_ending_before_they_start_match_loop(seed):
+    rng = random.Random(seed)
+    segments = _random_segments(rng, 300)
+    for segment in rng.sample(segments, 30):
+        segment["end"] = segment["start"] - rng.randint(1, 200) / 10
+
+    assert condense(segments) == _condense_by_loop(segments)
+
+
+def test_caption_track_matches_dictionaries():
+    rng = random.Random(1)
+    segments = _random_segments(rng, 200)
+    track = CaptionTrack.from_dict(
+        {
+            "starts": [segment["start"] for segment in segments],
+            "ends": [segment["end"] for segment in segments],
+            "texts": [segment["text"] for segment in segments],
+        }
+    )
+
+    assert condense(track) == condense(segments)
+
+
+def test_characters_policy():
+    segments = [
+        {"start": float(index), "end": index + 1.0, "text": "x" * 9}
+        for index in range(10)
+    ]
+
+    entries, _ = condense(segments, policy="characters", min_characters=30)
+
+    # Each text counts ten characters with its joining space
+    assert [entry["text"].count("x") for entry in entries] == [27, 27, 27, 9]
+
+
+def test_sentence_policy_waits_for_a_sentence_end():
+    texts = ["One", "two.", "Three", "four", "five.", "Six"]
+    segments = [
+        {"start": index * 10.0, "end": index * 10.0 + 10, "text": text}
+        for index, text in enumerate(texts)
+    ]
+
+    entries, starts = condense(segments, policy="sentence", min_length=20)
+
+    assert [entry["text"] for entry in entries] == [
+        "One two.",
+        "Three four five.",
+        "Six",
+    ]
+    assert starts == [0.0, 20.0, 50.0]
+
+
+def test_sentence_policy_ends_long_groups_without_a_sentence_end():
+    segments = [
+        {"start": index * 10.0, "end": index * 10.0 + 10, "text": "and"}
+        for index in range(8)
+    ]
+
+    entries, _ = condense(
+        segments,
+        policy="sentence",
+        min_length=10,
+        find_sentence_ends=lambda texts: np.array([], dtype=np.intp),
+    )
+
+    # Three times the minimum length
+    assert [entry["duration"] for entry in entries] == [30.0, 30.0, 20.0]
+
+
+def test_no_segments():
+    assert condense([]) == ([], [])
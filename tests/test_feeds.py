@@ -0,0 +1,125 @@
+"""Parsing podcast feeds and queueing their new episodes"""
+
+import pytest
+
+from unchecked_transcript import feeds
+from unchecked_transcript.feeds import FeedState, FeedWatcher, parse_feed
+from unchecked_transcript.service import JobQueue
+
+FEED_URL = "http://localhost/feed.xml"
+
+FEED = b"""<?xml version="1.0"?>
+<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">
+<channel>
+  <title>A Podcast</title>
+  <atom:link href="http://localhost/feed.xml" rel="self"/>
+  <link>http://localhost/podcast</link>
+  <item>
+    <title>Good</title>
+    <link>http://localhost/good</link>
+    <guid>good</guid>
+    <enclosure url="http://localhost/good.mp3" type="audio/mpeg"/>
+  </item>
+  <item>
+    <title>No link</title>
+    <guid>no-link</guid>
+    <enclosure url="http://localhost/no-link.mp3" type="audio/mpeg"/>
+  </item>
+  <item>
+    <link>http://localhost/no-title</link>
+    <guid>no-title</guid>
+    <enclosure url="http://localhost/no-title.mp3" type="audio/mpeg"/>
+  </item>
+  <item>
+    <title>Also good</title>
+    <link>http://localhost/also-good</link>
+    <guid>also-good</guid>
+    <enclosure url="http://localhost/also-good.mp3" type="audio/mpeg"/>
+  </item>
+</channel>
+</rss>
+"""
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start : start + chunk_size]
+
+
+class FakeSession:
+    """Serves the feed with an ETag, and 304 to a matching request"""
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, headers, stream, timeout):
+        self.requests.append(dict(headers))
+        if headers.get("If-None-Match") == '"v1"':
+            return FakeResponse(304)
+        return FakeResponse(200, FEED, {"ETag": '"v1"'})
+
+
+@pytest.fixture
+def watcher(tmp_path, monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(feeds, "get_session", lambda: session)
+    path = str(tmp_path / "jobs.sqlite3")
+    job_queue = JobQueue(path)
+    state = FeedState(path)
+    yield FeedWatcher(job_queue, state)
+    state.close()
+    job_queue.close()
+
+
+def test_item_without_link_gets_the_channel_link():
+    entries = {entry["guid"]: entry for entry in parse_feed([FEED])}
+
+    assert entries["good"]["episode_url"] == "http://localhost/good"
+    assert entries["no-link"]["episode_url"] == "http://localhost/podcast"
+    assert entries["good"]["podcast_title"] == "A Podcast"
+
+
+def test_item_without_any_link_gets_its_enclosure_url():
+    feed = FEED.replace(b"<link>http://localhost/podcast</link>", b"")
+    entries = {entry["guid"]: entry for entry in parse_feed([feed])}
+
+    assert entries["no-link"]["episode_url"] == "http://localhost/no-link.mp3"
+
+
+def test_bad_item_is_skipped_and_the_rest_of_the_feed_queued(watcher):
+    job_ids = watcher.check(FEED_URL)
+
+    queued = [
+        job["entry"]["episode_title"] for job in watcher.job_queue.jobs()
+    ]
+    assert sorted(queued) == ["Also good", "Good", "No link"]
+    assert len(job_ids) == 3
+    assert watcher.state.seen(FEED_URL) == {
+        "good",
+        "no-link",
+        "no-title",
+        "also-good",
+    }
+    assert watcher.state.validators(FEED_URL) == {"If-None-Match": '"v1"'}
+
+
+def test_feed_is_not_fetched_again_after_a_bad_item(watcher):
+    watcher.check(FEED_URL)
+
+    assert watcher.check(FEED_URL) == []
+    assert len(watcher.job_queue.jobs()) == 3
@@ -0,0 +1,58 @@
+"""Spans, per-stage totals, and the bounded run report"""
+
+import pytest
+
+from unchecked_transcript.instrumentation import RunReport
+
+
+def _record(report, count, name="stage", **attributes):
+    for _ in range(count):
+        with report.span(name, **attributes):
+            pass
+
+
+def test_totals_sum_each_stage():
+    report = RunReport()
+    _record(report, 2, "download", bytes=100)
+    _record(report, 1, "transcribe", audio_seconds=30.0)
+
+    totals = report.totals()
+    assert totals["download"]["count"] == 2
+    assert totals["download"]["bytes"] == 200
+    assert totals["transcribe"]["audio_seconds"] == 30.0
+    assert len(report.spans) == 3
+
+
+def test_failed_span_is_recorded():
+    report = RunReport()
+    with pytest.raises(ValueError):
+        with report.span("upload"):
+            raise ValueError("no bucket")
+
+    assert report.spans[-1].attributes["error"] == "ValueError: no bucket"
+    assert report.totals()["upload"]["count"] == 1
+
+
+def test_max_spans_keeps_recent_spans_and_all_totals():
+    report = RunReport(max_spans=3)
+    for number in range(5):
+        with report.span("stage", number=number, bytes=1):
+            pass
+
+    assert [span.attributes["number"] for span in report.spans] == [2, 3, 4]
+    assert report.totals()["stage"]["count"] == 5
+    assert report.totals()["stage"]["bytes"] == 5
+    record = report.as_dict()
+    assert record["spans_dropped"] == 2
+    assert len(record["spans"]) == 3
+
+
+def test_limit_spans_trims_existing_spans():
+    report = RunReport()
+    _record(report, 5)
+    report.limit_spans(2)
+    _record(report, 1)
+
+    assert len(report.spans) == 2
+    assert report.dropped == 4
+    assert report.totals()["stage"]["count"] == 6
@@ -0,0 +1,175 @@
+"""Resumed downloads and eviction from the media cache"""
+
+import os
+
+import pytest
+
+from unchecked_transcript import media_cache, mediacontent
+from unchecked_transcript.batch import make_media_content
+from unchecked_transcript.media_cache import MediaCache, download
+
+URL = "http://localhost/episode.mp3"
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=b"", headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start : start + chunk_size]
+
+
+class FakeSession:
+    """Serves one resource, honouring Range as a real server would"""
+
+    def __init__(self, body):
+        self.body = body
+        self.requests = []
+
+    def get(self, url, headers, stream, timeout):
+        self.requests.append(dict(headers))
+        if "Range" not in headers:
+            return FakeResponse(200, self.body)
+        offset = int(headers["Range"][len("bytes=") : -1])
+        if offset >= len(self.body):
+            return FakeResponse(
+                416, headers={"Content-Range": f"bytes */{len(self.body)}"}
+            )
+        return FakeResponse(206, self.body[offset:])
+
+
+@pytest.fixture
+def session(monkeypatch):
+    fake = FakeSession(b"0123456789")
+    monkeypatch.setattr(media_cache, "get_session", lambda: fake)
+    return fake
+
+
+def test_resumes_a_partial_file(session, tmp_path):
+    path = tmp_path / "audio.part"
+    path.write_bytes(b"0123")
+
+    download(URL, str(path), if_range='"etag"')
+
+    assert path.read_bytes() == b"0123456789"
+    assert session.requests[0]["Range"] == "bytes=4-"
+
+
+def test_416_keeps_a_partial_file_of_the_full_length(session, tmp_path):
+    path = tmp_path / "audio.part"
+    path.write_bytes(b"0123456789")
+
+    download(URL, str(path), if_range='"etag"')
+
+    assert path.read_bytes() == b"0123456789"
+    assert len(session.requests) == 1
+
+
+def test_416_restarts_a_partial_file_longer_than_the_resource(
+    session, tmp_path
+):
+    path = tmp_path / "audio.part"
+    path.write_bytes(b"0123456789-left-over")
+
+    download(URL, str(path), if_range='"etag"')
+
+    assert path.read_bytes() == b"0123456789"
+    assert "Range" not in session.requests[-1]
+
+
+def make_cache(directory, files, max_bytes):
+    cache = MediaCache(str(directory), max_bytes)
+    directory.mkdir(exist_ok=True)
+    for age, name in enumerate(files):
+        path = directory / name
+        path.write_bytes(b"x" * 10)
+        os.utime(path, (age, age))
+    return cache
+
+
+def test_evict_removes_least_recently_used_files(tmp_path):
+    cache = make_cache(tmp_path / "media", ["old.mp3", "new.mp3"], 10)
+
+    assert cache.evict() == 1
+    assert sorted(os.listdir(cache.directory)) == ["new.mp3"]
+
+
+def test_evict_counts_only_complete_media_files(tmp_path):
+    cache = make_cache(tmp_path / "media", ["old.mp3", "new.mp3"], 20)
+    (tmp_path / "media" / "old.mp3.json").write_text("{}")
+    (tmp_path / "media" / "next.mp3.part").write_bytes(b"x" * 100)
+
+    assert cache.evict() == 0
+    cache.max_bytes = 10
+    assert cache.evict() == 1
+    assert sorted(os.listdir(cache.directory)) == ["new.mp3", "next.mp3.part"]
+
+
+def test_fetch_locks_are_dropped_after_use(session, tmp_path):
+    cache = MediaCache(str(tmp_path / "media"), 1 << 20)
+    for index in range(3):
+        cache.fetch(f"{URL}?episode={index}")
+
+    assert not cache._locks
+
+
+def test_evict_keeps_pinned_files_until_released(session, tmp_path):
+    cache = make_cache(tmp_path / "media", ["old.mp3"], 5)
+    prefetched = cache.fetch(URL)
+    os.utime(prefetched, (1, 1))
+    # The second fetch of the same file pins it again
+    assert cache.fetch(URL) == prefetched
+    cache.release(prefetched)
+
+    cache.evict()
+    assert os.path.exists(prefetched)
+
+    cache.release(prefetched)
+    cache.evict()
+    assert not os.path.exists(prefetched)
+
+
+def test_failed_fetch_does_not_leave_a_pin(monkeypatch, tmp_path):
+    def fail(*args, **kwargs):
+        raise OSError("no route to host")
+
+    monkeypatch.setattr(media_cache, "download", fail)
+    cache = MediaCache(str(tmp_path / "media"), 0)
+
+    with pytest.raises(OSError):
+        cache.fetch(URL)
+    assert not cache._pins
+
+
+def test_discarding_the_audio_releases_it(config, session, monkeypatch):
+    cache = MediaCache(os.path.abspath("media"), 0)
+    monkeypatch.setattr(mediacontent, "get_media_cache", lambda: cache)
+    media_content = make_media_content(
+        {
+            "type": "podcast",
+            "audio_url": URL,
+            "episode_title": "An Episode",
+            "episode_url": "http://localhost/episode",
+            "podcast_title": "A Podcast",
+        }
+    )
+    audio_file = media_content.audio_file
+    assert cache._pins == {audio_file: 1}
+
+    media_content.discard_audio_file()
+
+    assert not cache._pins
+    assert cache.evict() == 1
@@ -0,0 +1,132 @@
+"""Decoding into, reading from, and evicting the PCM cache"""
+
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from unchecked_transcript import pcm_cache
+from unchecked_transcript.pcm_cache import PcmCache
+
+streaming = pytest.importorskip("unchecked_transcript.streaming")
+
+
+@pytest.fixture
+def decodes(monkeypatch):
+    """Decode each audio file to samples derived from its bytes
+
+    :return: the paths decoded, in order
+    :rtype: list
+    """
+    decoded = []
+
+    def decode_pcm(source, block_seconds=1.0):
+        decoded.append(source)
+        with open(source, "rb") as file:
+            data = np.frombuffer(file.read(), dtype=np.uint8)
+        yield data.astype(np.float32) / 256
+
+    monkeypatch.setattr(streaming, "decode_pcm", decode_pcm)
+    return decoded
+
+
+def write_audio(directory, name, size=4000):
+    path = directory / name
+    path.write_bytes(bytes(range(256)) * (size // 256) + name.encode())
+    return str(path)
+
+
+def test_second_load_maps_the_cached_samples(decodes, tmp_path):
+    cache = PcmCache(str(tmp_path / "pcm"), 1 << 20)
+    audio = write_audio(tmp_path, "a.mp3")
+
+    first = cache.load(audio)
+    second = cache.load(audio)
+
+    assert decodes == [audio]
+    assert isinstance(second, np.memmap)
+    np.testing.assert_array_equal(first, second)
+
+
+def test_empty_audio_loads_as_no_samples(decodes, tmp_path):
+    cache = PcmCache(str(tmp_path / "pcm"), 1 << 20)
+    audio = tmp_path / "empty.mp3"
+    audio.write_bytes(b"")
+
+    assert len(cache.load(str(audio))) == 0
+    assert len(cache.load(str(audio))) == 0
+
+
+def test_decode_locks_and_hashes_are_bounded(decodes, tmp_path, monkeypatch):
+    monkeypatch.setattr(pcm_cache, "HASH_MEMORY", 3)
+    cache = PcmCache(str(tmp_path / "pcm"), 1 << 20)
+
+    for index in range(10):
+        cache.load(write_audio(tmp_path, f"{index}.mp3"))
+
+    assert not cache._locks
+    assert len(cache._hashes) == 3
+
+
+def test_loads_survive_concurrent_eviction(decodes, tmp_path):
+    # Room for about one entry, so every decode evicts another file
+    cache = PcmCache(str(tmp_path / "pcm"), 20000)
+    audio_files = [write_audio(tmp_path, f"{index}.mp3") for index in range(4)]
+    errors = []
+
+    def load_repeatedly(offset):
+        try:
+            for turn in range(50):
+                audio = audio_files[(offset + turn) % len(audio_files)]
+                assert len(cache.load(audio)) == 3840 + len("0.mp3")
+        except Exception as error:  # pylint: disable=broad-except
+            errors.append(error)
+
+    threads = [
+        threading.Thread(target=load_repeatedly, args=(offset,))
+        for offset in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+
+def test_entry_removed_by_another_process_while_opening_is_decoded_again(
+    decodes, tmp_path, monkeypatch
+):
+    cache = PcmCache(str(tmp_path / "pcm"), 1 << 20)
+    audio = write_audio(tmp_path, "a.mp3")
+    expected = np.array(cache.load(audio))
+    utime = os.utime
+    removed = []
+
+    def evicted_first(path, *args, **kwargs):
+        # The other process evicts the entry just after it was found
+        if not removed:
+            removed.append(path)
+            os.remove(path)
+        return utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "utime", evicted_first)
+
+    np.testing.assert_array_equal(cache.load(audio), expected)
+    assert decodes == [audio, audio]
+
+
+def test_evict_skips_entries_another_process_removed(decodes, tmp_path):
+    cache = PcmCache(str(tmp_path / "pcm"), 1 << 20)
+    other_process = PcmCache(cache.directory, 0)
+    for name in ("a.mp3", "b.mp3"):
+        cache.load(write_audio(tmp_path, name))
+    entries = cache.entries()
+    assert len(entries) == 2
+
+    os.remove(cache._path(entries[0]["key"]))
+    other_process.entries = lambda: entries
+
+    assert other_process.evict() == 1
+    assert cache.entries() == []
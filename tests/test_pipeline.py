@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+from unchecked_transcript import pipeline
+from unchecked_transcript.pipeline import Pipeline
+
+
+class FakeMediaContent:
+    s3_path = "folder/"
+
+    def __init__(self, entry, fail_discard):
+        self.entry = entry
+        self.fail_discard = fail_discard
+
+    def discard_audio_file(self):
+        if self.fail_discard:
+            raise OSError("audio is busy")
+
+
+class FakeTranscription:
+    def __init__(self, media_content):
+        self.media_content = media_content
+
+    def prefetch(self):
+        pass
+
+    @property
+    def segments(self):
+        return []
+
+
+@pytest.fixture
+def fake_stages(config, monkeypatch):
+    def make_media_content(entry):
+        return FakeMediaContent(entry, fail_discard=entry["id"] % 2 == 0)
+
+    monkeypatch.setattr(pipeline, "make_media_content", make_media_content)
+    monkeypatch.setattr(pipeline, "Transcription", FakeTranscription)
+    monkeypatch.setattr(
+        pipeline,
+        "upload_transcription",
+        lambda transcription, folder: folder + "index.html",
+    )
+
+
+def run_with_timeout(target, timeout=10):
+    outcome = {}
+
+    def wrapper():
+        outcome["value"] = target()
+
+    thread = threading.Thread(target=wrapper, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the pipeline hung"
+    return outcome["value"]
+
+
+def test_failing_cleanup_and_report_do_not_stop_the_pipeline(fake_stages):
+    entries = [{"id": index} for index in range(12)]
+    recorded = []
+
+    def on_result(result):
+        recorded.append(result)
+        raise OSError("report file is read-only")
+
+    pipe = Pipeline(download_workers=1, upload_workers=1, prefetch=1)
+    results = run_with_timeout(lambda: pipe.run(entries, on_result))
+
+    assert [result.entry for result in results] == entries
+    assert all(result.status == "ok" for result in results)
+    assert all(result.url == "folder/index.html" for result in results)
+    assert len(recorded) == len(entries)
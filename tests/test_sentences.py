@@ -0,0 +1,78 @@
+"""Sentence ends found by spaCy, mapped back to transcript segments"""
+
+import pytest
+
+pytest.importorskip("spacy")
+
+from unchecked_transcript.sentences import (  # noqa: E402
+    _documents,
+    spacy_sentence_ends,
+)
+
+
+def ends(texts, per_doc=256):
+    return spacy_sentence_ends(texts, per_doc=per_doc).tolist()
+
+
+def test_documents_record_where_each_segment_ends():
+    documents = list(_documents([" It was ", "late.", "We left."], 2))
+
+    assert documents == [
+        ("It was late.", 0, [6, 12]),
+        ("We left.", 2, [8]),
+    ]
+
+
+def test_sentences_ending_with_a_segment():
+    texts = ["Hello there.", "How are", "you today?", "Fine."]
+
+    assert ends(texts) == [0, 2, 3]
+
+
+@pytest.mark.parametrize(
+    "texts, expected",
+    [
+        # "it." is 3 characters into a 20 character segment
+        (["This is", "it. And then we went", "home."], [0, 2]),
+        # "shop." is 5 characters from the end of its segment
+        (["We went to the shop. Then", "home."], [0, 1]),
+    ],
+)
+def test_sentences_ending_inside_a_segment_move_to_its_nearer_end(
+    texts, expected
+):
+    assert ends(texts) == expected
+
+
+def test_sentence_ending_early_in_a_document_ends_the_previous_one():
+    # The second document starts "left. Then": the sentence ends closer to
+    # the start of its first segment, which is the end of segment 1
+    texts = ["It was late", "and so we", "left. Then we", "slept."]
+
+    assert ends(texts, per_doc=2) == [1, 3]
+    assert ends(texts) == [1, 3]
+
+
+def test_sentence_ending_early_in_the_first_segment_is_dropped():
+    assert ends(["Yes. And so it", "ends."]) == [1]
+
+
+def test_document_cut_after_sentence_punctuation_ends_a_sentence():
+    texts = ["It was late.", "We left.", "Then we", "slept."]
+
+    assert ends(texts, per_doc=2) == [0, 1, 3]
+
+
+def test_document_cut_inside_a_sentence_does_not_end_it():
+    texts = ["It was late.", "We left and", "then we", "slept."]
+
+    assert ends(texts, per_doc=2) == [0, 3]
+    assert ends(texts) == [0, 3]
+
+
+def test_last_document_ends_a_sentence_without_punctuation():
+    assert ends(["It was late.", "We left"], per_doc=1) == [0, 1]
+
+
+def test_no_segments():
+    assert ends([]) == []
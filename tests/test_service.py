@@ -0,0 +1,261 @@
+"""The SQLite job queue, the service's workers, and its HTTP API"""
+
+import http.client
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from unchecked_transcript import service
+from unchecked_transcript.batch import BatchResult
+from unchecked_transcript.service import (
+    JobQueue,
+    ServiceServer,
+    TranscriptionService,
+)
+
+ENTRY = {"type": "youtube", "url": "https://www.youtube.com/watch?v=abc"}
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    job_queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    yield job_queue
+    job_queue.close()
+
+
+def _result(entry, status="ok", url=None, error=None):
+    result = BatchResult(entry)
+    result.status = status
+    result.url = url
+    result.error = error
+    return result
+
+
+def test_claim_takes_oldest_queued_job(job_queue):
+    first = job_queue.submit(ENTRY)
+    second = job_queue.submit({**ENTRY, "title": "Second"})
+
+    job = job_queue.claim()
+    assert job["id"] == first
+    assert job["status"] == "running"
+    assert job["entry"] == ENTRY
+    assert job_queue.claim()["id"] == second
+    assert job_queue.claim() is None
+    assert job_queue.counts()["running"] == 2
+
+
+def test_submit_rejects_incomplete_entry(job_queue):
+    with pytest.raises(ValueError):
+        job_queue.submit({"type": "youtube"})
+    assert job_queue.jobs() == []
+
+
+def test_complete_records_result(job_queue):
+    job_id = job_queue.submit(ENTRY)
+    job_queue.claim()
+    job_queue.complete(job_id, _result(ENTRY, url="https://example/page"))
+
+    job = job_queue.get(job_id)
+    assert job["status"] == "ok"
+    assert job["url"] == "https://example/page"
+    assert job["finished"] is not None
+    assert job_queue.jobs(status="ok")[0]["id"] == job_id
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_requeue_abandoned_only_requeues_dead_claims(job_queue):
+    dead = job_queue.submit(ENTRY)
+    alive = job_queue.submit(ENTRY)
+    elsewhere = job_queue.submit(ENTRY)
+    for _ in range(3):
+        job_queue.claim()
+    host = socket.gethostname()
+    connection = sqlite3.connect(job_queue.path)
+    with connection:
+        for job_id, claimed_by in (
+            (dead, f"{host}:{_dead_pid()}"),
+            (elsewhere, f"another-{host}:1"),
+        ):
+            connection.execute(
+                "UPDATE jobs SET claimed_by = ? WHERE id = ?",
+                (claimed_by, job_id),
+            )
+    connection.close()
+
+    assert job_queue.requeue_abandoned() == 1
+    assert job_queue.get(dead)["status"] == "queued"
+    assert job_queue.get(alive)["status"] == "running"
+    assert job_queue.get(elsewhere)["status"] == "running"
+    assert job_queue.claim()["id"] == dead
+
+
+def test_requeue_abandoned_requeues_an_earlier_run_with_this_pid(job_queue):
+    earlier = job_queue.submit(ENTRY)
+    before_run_ids = job_queue.submit(ENTRY)
+    current = job_queue.submit(ENTRY)
+    for _ in range(3):
+        job_queue.claim()
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    connection = sqlite3.connect(job_queue.path)
+    with connection:
+        for job_id, claimed_by in (
+            (earlier, f"{worker}:an-earlier-run"),
+            (before_run_ids, worker),
+        ):
+            connection.execute(
+                "UPDATE jobs SET claimed_by = ? WHERE id = ?",
+                (claimed_by, job_id),
+            )
+    connection.close()
+
+    assert job_queue.requeue_abandoned() == 2
+    assert job_queue.get(earlier)["status"] == "queued"
+    assert job_queue.get(before_run_ids)["status"] == "queued"
+    assert job_queue.get(current)["status"] == "running"
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _run_worker(transcription_service):
+    thread = threading.Thread(target=transcription_service._work, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_worker_survives_failing_job(job_queue, monkeypatch):
+    def process_entry(entry, stdout=False):
+        if entry.get("title") == "bad":
+            raise OSError("disk full")
+        return _result(entry)
+
+    monkeypatch.setattr(service, "process_entry", process_entry)
+    bad = job_queue.submit({**ENTRY, "title": "bad"})
+    good = job_queue.submit(ENTRY)
+    transcription_service = TranscriptionService(job_queue, poll_seconds=0.01)
+    thread = _run_worker(transcription_service)
+
+    _wait_for(lambda: job_queue.get(good)["status"] == "ok")
+    transcription_service.stop()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert job_queue.get(bad)["status"] == "error"
+    assert job_queue.get(bad)["error"] == "OSError: disk full"
+
+
+def test_worker_survives_failing_complete(job_queue, monkeypatch):
+    monkeypatch.setattr(
+        service, "process_entry", lambda entry, stdout=False: _result(entry)
+    )
+    complete = job_queue.complete
+    calls = []
+
+    def flaky_complete(job_id, result):
+        calls.append(result.status)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        complete(job_id, result)
+
+    monkeypatch.setattr(job_queue, "complete", flaky_complete)
+    first = job_queue.submit(ENTRY)
+    second = job_queue.submit(ENTRY)
+    transcription_service = TranscriptionService(job_queue, poll_seconds=0.01)
+    thread = _run_worker(transcription_service)
+
+    _wait_for(lambda: job_queue.get(second)["status"] == "ok")
+    transcription_service.stop()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    # The job whose result could not be stored is marked failed instead
+    assert calls[:2] == ["ok", "error"]
+    assert job_queue.get(first)["status"] == "error"
+    assert "database is locked" in job_queue.get(first)["error"]
+
+
+@pytest.fixture
+def api(job_queue):
+    transcription_service = TranscriptionService(job_queue)
+    server = ServiceServer(("127.0.0.1", 0), transcription_service)
+    thread = threading.Thread(
+        target=server.serve_forever,
+        kwargs={"poll_interval": 0.01},
+        daemon=True,
+    )
+    thread.start()
+
+    def request(method, path, body=None):
+        connection = http.client.HTTPConnection(*server.server_address)
+        payload = body if isinstance(body, bytes) else json.dumps(body)
+        if body is None:
+            payload = None
+        connection.request(method, path, body=payload)
+        response = connection.getresponse()
+        result = response.status, json.loads(response.read())
+        connection.close()
+        return result
+
+    yield request
+    server.shutdown()
+    server.server_close()
+
+
+def test_post_job_queues_it(api, job_queue):
+    status, body = api("POST", "/jobs", ENTRY)
+
+    assert status == 202
+    assert body["status"] == "queued"
+    assert body["href"] == f"/jobs/{body['id']}"
+    assert job_queue.get(body["id"])["entry"] == ENTRY
+
+
+@pytest.mark.parametrize(
+    "body", [{"type": "youtube"}, [ENTRY], b"not json", {"type": "vinyl"}]
+)
+def test_post_bad_job_is_rejected(api, job_queue, body):
+    status, response = api("POST", "/jobs", body)
+
+    assert status == 400
+    assert "error" in response
+    assert job_queue.jobs() == []
+
+
+def test_get_jobs(api, job_queue):
+    job_id = job_queue.submit(ENTRY)
+    job_queue.submit(ENTRY)
+
+    assert api("GET", f"/jobs/{job_id}") == (200, job_queue.get(job_id))
+    status, jobs = api("GET", "/jobs?status=queued&limit=1")
+    assert status == 200
+    assert [job["id"] for job in jobs] == [job_id + 1]
+    assert api("GET", "/jobs?limit=many")[0] == 400
+    assert api("GET", "/jobs/999")[0] == 404
+
+
+def test_health_counts_jobs(api, job_queue):
+    job_queue.submit(ENTRY)
+
+    status, body = api("GET", "/health")
+    assert status == 200
+    assert body["status"] == "ok"
+    assert body["jobs"]["queued"] == 1
+
+
+def test_unknown_paths(api):
+    assert api("GET", "/nothing")[0] == 404
+    assert api("POST", "/health", ENTRY)[0] == 404
@@ -0,0 +1,119 @@
+"""Search terms shared by the sidecar index and the page's search box"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import unicodedata
+
+import pytest
+
+from unchecked_transcript.sidecar import build_sidecar, terms
+
+TEMPLATE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "unchecked_transcript",
+    "templates",
+    "youtube_shell.html.j2",
+)
+
+SAMPLES = [
+    "Hello, World!",
+    "café crème",
+    unicodedata.normalize("NFD", "café crème"),
+    "naïve co-operation_2024",
+    "Ünïcödé ÅNGSTRÖM",
+    "नमस्ते दुनिया",
+    "東京タワー 123",
+    "the theme of theory",
+]
+
+
+def test_terms_are_normalized_to_nfc():
+    assert terms(unicodedata.normalize("NFD", "Café")) == ["café"]
+
+
+def test_combining_marks_split_terms_like_python_word_characters():
+    # NFC composes a + U+0301 into one letter; U+20DD has no composed form
+    assert terms("a\u0301b") == ["\u00e1b"]
+    assert terms("x\u20dd y") == ["x", "y"]
+
+
+def test_sidecar_text_is_normalized_to_nfc():
+    document = build_sidecar(
+        [{"text": unicodedata.normalize("NFD", "café"), "start_display": ""}],
+        [0.0],
+    )
+
+    assert document["text"] == ["café"]
+    assert document["terms"] == ["café"]
+
+
+def page_function(source, name):
+    match = re.search(
+        rf"^    function {name}\(.*?^    }};$", source, re.M | re.S
+    )
+    return match.group(0)
+
+
+@pytest.fixture(scope="module")
+def page_search():
+    """Run the page's term and highlight functions under Node
+
+    :return: a function taking JavaScript that uses ``terms`` and
+        ``highlighter``, and returning what it prints as JSON
+    :rtype: Callable[[str], object]
+    """
+    if shutil.which("node") is None:
+        pytest.skip("Node is not installed")
+    with open(TEMPLATE, encoding="utf-8") as file:
+        source = file.read()
+    word = re.search(r"^    var WORD = .*$", source, re.M).group(0)
+    term = re.search(r"^    var TERM = .*$", source, re.M).group(0)
+    functions = "\n".join(
+        page_function(source, name)
+        for name in ("terms", "escapeRegExp", "highlighter")
+    )
+
+    def run(script):
+        result = subprocess.run(
+            ["node", "-e", "\n".join([word, term, functions, script])],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        return json.loads(result.stdout)
+
+    return run
+
+
+def test_page_splits_terms_like_the_index(page_search):
+    page_terms = page_search(
+        f"console.log(JSON.stringify({json.dumps(SAMPLES)}.map(terms)))"
+    )
+
+    assert page_terms == [terms(sample) for sample in SAMPLES]
+
+
+def highlights(page_search, query, text):
+    return page_search(
+        f"console.log(JSON.stringify({json.dumps(text)}.match("
+        f"new RegExp(highlighter(terms({json.dumps(query)}))"
+        f".source, 'giu')) || []))"
+    )
+
+
+def test_highlights_whole_words_and_a_last_word_prefix(page_search):
+    assert highlights(page_search, "the th", "the theme of theory") == [
+        "the",
+        "th",
+        "th",
+    ]
+    assert highlights(page_search, "the x", "breathe the theme") == ["the"]
+
+
+def test_highlights_nfd_queries_in_nfc_text(page_search):
+    query = unicodedata.normalize("NFD", "café")
+
+    assert highlights(page_search, query + " x", "un café, cafés") == ["café"]
@@ -0,0 +1,77 @@
+"""Uploads to a moto stand-in for S3"""
+
+import pytest
+
+from unchecked_transcript.instrumentation import get_report
+from unchecked_transcript.upload_html import (
+    HASH_METADATA_KEY,
+    get_s3_client,
+    upload_html,
+    upload_sidecar,
+)
+
+moto = pytest.importorskip("moto")
+
+
+@pytest.fixture
+def s3(config):
+    with moto.mock_aws():
+        # The shared client has to be created inside the stand-in
+        get_s3_client.cache_clear()
+        client = get_s3_client()
+        client.create_bucket(Bucket=config.bucket)
+        yield client
+        get_s3_client.cache_clear()
+
+
+def _uploads(key):
+    return [
+        span.attributes
+        for span in get_report().spans
+        if span.name == "upload" and span.attributes.get("key") == key
+    ]
+
+
+def test_unchanged_page_is_not_uploaded_again(config, s3):
+    key = "fixed-slug/index.html"
+    upload_html("<p>one</p>", "fixed-slug")
+    first = s3.head_object(Bucket=config.bucket, Key=key)
+    upload_html("<p>one</p>", "fixed-slug")
+
+    uploads = _uploads(key)
+    assert not uploads[-2].get("skipped")
+    assert uploads[-1].get("skipped")
+    second = s3.head_object(Bucket=config.bucket, Key=key)
+    assert second["ETag"] == first["ETag"]
+    assert second["LastModified"] == first["LastModified"]
+
+
+def test_changed_page_is_uploaded(config, s3):
+    key = "changed/index.html"
+    upload_html("<p>one</p>", "changed")
+    upload_html("<p>two</p>", "changed")
+
+    assert not _uploads(key)[-1].get("skipped")
+    body = s3.get_object(Bucket=config.bucket, Key=key)["Body"].read()
+    assert body == b"<p>two</p>"
+
+
+def test_force_uploads_unchanged_page(config, s3):
+    upload_html("<p>one</p>", "forced")
+    upload_html(html_string="<p>one</p>", folder="forced", force=True)
+
+    assert not _uploads("forced/index.html")[-1].get("skipped")
+
+
+def test_unchanged_sidecar_is_not_uploaded_again(config, s3):
+    document = {"version": 1, "text": ["hello"]}
+    first = upload_sidecar(document, "sidecar")
+    second = upload_sidecar(document, "sidecar")
+
+    assert first == second
+    assert _uploads("sidecar/transcript.json")[-1].get("skipped")
+    stored = s3.head_object(
+        Bucket=config.bucket, Key="sidecar/transcript.json"
+    )
+    assert stored["Metadata"][HASH_METADATA_KEY] == first
+    assert stored["ContentEncoding"] == "gzip"
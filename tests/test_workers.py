@@ -0,0 +1,42 @@
+"""Worker processes sharing a model loaded in this process"""
+
+import gc
+import multiprocessing
+import os
+
+import pytest
+
+from unchecked_transcript.workers import WhisperWorkerPool
+
+pytestmark = pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="Sharing a model needs fork",
+)
+
+
+class ForkableBackend:
+    name = "fake"
+    identity = "fake:model"
+    forkable = True
+    model = object()
+
+    def limit_threads(self, threads):
+        self.threads = threads
+
+    def transcribe(self, audio, **options):
+        return {"text": f"{audio} in {os.getpid()}", "segments": []}
+
+
+def test_shared_model_workers_transcribe_in_other_processes():
+    with WhisperWorkerPool(ForkableBackend(), 2, share_model=True) as pool:
+        result = pool.transcribe("audio.mp3")
+
+    assert result["text"].startswith("audio.mp3 in ")
+    assert result["text"] != f"audio.mp3 in {os.getpid()}"
+
+
+def test_objects_are_collected_again_once_workers_have_forked():
+    frozen = gc.get_freeze_count()
+
+    with WhisperWorkerPool(ForkableBackend(), 1, share_model=True):
+        assert gc.get_freeze_count() == frozen
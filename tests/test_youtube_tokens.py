@@ -0,0 +1,120 @@
+"""Generating, caching, and renewing YouTube proof-of-origin tokens"""
+
+import subprocess
+import sys
+
+import pytest
+
+from unchecked_transcript import mediacontent
+from unchecked_transcript.youtube_tokens import (
+    NodeTokenGenerator,
+    StubTokenGenerator,
+    TokenError,
+    TokenProvider,
+)
+
+
+def helper_replying(reply):
+    """Start a stand-in for the Node helper that answers every request
+
+    :return: a generator already connected to the helper
+    :rtype: NodeTokenGenerator
+    """
+    generator = NodeTokenGenerator("helper.js")
+    generator._process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n"
+            "for _ in sys.stdin:\n"
+            f"    print({reply!r}, flush=True)\n",
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+    )
+    return generator
+
+
+@pytest.mark.parametrize(
+    "reply",
+    ["Debugger attached.", '{"visitorData": "v"}', "[1, 2]"],
+)
+def test_unexpected_helper_output_raises_token_error(reply):
+    generator = helper_replying(reply)
+    try:
+        with pytest.raises(TokenError, match="unexpected reply"):
+            generator.generate()
+    finally:
+        generator.close()
+
+
+def test_helper_error_raises_token_error():
+    generator = helper_replying('{"error": "no browser"}')
+    try:
+        with pytest.raises(TokenError, match="no browser"):
+            generator.generate()
+    finally:
+        generator.close()
+
+
+def test_helper_tokens_are_returned():
+    generator = helper_replying('{"visitorData": "v", "poToken": "p"}')
+    try:
+        assert generator.generate() == ("v", "p")
+    finally:
+        generator.close()
+
+
+class CountingGenerator(StubTokenGenerator):
+    def __init__(self):
+        super().__init__()
+        self.generated = 0
+
+    def generate(self):
+        self.generated += 1
+        return f"visitor-{self.generated}", f"token-{self.generated}"
+
+
+def test_provider_reuses_tokens_until_invalidated(tmp_path):
+    generator = CountingGenerator()
+    path = str(tmp_path / "tokens.json")
+    provider = TokenProvider(generator, path=path)
+
+    assert provider.tokens() == ("visitor-1", "token-1")
+    assert TokenProvider(generator, path=path).tokens()[1] == "token-1"
+    provider.invalidate()
+
+    assert provider.tokens() == ("visitor-2", "token-2")
+    assert generator.generated == 2
+
+
+def test_rejected_tokens_are_renewed_once(monkeypatch):
+    pytubefix = pytest.importorskip("pytubefix")
+    from pytubefix.exceptions import BotDetection
+
+    generator = CountingGenerator()
+    provider = TokenProvider(generator, path=None)
+    monkeypatch.setattr(mediacontent, "get_token_provider", lambda: provider)
+    rejected = []
+
+    class FakeYouTube:
+        def __init__(self, url, use_po_token, po_token_verifier):
+            self.tokens = po_token_verifier()
+
+        @property
+        def title(self):
+            if self.tokens[1] == "token-1":
+                rejected.append(self.tokens)
+                raise BotDetection("abcdefghijk")
+            return "A Video"
+
+    monkeypatch.setattr(pytubefix, "YouTube", FakeYouTube)
+    video = mediacontent.YouTubeVideo(
+        "https://www.youtube.com/watch?v=abcdefghijk"
+    )
+
+    assert video.title == "A Video"
+    assert rejected == [("visitor-1", "token-1")]
+    assert generator.generated == 2
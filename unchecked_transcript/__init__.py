@@ -1,13 +1,44 @@
+import functools
 import logging
 
-import boto3
-from omegaconf import OmegaConf
-
 log = logging.getLogger()
 log.setLevel(logging.DEBUG)
-config = OmegaConf.load("config.yml")
-aws_session = boto3.Session(
-    aws_access_key_id=config.aws_access_key_id,
-    aws_secret_access_key=config.aws_secret_access_key,
-    region_name=config.region_name,
-)
+
+
+@functools.lru_cache(maxsize=None)
+def get_config():
+    """Load config.yml from the working directory, on first use
+
+    :return: the configuration
+    :rtype: omegaconf.DictConfig
+    """
+    from omegaconf import OmegaConf
+
+    return OmegaConf.load("config.yml")
+
+
+@functools.lru_cache(maxsize=None)
+def get_aws_session():
+    """Create the AWS session from the configured credentials, on first use
+
+    :return: the session
+    :rtype: boto3.Session
+    """
+    import boto3
+
+    config = get_config()
+    return boto3.Session(
+        aws_access_key_id=config.aws_access_key_id,
+        aws_secret_access_key=config.aws_secret_access_key,
+        region_name=config.region_name,
+    )
+
+
+def __getattr__(name: str):
+    # Keep ``from unchecked_transcript import config, aws_session`` working
+    # without paying for them at import time
+    if name == "config":
+        return get_config()
+    if name == "aws_session":
+        return get_aws_session()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,269 @@
+"""Speech-to-text backends that produce Whisper-shaped results"""
+
+import functools
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Type
+
+from . import get_config
+from .instrumentation import span
+
+log = logging.getLogger()
+
+COMPUTE_TYPES = ["float32", "float16", "int8"]
+
+
+class TranscriptionBackend(ABC):
+    """A speech-to-text engine
+
+    Every backend returns the result shape of openai-whisper's
+    ``transcribe``: a dictionary with "text", "segments", and "language"
+    keys, where each segment has at least "id", "start", "end", and "text".
+    The model is loaded on first use and kept for the life of the backend.
+    """
+
+    name: str = None
+    # Whether worker processes forked after the model is loaded can use it
+    forkable: bool = False
+    model_name: str
+    compute_type: str
+    beam_size: Optional[int]
+    threads: Optional[int]
+    _model = None
+
+    def __init__(
+        self,
+        model_name: str = "base",
+        compute_type: str = "float32",
+        beam_size: Optional[int] = None,
+        threads: Optional[int] = None,
+    ) -> None:
+        if compute_type not in COMPUTE_TYPES:
+            raise ValueError(f"Unknown compute type {compute_type}")
+        self.model_name = model_name
+        self.compute_type = compute_type
+        self.beam_size = beam_size
+        self.threads = threads
+
+    @property
+    def settings(self) -> Dict[str, object]:
+        """The constructor arguments, for building a copy in another process
+
+        :return: keyword arguments for the backend's constructor
+        :rtype: Dict[str, object]
+        """
+        return {
+            "model_name": self.model_name,
+            "compute_type": self.compute_type,
+            "beam_size": self.beam_size,
+            "threads": self.threads,
+        }
+
+    @property
+    def identity(self) -> str:
+        """A string identifying everything that affects the output
+
+        :return: backend, model, compute type, and beam size
+        :rtype: str
+        """
+        return (
+            f"{self.name}:{self.model_name}:{self.compute_type}"
+            f":beam={self.beam_size}"
+        )
+
+    @property
+    def model(self):
+        """The loaded model, loading it on first use
+
+        :return: the backend's model object
+        """
+        if self._model is None:
+            with span("model_load", backend=self.identity):
+                self._model = self.load()
+        return self._model
+
+    @abstractmethod
+    def load(self):
+        """Load the model
+
+        :return: the backend's model object
+        """
+
+    def limit_threads(self, threads: int) -> None:
+        """Limit the threads used by an already loaded model
+
+        Used by forked workers, which inherit the model instead of loading
+        it with their own thread count.
+
+        :param threads: threads for inference
+        :type threads: int
+        """
+        self.threads = threads
+
+    @abstractmethod
+    def transcribe(self, audio, **options) -> dict:
+        """Transcribe audio
+
+        :param audio: path to an audio file, or a 16 kHz mono waveform
+        :type audio: str or numpy.ndarray
+        :return: the result, with "text", "segments", and "language" keys
+        :rtype: dict
+        """
+
+
+class WhisperBackend(TranscriptionBackend):
+    """OpenAI's reference Whisper implementation on PyTorch"""
+
+    name = "whisper"
+    forkable = True
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if self.compute_type == "int8":
+            raise ValueError(
+                "The whisper backend does not support int8; "
+                "use the faster-whisper backend"
+            )
+
+    def load(self):
+        import torch
+        import whisper
+
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        model = whisper.load_model(self.model_name)
+        # Inference only: without autograd state the weights are never
+        # written to, so forked workers keep sharing their pages
+        model.eval()
+        model.requires_grad_(False)
+        return model
+
+    def limit_threads(self, threads: int) -> None:
+        import torch
+
+        super().limit_threads(threads)
+        torch.set_num_threads(threads)
+
+    def transcribe(self, audio, **options) -> dict:
+        from .pcm_cache import load_pcm
+
+        if isinstance(audio, str):
+            audio = load_pcm(audio)
+        options.setdefault("fp16", self.compute_type == "float16")
+        if self.beam_size:
+            options.setdefault("beam_size", self.beam_size)
+        return self.model.transcribe(audio, **options)
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    """Whisper on CTranslate2, with int8 quantization on CPU
+
+    Requires the optional ``faster-whisper`` package.
+    """
+
+    name = "faster-whisper"
+    # CTranslate2's thread pool does not survive a fork
+    forkable = False
+
+    def load(self):
+        from faster_whisper import WhisperModel
+
+        return WhisperModel(
+            self.model_name,
+            device="cpu",
+            compute_type=self.compute_type,
+            cpu_threads=self.threads or 0,
+        )
+
+    def transcribe(self, audio, **options) -> dict:
+        from .pcm_cache import load_pcm
+
+        if isinstance(audio, str):
+            audio = load_pcm(audio)
+        options.pop("fp16", None)
+        options.setdefault("beam_size", self.beam_size or 5)
+        segments, info = self.model.transcribe(audio, **options)
+        result_segments = [
+            {
+                "id": index,
+                "seek": segment.seek,
+                "start": segment.start,
+                "end": segment.end,
+                "text": segment.text,
+                "tokens": list(segment.tokens),
+                "temperature": segment.temperature,
+                "avg_logprob": segment.avg_logprob,
+                "compression_ratio": segment.compression_ratio,
+                "no_speech_prob": segment.no_speech_prob,
+            }
+            for index, segment in enumerate(segments)
+        ]
+        return {
+            "text": "".join(segment["text"] for segment in result_segments),
+            "segments": result_segments,
+            "language": info.language,
+        }
+
+
+BACKENDS: Dict[str, Type[TranscriptionBackend]] = {
+    WhisperBackend.name: WhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+
+def create_backend(name: str, **settings) -> TranscriptionBackend:
+    """Create a backend by name
+
+    :param name: one of the keys of ``BACKENDS``
+    :type name: str
+    :return: the backend, with its model not yet loaded
+    :rtype: TranscriptionBackend
+    """
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError as error:
+        raise ValueError(f"Unknown transcription backend {name}") from error
+    return backend_class(**settings)
+
+
+def backend_settings(**overrides) -> Dict[str, object]:
+    """Get backend settings from config.yml, with overrides
+
+    The optional ``whisper_backend``, ``whisper_model``,
+    ``whisper_compute_type``, ``whisper_beam_size``, and ``whisper_threads``
+    keys are used; overrides that are None are ignored.
+
+    :return: a "name" key and the backend constructor's keyword arguments
+    :rtype: Dict[str, object]
+    """
+    config = get_config()
+    settings = {
+        "name": config.get("whisper_backend", WhisperBackend.name),
+        "model_name": config.get("whisper_model", "base"),
+        "compute_type": config.get("whisper_compute_type", "float32"),
+        "beam_size": config.get("whisper_beam_size", None),
+        "threads": config.get("whisper_threads", None),
+    }
+    settings.update(
+        {key: value for key, value in overrides.items() if value is not None}
+    )
+    return settings
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_backend(name: str, settings: tuple) -> TranscriptionBackend:
+    return create_backend(name, **dict(settings))
+
+
+def get_backend(name: str, **settings) -> TranscriptionBackend:
+    """Get a backend shared by everything in this process
+
+    Backends with the same settings are the same object, so a model is
+    only loaded once however many transcriptions use it.
+
+    :param name: one of the keys of ``BACKENDS``
+    :type name: str
+    :return: the shared backend
+    :rtype: TranscriptionBackend
+    """
+    return _shared_backend(name, tuple(sorted(settings.items())))
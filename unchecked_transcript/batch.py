@@ -0,0 +1,300 @@
+"""Process many media items in one run"""
+
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from unchecked_transcript.mediacontent import (
+    MediaContent,
+    PodcastEpisode,
+    YouTubeVideo,
+)
+from unchecked_transcript.transcription import Transcription
+from unchecked_transcript.upload_html import upload_transcription
+
+log = logging.getLogger()
+
+ManifestEntry = Dict[str, str]
+
+PODCAST_FIELDS = [
+    "audio_url",
+    "episode_title",
+    "episode_url",
+    "podcast_title",
+]
+
+
+class BatchResult:
+    """The outcome of processing one manifest entry"""
+
+    entry: ManifestEntry
+    status: str = "pending"
+    url: str = None
+    error: str = None
+    elapsed: float = 0.0
+
+    def __init__(self, entry: ManifestEntry) -> None:
+        self.entry = entry
+
+    @property
+    def ok(self) -> bool:
+        """Whether the entry was processed successfully
+
+        :return: True if the entry was processed
+        :rtype: bool
+        """
+        return self.status == "ok"
+
+    def as_dict(self) -> Dict[str, object]:
+        """Get the result as a JSON-serializable dictionary
+
+        :return: the result record
+        :rtype: Dict[str, object]
+        """
+        return {
+            "entry": self.entry,
+            "status": self.status,
+            "url": self.url,
+            "error": self.error,
+            "elapsed": round(self.elapsed, 3),
+        }
+
+
+def _detect_format(source: str) -> str:
+    lowered = source.lower()
+    if lowered.startswith(("http://", "https://")):
+        return "rss"
+    if lowered.endswith(".csv"):
+        return "csv"
+    if lowered.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if lowered.endswith((".rss", ".xml")):
+        return "rss"
+    raise ValueError(f"Cannot determine manifest format of {source}")
+
+
+def _read_csv(path: str) -> Iterator[ManifestEntry]:
+    with open(path, newline="", encoding="utf-8") as csv_file:
+        for row in csv.DictReader(csv_file):
+            yield {key: value for key, value in row.items() if value}
+
+
+def _read_jsonl(path: str) -> Iterator[ManifestEntry]:
+    with open(path, encoding="utf-8") as jsonl_file:
+        for line in jsonl_file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _read_rss(
+    source: str, podcast_title: Optional[str] = None
+) -> Iterator[ManifestEntry]:
+    from unchecked_transcript.feeds import CHUNK_SIZE, TIMEOUT, parse_feed
+    from unchecked_transcript.media_cache import get_session
+
+    try:
+        if source.lower().startswith(("http://", "https://")):
+            with get_session().get(
+                source, stream=True, timeout=TIMEOUT
+            ) as response:
+                response.raise_for_status()
+                chunks = response.iter_content(CHUNK_SIZE)
+                entries = list(parse_feed(chunks, podcast_title))
+        else:
+            with open(source, "rb") as file:
+                chunks = iter(lambda: file.read(CHUNK_SIZE), b"")
+                entries = list(parse_feed(chunks, podcast_title))
+    except ValueError as error:
+        raise ValueError(f"{source} is not an RSS feed") from error
+    for entry in entries:
+        del entry["guid"]
+        yield entry
+
+
+def read_manifest(
+    source: str,
+    source_format: str = "auto",
+    podcast_title: Optional[str] = None,
+) -> List[ManifestEntry]:
+    """Read the items to process from a manifest or RSS feed
+
+    CSV and JSONL manifests have one entry per row/line. A ``type`` of
+    ``podcast`` takes the ``PodcastEpisode`` parameters (``audio_url``,
+    ``episode_title``, ``episode_url``, ``podcast_title``); a ``type`` of
+    ``youtube`` takes ``url`` and the optional ``title`` and ``channel``
+    overrides. Either may set ``slug`` to publish to a fixed folder. RSS
+    feeds produce one podcast entry per item enclosure.
+
+    :param source: path to a manifest file, or path/URL of an RSS feed
+    :type source: str
+    :param source_format: one of "auto", "csv", "jsonl", or "rss"
+    :type source_format: str, optional
+    :param podcast_title: override the podcast title of RSS feed entries
+    :type podcast_title: str, optional
+    :return: manifest entries
+    :rtype: List[ManifestEntry]
+    """
+    if source_format == "auto":
+        source_format = _detect_format(source)
+    if source_format == "csv":
+        entries = _read_csv(source)
+    elif source_format == "jsonl":
+        entries = _read_jsonl(source)
+    elif source_format == "rss":
+        entries = _read_rss(source, podcast_title=podcast_title)
+    else:
+        raise ValueError(f"Unknown manifest format {source_format}")
+    return list(entries)
+
+
+def validate_entry(entry: ManifestEntry) -> None:
+    """Check that a manifest entry has the fields its type needs
+
+    :param entry: the manifest entry
+    :type entry: ManifestEntry
+    :raises ValueError: if the type is unknown or a field is missing
+    """
+    entry_type = entry.get("type", "podcast")
+    if entry_type == "podcast":
+        missing = [field for field in PODCAST_FIELDS if not entry.get(field)]
+        if missing:
+            raise ValueError(f"Podcast entry missing {', '.join(missing)}")
+    elif entry_type == "youtube":
+        if not entry.get("url"):
+            raise ValueError("YouTube entry missing url")
+    else:
+        raise ValueError(f"Unknown entry type {entry_type}")
+
+
+def make_media_content(entry: ManifestEntry) -> MediaContent:
+    """Construct the MediaContent described by a manifest entry
+
+    :param entry: the manifest entry
+    :type entry: ManifestEntry
+    :return: the podcast episode or YouTube video
+    :rtype: MediaContent
+    """
+    validate_entry(entry)
+    if entry.get("type", "podcast") == "podcast":
+        media_content = PodcastEpisode(
+            **{field: entry[field] for field in PODCAST_FIELDS}
+        )
+    else:
+        media_content = YouTubeVideo(
+            source_url=entry["url"],
+            title=entry.get("title"),
+            creator=entry.get("channel"),
+        )
+    if entry.get("slug"):
+        media_content.slug = entry["slug"]
+    return media_content
+
+
+def process_entry(entry: ManifestEntry, stdout: bool = False) -> BatchResult:
+    """Download, transcribe, render, and upload one manifest entry
+
+    Errors are recorded on the result rather than raised so that one bad
+    entry does not stop the rest of the batch.
+
+    :param entry: the manifest entry
+    :type entry: ManifestEntry
+    :param stdout: print the HTML instead of uploading it to S3
+    :type stdout: bool, optional
+    :return: the outcome of processing the entry
+    :rtype: BatchResult
+    """
+    result = BatchResult(entry)
+    started = time.perf_counter()
+    media_content = None
+    try:
+        media_content = make_media_content(entry)
+        transcription = Transcription(media_content)
+        if stdout:
+            sys.stdout.writelines(transcription.html_chunks())
+            print()
+        else:
+            result.url = upload_transcription(
+                transcription, folder=media_content.s3_path
+            )
+        result.status = "ok"
+    except Exception as error:  # pylint: disable=broad-except
+        log.exception("Failed to process %s", entry)
+        result.status = "error"
+        result.error = f"{type(error).__name__}: {error}"
+    finally:
+        if media_content is not None:
+            media_content.discard_audio_file()
+        result.elapsed = time.perf_counter() - started
+    return result
+
+
+def run_batch(
+    entries: List[ManifestEntry],
+    stdout: bool = False,
+    report_path: Optional[str] = None,
+    pipeline_workers: int = 0,
+    prefetch: int = 2,
+) -> List[BatchResult]:
+    """Process manifest entries in this process
+
+    The Whisper model is loaded on the first transcription and stays
+    resident for the rest of the batch. By default entries are processed
+    one after another; with ``pipeline_workers`` set, downloads and uploads
+    overlap transcription (see ``pipeline.Pipeline``).
+
+    :param entries: manifest entries to process
+    :type entries: List[ManifestEntry]
+    :param stdout: print the HTML instead of uploading it to S3
+    :type stdout: bool, optional
+    :param report_path: file to append per-item JSON line results to
+    :type report_path: str, optional
+    :param pipeline_workers: download and upload threads per stage; 0 to
+        process entries serially, defaults to 0
+    :type pipeline_workers: int, optional
+    :param prefetch: downloaded items allowed to wait for transcription,
+        defaults to 2
+    :type prefetch: int, optional
+    :return: the result of each entry, in manifest order
+    :rtype: List[BatchResult]
+    """
+    report_file = None
+    report_lock = threading.Lock()
+    if report_path:
+        os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+        report_file = open(report_path, "a", encoding="utf-8")
+
+    def record(result: BatchResult) -> None:
+        if report_file is not None:
+            with report_lock:
+                report_file.write(json.dumps(result.as_dict()) + "\n")
+                report_file.flush()
+
+    try:
+        if pipeline_workers:
+            # The pipeline module imports from this one
+            from unchecked_transcript.pipeline import Pipeline
+
+            pipeline = Pipeline(
+                download_workers=pipeline_workers,
+                upload_workers=pipeline_workers,
+                prefetch=prefetch,
+                stdout=stdout,
+            )
+            return pipeline.run(entries, on_result=record)
+
+        results = []
+        for index, entry in enumerate(entries, start=1):
+            log.info("Processing item %d of %d", index, len(entries))
+            result = process_entry(entry, stdout=stdout)
+            results.append(result)
+            record(result)
+        return results
+    finally:
+        if report_file is not None:
+            report_file.close()
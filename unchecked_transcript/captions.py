@@ -0,0 +1,195 @@
+"""Caption tracks, parsed once and stored column by column"""
+
+import hashlib
+import json
+import logging
+import time
+from array import array
+from typing import Dict, Iterator, List, Optional, Union
+
+from . import get_config
+from .result_cache import get_result_cache
+
+log = logging.getLogger()
+
+DEFAULT_MAX_AGE_DAYS = 7
+
+CaptionEntry = Dict[str, Union[float, str]]
+
+
+def srt_seconds(time_str: str) -> float:
+    """Convert an SRT time (hh:mm:ss,ms) to seconds
+
+    :param time_str: time in the format "hh:mm:ss,ms", e.g. "00:00:10,160"
+    :type time_str: str
+    :return: the time in seconds, e.g. 10.16
+    :rtype: float
+    """
+    hours, minutes, seconds_ms = time_str.split(":")
+    seconds, milliseconds = seconds_ms.split(",")
+    return (
+        int(hours) * 3600
+        + int(minutes) * 60
+        + int(seconds)
+        + int(milliseconds) / 1000.0
+    )
+
+
+class CaptionTrack:
+    """The cues of a caption track as parallel columns
+
+    Start and end times are kept in ``array('d')`` columns and the cue
+    text in a list, which is smaller than a dictionary per cue and cheap
+    to store. Iterating or indexing the track still yields the
+    ``{"start", "end", "text"}`` dictionaries that Whisper segments use, so
+    a track can stand in for a segment list.
+    """
+
+    starts: array
+    ends: array
+    texts: List[str]
+
+    def __init__(
+        self,
+        starts: array = None,
+        ends: array = None,
+        texts: List[str] = None,
+    ) -> None:
+        self.starts = starts if starts is not None else array("d")
+        self.ends = ends if ends is not None else array("d")
+        self.texts = texts if texts is not None else []
+
+    @classmethod
+    def from_srt(cls, srt_content: str) -> "CaptionTrack":
+        """Parse an SRT (SubRip) document
+
+        Blocks without an index line, a timecode line, and at least one
+        line of text are skipped; multi-line text is joined with spaces.
+
+        :param srt_content: the SRT document
+        :type srt_content: str
+        :return: the parsed track
+        :rtype: CaptionTrack
+        """
+        track = cls()
+        for block in srt_content.strip().split("\n\n"):
+            lines = block.split("\n")
+            if len(lines) < 3:
+                continue
+            _, timecode, *text = lines
+            start_str, end_str = map(str.strip, timecode.split("-->"))
+            track.starts.append(srt_seconds(start_str))
+            track.ends.append(srt_seconds(end_str))
+            track.texts.append(" ".join(text).strip())
+        return track
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CaptionTrack":
+        """Rebuild a track saved with ``as_dict``
+
+        :param data: dictionary with "starts", "ends", and "texts" lists
+        :type data: dict
+        :return: the track
+        :rtype: CaptionTrack
+        """
+        return cls(
+            array("d", data["starts"]),
+            array("d", data["ends"]),
+            list(data["texts"]),
+        )
+
+    def as_dict(self) -> Dict[str, list]:
+        """Get the track as a JSON-serializable dictionary of columns
+
+        :return: dictionary with "starts", "ends", and "texts" lists
+        :rtype: Dict[str, list]
+        """
+        return {
+            "starts": self.starts.tolist(),
+            "ends": self.ends.tolist(),
+            "texts": self.texts,
+        }
+
+    @property
+    def text(self) -> str:
+        """The cue text, one cue per line
+
+        :return: plaintext captions
+        :rtype: str
+        """
+        return "\n".join(self.texts)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __getitem__(self, index: int) -> CaptionEntry:
+        return {
+            "start": self.starts[index],
+            "end": self.ends[index],
+            "text": self.texts[index],
+        }
+
+    def __iter__(self) -> Iterator[CaptionEntry]:
+        for start, end, text in zip(self.starts, self.ends, self.texts):
+            yield {"start": start, "end": end, "text": text}
+
+
+def caption_key(video_id: str, language: str) -> str:
+    """Build the cache key for a video's caption track
+
+    :param video_id: YouTube video ID
+    :type video_id: str
+    :param language: caption language code, e.g. "en-US"
+    :type language: str
+    :return: cache key
+    :rtype: str
+    """
+    material = json.dumps(["youtube-captions", video_id, language])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def load_cached_track(video_id: str, language: str) -> Optional[CaptionTrack]:
+    """Get a caption track from the result cache
+
+    Tracks older than ``caption_cache_max_age_days`` in config.yml
+    (default 7) are ignored, since YouTube revises automatic captions.
+
+    :param video_id: YouTube video ID
+    :type video_id: str
+    :param language: caption language code
+    :type language: str
+    :return: the track, or None if it is not cached or too old
+    :rtype: CaptionTrack, optional
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return None
+    entry = cache.get(caption_key(video_id, language))
+    if entry is None:
+        return None
+    max_age_days = get_config().get(
+        "caption_cache_max_age_days", DEFAULT_MAX_AGE_DAYS
+    )
+    if time.time() - entry.get("fetched", 0) > max_age_days * 86400:
+        log.debug("Cached %s captions for %s are stale", language, video_id)
+        return None
+    return CaptionTrack.from_dict(entry)
+
+
+def store_track(video_id: str, language: str, track: CaptionTrack) -> None:
+    """Save a caption track in the result cache, if it is turned on
+
+    :param video_id: YouTube video ID
+    :type video_id: str
+    :param language: caption language code
+    :type language: str
+    :param track: the parsed track
+    :type track: CaptionTrack
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return
+    cache.put(
+        caption_key(video_id, language),
+        {"fetched": time.time(), **track.as_dict()},
+    )
@@ -0,0 +1,208 @@
+"""Transcribe one long audio file as parallel, overlapping chunks"""
+
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+from whisper.audio import HOP_LENGTH, SAMPLE_RATE
+
+from unchecked_transcript.pcm_cache import load_pcm
+
+log = logging.getLogger()
+
+# Length of the frames compared when looking for the quietest cut point
+FRAME_SECONDS = 0.5
+
+
+def _frame_energy(audio: np.ndarray, start: int, end: int) -> np.ndarray:
+    frame = int(FRAME_SECONDS * SAMPLE_RATE)
+    window = audio[start:end]
+    frames = len(window) // frame
+    if frames == 0:
+        return np.zeros(1, dtype=np.float32)
+    window = window[: frames * frame].reshape(frames, frame)
+    return np.sqrt(np.mean(np.square(window), axis=1))
+
+
+def find_chunks(
+    audio: np.ndarray,
+    chunk_seconds: float = 600.0,
+    overlap_seconds: float = 5.0,
+    search_seconds: float = 30.0,
+) -> List[Tuple[int, int, int]]:
+    """Split a waveform into chunks that start at quiet points
+
+    Each nominal boundary, every ``chunk_seconds``, is moved to the
+    quietest frame within ``search_seconds`` of it so that cuts fall
+    between words. Chunks run ``overlap_seconds`` past the next cut to give
+    Whisper the context to finish the words at the end of the chunk.
+
+    :param audio: 16 kHz mono waveform
+    :type audio: np.ndarray
+    :param chunk_seconds: nominal chunk length, defaults to 600.0
+    :type chunk_seconds: float, optional
+    :param overlap_seconds: audio shared by adjacent chunks, defaults to 5.0
+    :type overlap_seconds: float, optional
+    :param search_seconds: how far a cut may move, defaults to 30.0
+    :type search_seconds: float, optional
+    :return: (start, cut, end) sample offsets for each chunk; the chunk owns
+        the segments that start before ``cut``
+    :rtype: List[Tuple[int, int, int]]
+    """
+    total = len(audio)
+    step = int(chunk_seconds * SAMPLE_RATE)
+    search = int(search_seconds * SAMPLE_RATE)
+    frame = int(FRAME_SECONDS * SAMPLE_RATE)
+
+    cuts = [0]
+    nominal = step
+    while nominal < total - search:
+        low = max(cuts[-1] + frame, nominal - search)
+        high = min(total, nominal + search)
+        energy = _frame_energy(audio, low, high)
+        cuts.append(low + int(np.argmin(energy)) * frame)
+        nominal = cuts[-1] + step
+    cuts.append(total)
+
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    return [
+        (start, cut, min(total, cut + overlap))
+        for start, cut in zip(cuts[:-1], cuts[1:])
+    ]
+
+
+def _words(text: str) -> List[str]:
+    return re.sub(r"[^\w\s']", "", text.lower()).split()
+
+
+def _dedupe_overlap(previous_text: str, text: str) -> str:
+    """Drop leading words of ``text`` that repeat the end of the previous"""
+    previous_words = _words(previous_text)
+    words = text.split()
+    for length in range(min(len(previous_words), len(words)), 1, -1):
+        if previous_words[-length:] == _words(" ".join(words[:length])):
+            return " " + " ".join(words[length:]) if words[length:] else ""
+    return text
+
+
+def stitch_results(
+    results: List[dict], chunks: List[Tuple[int, int, int]]
+) -> dict:
+    """Combine per-chunk Whisper results into one result for the whole file
+
+    Segment times are moved from chunk time to file time, segments that
+    start in a chunk's overlap are left to the next chunk, and words
+    repeated across a cut are removed.
+
+    :param results: Whisper result for each chunk
+    :type results: List[dict]
+    :param chunks: the (start, cut, end) sample offsets of each chunk
+    :type chunks: List[Tuple[int, int, int]]
+    :return: a Whisper result with "text", "segments", and "language" keys
+    :rtype: dict
+    """
+    segments = []
+    for result, (start, cut, _) in zip(results, chunks):
+        offset = start / SAMPLE_RATE
+        boundary = cut / SAMPLE_RATE
+        for segment in result["segments"]:
+            segment = dict(segment)
+            segment["start"] += offset
+            segment["end"] += offset
+            if segment["start"] >= boundary:
+                continue
+            if segments and segment["start"] < segments[-1]["end"]:
+                segment["text"] = _dedupe_overlap(
+                    segments[-1]["text"], segment["text"]
+                )
+                if not segment["text"].strip():
+                    continue
+            segment["seek"] = segment.get("seek", 0) + start // HOP_LENGTH
+            segment["id"] = len(segments)
+            segments.append(segment)
+
+    return {
+        "text": "".join(segment["text"] for segment in segments),
+        "segments": segments,
+        "language": results[0].get("language", "en") if results else "en",
+    }
+
+
+class ChunkedTranscriber:
+    """Transcription engine that splits long files into parallel chunks
+
+    Wraps another engine: each file is cut at quiet points into chunks that
+    are transcribed at the same time, up to the wrapped engine's
+    concurrency, and the results are stitched back into the segment shape
+    of a single Whisper call. Wrap a ``WhisperWorkerPool`` to get a speedup
+    roughly equal to its number of processes.
+    """
+
+    chunk_seconds: float
+    overlap_seconds: float
+
+    def __init__(
+        self,
+        engine,
+        chunk_seconds: float = 600.0,
+        overlap_seconds: float = 5.0,
+    ) -> None:
+        self._engine = engine
+        self.chunk_seconds = chunk_seconds
+        self.overlap_seconds = overlap_seconds
+
+    @property
+    def identity(self) -> str:
+        """The wrapped engine's identity and the chunk and overlap lengths
+
+        Where the audio is cut changes the result, so chunked results are
+        cached separately from single-pass ones and from each other.
+
+        :return: what produces the results
+        :rtype: str
+        """
+        return (
+            f"{self._engine.identity}"
+            f":chunk={self.chunk_seconds:g}/{self.overlap_seconds:g}"
+        )
+
+    @property
+    def concurrency(self) -> int:
+        """The number of transcriptions the wrapped engine runs at once
+
+        :return: the wrapped engine's concurrency
+        :rtype: int
+        """
+        return self._engine.concurrency
+
+    def transcribe(self, audio, **options) -> dict:
+        """Transcribe an audio file in chunks
+
+        :param audio: path to the audio file, or a 16 kHz waveform
+        :type audio: str or np.ndarray
+        :return: the Whisper result, with "text" and "segments" keys
+        :rtype: dict
+        """
+        if isinstance(audio, str):
+            audio = load_pcm(audio)
+        chunks = find_chunks(
+            audio,
+            chunk_seconds=self.chunk_seconds,
+            overlap_seconds=self.overlap_seconds,
+        )
+        if len(chunks) == 1:
+            return self._engine.transcribe(audio, **options)
+
+        log.debug("Transcribing %d chunks", len(chunks))
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(
+                executor.map(
+                    lambda chunk: self._engine.transcribe(
+                        audio[chunk[0] : chunk[2]], **options
+                    ),
+                    chunks,
+                )
+            )
+        return stitch_results(results, chunks)
@@ -2,20 +2,55 @@
 # encoding: utf-8
 """Create dirty transcript from audio file."""
 
+import contextlib
 import logging
+import os
+import sys
+import time
 from typing import Callable
 
 import click
-from omegaconf import OmegaConf
 
-from unchecked_transcript import config
+from unchecked_transcript import get_config
+from unchecked_transcript.backends import (
+    BACKENDS,
+    COMPUTE_TYPES,
+    backend_settings,
+    get_backend,
+)
+from unchecked_transcript.batch import read_manifest, run_batch
+from unchecked_transcript.instrumentation import (
+    LONG_RUNNING_MAX_SPANS,
+    get_report,
+)
 from unchecked_transcript.mediacontent import PodcastEpisode, YouTubeVideo
-from unchecked_transcript.transcription import Transcription
-from unchecked_transcript.upload_html import upload_html
+from unchecked_transcript.result_cache import get_result_cache
+from unchecked_transcript.transcription import (
+    InProcessEngine,
+    Transcription,
+    set_engine,
+)
+from unchecked_transcript.upload_html import upload_transcription
+from unchecked_transcript.workers import WhisperWorkerPool
 
 log = logging.getLogger()
 
 
+def _write_reports(run_report: str, prometheus_file: str) -> None:
+    report = get_report()
+    report.log_summary()
+    if run_report:
+        report.write_json(run_report)
+    if prometheus_file:
+        report.write_prometheus(prometheus_file)
+
+
+def _freeze_config() -> None:
+    from omegaconf import OmegaConf
+
+    OmegaConf.set_readonly(get_config(), True)
+
+
 # Common options decorator
 def common_options(func: Callable) -> Callable:
     """Decorator to add common options to Click commands."""
@@ -28,7 +63,89 @@ def common_options(func: Callable) -> Callable:
         default=False,
         help="If set, output will be printed to stdout instead of uploading to S3.",
     )
-    def wrapper(*args, verbose: bool, debug: bool, **kwargs):
+    @click.option(
+        "--backend",
+        "backend_name",
+        type=click.Choice(sorted(BACKENDS)),
+        help="Transcription backend [default: whisper_backend in config.yml, or whisper]",
+    )
+    @click.option(
+        "--model",
+        "model_name",
+        type=str,
+        help="Model name, e.g. tiny, base, small [default: whisper_model in config.yml, or base]",
+    )
+    @click.option(
+        "--compute-type",
+        type=click.Choice(COMPUTE_TYPES),
+        help="Weight precision; int8 needs the faster-whisper backend [default: float32]",
+    )
+    @click.option(
+        "--beam-size",
+        type=click.IntRange(min=1),
+        help="Beam search width [default: the backend's own]",
+    )
+    @click.option(
+        "-w",
+        "--workers",
+        type=click.IntRange(min=0),
+        default=0,
+        show_default=True,
+        help="Whisper worker processes, each with its own model; 0 to transcribe in this process",
+    )
+    @click.option(
+        "--threads-per-worker",
+        type=click.IntRange(min=1),
+        help="Backend threads for each worker process [default: cores / workers]",
+    )
+    @click.option(
+        "--share-model",
+        is_flag=True,
+        help="Load the model once and fork workers that share its weights (whisper backend only)",
+    )
+    @click.option(
+        "--chunk-minutes",
+        type=click.FloatRange(min=1),
+        help="Split long audio into chunks of about this length and transcribe them in parallel",
+    )
+    @click.option(
+        "--vad",
+        is_flag=True,
+        help="Detect speech by loudness and transcribe only that, skipping silence",
+    )
+    @click.option(
+        "--stream",
+        is_flag=True,
+        help="Transcribe audio in 30-second windows while it downloads, without a temporary file",
+    )
+    @click.option(
+        "--run-report",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Write timings and resource use of each stage to this JSON file",
+    )
+    @click.option(
+        "--prometheus-file",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Write per-stage totals in Prometheus text format to this file",
+    )
+    def wrapper(
+        *args,
+        verbose: bool,
+        debug: bool,
+        backend_name: str,
+        model_name: str,
+        compute_type: str,
+        beam_size: int,
+        workers: int,
+        threads_per_worker: int,
+        share_model: bool,
+        chunk_minutes: float,
+        vad: bool,
+        stream: bool,
+        run_report: str,
+        prometheus_file: str,
+        **kwargs,
+    ):
         # Configure logging level based on the options
         if debug:
             logging.basicConfig(level=logging.DEBUG)
@@ -40,7 +157,55 @@ def common_options(func: Callable) -> Callable:
         logging.getLogger("boto3").setLevel(logging.WARNING)
         logging.getLogger("pytube").setLevel(logging.WARNING)
         logging.getLogger("pytubefix").setLevel(logging.WARNING)
-        return func(*args, **kwargs)
+        if stream and chunk_minutes:
+            raise click.UsageError(
+                "--stream and --chunk-minutes cannot be used together"
+            )
+        if share_model and not workers:
+            raise click.UsageError("--share-model needs --workers")
+        with contextlib.ExitStack() as stack:
+            settings = backend_settings(
+                name=backend_name,
+                model_name=model_name,
+                compute_type=compute_type,
+                beam_size=beam_size,
+            )
+            backend = get_backend(**settings)
+            engine = InProcessEngine(backend)
+            pool = None
+            if workers:
+                try:
+                    pool = WhisperWorkerPool(
+                        backend,
+                        processes=workers,
+                        threads_per_worker=threads_per_worker,
+                        share_model=share_model,
+                    )
+                except ValueError as error:
+                    raise click.UsageError(str(error)) from error
+                engine = stack.enter_context(pool)
+            if chunk_minutes:
+                # numpy and whisper's audio loader are only needed here
+                from unchecked_transcript.chunking import ChunkedTranscriber
+
+                engine = ChunkedTranscriber(
+                    engine, chunk_seconds=chunk_minutes * 60
+                )
+            if vad:
+                from unchecked_transcript.vad import VadTranscriber
+
+                engine = VadTranscriber(engine)
+            if stream:
+                from unchecked_transcript.streaming import StreamingTranscriber
+
+                engine = StreamingTranscriber(engine)
+            set_engine(engine)
+            stack.callback(set_engine, None)
+            stack.callback(_write_reports, run_report, prometheus_file)
+            if pool:
+                # Runs before the reports are written and the pool closes
+                stack.callback(lambda: get_report().set_workers(pool.memory()))
+            return func(*args, **kwargs)
 
     return wrapper
 
@@ -58,29 +223,37 @@ def cli_group():
 @click.argument("episode_title", type=str)
 @click.argument("episode_url", type=str)
 @click.argument("podcast_title", type=str)
+@click.option(
+    "--slug",
+    help="Publish to this folder instead of a new timestamped one, replacing the page there",
+    type=str,
+)
 @common_options
 def podcast(
     audio_url: str,
     episode_title: str,
     episode_url: str,
     podcast_title: str,
+    slug: str,
     stdout: bool,
 ):
     """Create an HTML transcript page for a podcast episode."""
-    OmegaConf.set_readonly(config, True)
+    _freeze_config()
     podcastepisode = PodcastEpisode(
         audio_url=audio_url,
         episode_title=episode_title,
         episode_url=episode_url,
         podcast_title=podcast_title,
     )
+    if slug:
+        podcastepisode.slug = slug
     transcription = Transcription(podcastepisode)
-    transcription_html = transcription.html()
     if stdout:
-        print(transcription_html)
+        sys.stdout.writelines(transcription.html_chunks())
+        print()
     else:
-        url = upload_html(
-            html_string=transcription_html, folder=podcastepisode.s3_path
+        url = upload_transcription(
+            transcription, folder=podcastepisode.s3_path
         )
         click.echo(f"Transcript file uploaded to {url}")
 
@@ -99,25 +272,277 @@ def podcast(
     help="Override the video channel supplied by YouTube",
     type=str,
 )
+@click.option(
+    "--slug",
+    help="Publish to this folder instead of a new timestamped one, replacing the page there",
+    type=str,
+)
 @common_options
 def youtubevideo(
     url: str,
     title: str,
     channel: str,
+    slug: str,
     stdout: bool,
 ):
     """Create an HTML transcript page for a YouTube video."""
-    OmegaConf.set_readonly(config, True)
+    _freeze_config()
 
     yt = YouTubeVideo(source_url=url, title=title, creator=channel)
+    if slug:
+        yt.slug = slug
     transcription = Transcription(yt)
-    transcription_html = transcription.html()
     if stdout:
-        print(transcription_html)
+        sys.stdout.writelines(transcription.html_chunks())
+        print()
     else:
-        url = upload_html(html_string=transcription_html, folder=yt.s3_path)
+        url = upload_transcription(transcription, folder=yt.s3_path)
         click.echo(f"Transcript file uploaded to {url}")
 
 
+@cli_group.command()
+@click.argument("source", type=str)
+@click.option(
+    "-f",
+    "--format",
+    "source_format",
+    type=click.Choice(["auto", "csv", "jsonl", "rss"]),
+    default="auto",
+    show_default=True,
+    help="Format of SOURCE; 'auto' guesses from the file extension or URL",
+)
+@click.option(
+    "--podcast-title",
+    type=str,
+    help="Override the podcast title supplied by an RSS feed",
+)
+@click.option(
+    "--limit",
+    type=int,
+    help="Process at most this many entries",
+)
+@click.option(
+    "-j",
+    "--pipeline-workers",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Download/upload threads that overlap with transcription; 0 to process entries one at a time",
+)
+@click.option(
+    "--prefetch",
+    type=click.IntRange(min=1),
+    default=2,
+    show_default=True,
+    help="Downloaded entries allowed to wait for transcription when pipelining",
+)
+@click.option(
+    "-r",
+    "--report",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Append a JSON line with the result of each entry to this file",
+)
+@common_options
+def batch(
+    source: str,
+    source_format: str,
+    podcast_title: str,
+    limit: int,
+    pipeline_workers: int,
+    prefetch: int,
+    report: str,
+    stdout: bool,
+):
+    """Create HTML transcript pages for every entry in SOURCE.
+
+    SOURCE is a CSV or JSONL manifest of podcast/YouTube entries, or the
+    path or URL of a podcast RSS feed. The Whisper model is loaded once
+    and reused for every entry.
+    """
+    _freeze_config()
+    entries = read_manifest(
+        source, source_format=source_format, podcast_title=podcast_title
+    )
+    if limit is not None:
+        entries = entries[:limit]
+
+    results = run_batch(
+        entries,
+        stdout=stdout,
+        report_path=report,
+        pipeline_workers=pipeline_workers,
+        prefetch=prefetch,
+    )
+    for result in results:
+        if result.ok:
+            click.echo(f"ok     {result.url or '-'} ({result.elapsed:.1f}s)")
+        else:
+            click.echo(f"error  {result.error}", err=True)
+    failures = sum(1 for result in results if not result.ok)
+    click.echo(f"{len(results) - failures} succeeded, {failures} failed")
+    if failures:
+        raise SystemExit(1)
+
+
+@cli_group.command()
+@click.option(
+    "--host",
+    default="127.0.0.1",
+    show_default=True,
+    help="Address to listen on",
+)
+@click.option(
+    "--port",
+    type=click.IntRange(min=0, max=65535),
+    default=8765,
+    show_default=True,
+    help="Port to listen on",
+)
+@click.option(
+    "--queue",
+    "queue_path",
+    type=click.Path(dir_okay=False, writable=True),
+    help="SQLite job queue [default: service_queue in config.yml, or ~/.cache/unchecked-transcript/jobs.sqlite3]",
+)
+@common_options
+def serve(host: str, port: int, queue_path: str, stdout: bool):
+    """Run a transcription service that takes jobs over HTTP.
+
+    Jobs are manifest entries, as in a JSONL batch manifest, POSTed as JSON
+    objects to /jobs; GET /jobs/<id> reports a job's status and result.
+    The model stays loaded between jobs and queued jobs survive restarts.
+    """
+    from unchecked_transcript import service
+
+    _freeze_config()
+    get_report().limit_spans(LONG_RUNNING_MAX_SPANS)
+    if queue_path is None:
+        queue_path = get_config().get(
+            "service_queue", service.DEFAULT_QUEUE_PATH
+        )
+    service.serve(host, port, os.path.expanduser(queue_path), stdout=stdout)
+
+
+@cli_group.command()
+@click.argument("feeds", nargs=-1)
+@click.option(
+    "--feeds-file",
+    type=click.File("r"),
+    help="Also watch the feed URLs in this file, one per line",
+)
+@click.option(
+    "--queue",
+    "queue_path",
+    type=click.Path(dir_okay=False, writable=True),
+    help="SQLite job queue of the service [default: service_queue in config.yml, or ~/.cache/unchecked-transcript/jobs.sqlite3]",
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0),
+    default=0,
+    show_default=True,
+    help="Check the feeds again every this many minutes; 0 to check once",
+)
+@click.option(
+    "--skip-existing",
+    is_flag=True,
+    help="On a feed's first check, mark its episodes seen without queueing them",
+)
+@click.option("--verbose", is_flag=True, help="Enables verbose mode.")
+def watch(
+    feeds: tuple,
+    feeds_file,
+    queue_path: str,
+    interval: float,
+    skip_existing: bool,
+    verbose: bool,
+):
+    """Queue service jobs for new episodes of podcast FEEDS.
+
+    Each feed is fetched with a conditional request and parsed as it
+    downloads; only episodes not seen in an earlier check are queued.
+    Run the serve command on the same queue to transcribe them.
+    """
+    from unchecked_transcript import feeds as feed_watch
+    from unchecked_transcript import service
+
+    logging.basicConfig(level=logging.INFO if verbose else logging.WARNING)
+    _freeze_config()
+    get_report().limit_spans(LONG_RUNNING_MAX_SPANS)
+    urls = list(feeds)
+    if feeds_file is not None:
+        urls.extend(
+            line.strip()
+            for line in feeds_file
+            if line.strip() and not line.startswith("#")
+        )
+    if not urls:
+        raise click.UsageError("No feeds to watch")
+    if queue_path is None:
+        queue_path = get_config().get(
+            "service_queue", service.DEFAULT_QUEUE_PATH
+        )
+    queue_path = os.path.expanduser(queue_path)
+    job_queue = service.JobQueue(queue_path)
+    watcher = feed_watch.FeedWatcher(
+        job_queue, feed_watch.FeedState(queue_path)
+    )
+    while True:
+        job_ids = watcher.check_all(urls, skip_existing=skip_existing)
+        click.echo(f"Queued {len(job_ids)} new episodes")
+        if not interval:
+            break
+        time.sleep(interval * 60)
+
+
+@cli_group.group()
+def cache():
+    """Inspect or purge the cache of Whisper results."""
+
+
+@cache.command("info")
+def cache_info():
+    """Show where the cache is and how full it is."""
+    result_cache = get_result_cache()
+    if result_cache is None:
+        click.echo("The result cache is turned off (result_cache_max_mb: 0)")
+        return
+    entries = result_cache.entries()
+    used = sum(entry["size"] for entry in entries)
+    click.echo(f"Directory: {result_cache.directory}")
+    click.echo(f"Entries:   {len(entries)}")
+    click.echo(
+        f"Size:      {used / 2**20:.1f} MiB"
+        f" of {result_cache.max_bytes / 2**20:.0f} MiB"
+    )
+
+
+@cache.command("list")
+def cache_list():
+    """List cached results, least recently used first."""
+    result_cache = get_result_cache()
+    if result_cache is None:
+        return
+    for entry in result_cache.entries():
+        used = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["used"]))
+        click.echo(f"{entry['key']}  {entry['size']:>10}  {used}")
+
+
+@cache.command("purge")
+@click.option(
+    "--older-than",
+    type=click.FloatRange(min=0),
+    help="Only remove results unused for this many days",
+)
+def cache_purge(older_than: float):
+    """Remove cached results."""
+    result_cache = get_result_cache()
+    if result_cache is None:
+        return
+    seconds = older_than * 86400 if older_than is not None else None
+    removed = result_cache.purge(older_than=seconds)
+    click.echo(f"Removed {removed} cached results")
+
+
 if __name__ == "__main__":
     podcast()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,246 @@
+"""Group transcript segments into the paragraphs shown on a page
+
+Groups are found from cumulative sums over start/end arrays with a binary
+search per group, so condensing takes O(groups * log(segments)) after one
+pass to build the arrays, and each group's text is joined once. Where
+rounding could decide a group's end, the group's running total is summed
+segment by segment, so groups end exactly where adding one segment at a
+time would end them.
+"""
+
+import bisect
+import functools
+import math
+import operator
+import re
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+
+from unchecked_transcript.captions import CaptionTrack
+
+TranscriptEntry = Dict[str, Union[float, str]]
+
+DEFAULT_MIN_SECONDS = 23.0
+DEFAULT_MIN_CHARACTERS = 400
+
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*$")
+
+
+def _columns(segments) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    if isinstance(segments, CaptionTrack):
+        starts = np.frombuffer(segments.starts, dtype=np.float64)
+        ends = np.frombuffer(segments.ends, dtype=np.float64)
+        return starts, ends, segments.texts
+    starts, ends, texts = [], [], []
+    for entry in segments:
+        try:
+            start = float(entry.get("start"))
+            end = float(entry.get("end"))
+        except (TypeError, ValueError):
+            continue
+        starts.append(start)
+        ends.append(end)
+        texts.append(entry.get("text", ""))
+    return (
+        np.asarray(starts, dtype=np.float64),
+        np.asarray(ends, dtype=np.float64),
+        texts,
+    )
+
+
+def sentence_ends(texts: List[str]) -> np.ndarray:
+    """Find the segments whose text ends a sentence
+
+    :param texts: segment texts
+    :type texts: List[str]
+    :return: indices of segments ending in sentence punctuation, ascending
+    :rtype: numpy.ndarray
+    """
+    return np.fromiter(
+        (
+            index
+            for index, text in enumerate(texts)
+            if _SENTENCE_END.search(text.rstrip())
+        ),
+        dtype=np.intp,
+    )
+
+
+def _tolerance(values: np.ndarray, cumulative: np.ndarray) -> float:
+    # How far a difference of the cumulative sum can be from the same
+    # values added one at a time from the start of a group: each has an
+    # error of at most n * eps * (sum of values). Integers add exactly.
+    # A negative value (a segment ending before it starts) makes the
+    # cumulative sum unsorted, so every total is then summed one at a time.
+    if not len(values):
+        return 0.0
+    if values.min() < 0:
+        return math.inf
+    if not np.issubdtype(values.dtype, np.floating):
+        return 0.0
+    total = max(float(cumulative[-1]), 1.0)
+    return 4 * len(values) * float(np.finfo(values.dtype).eps) * total
+
+
+def _reaching(
+    values: List[float],
+    cumulative: List[float],
+    tolerance: float,
+    first: int,
+    threshold: float,
+) -> int:
+    # The first segment whose running total since ``first`` reaches the
+    # threshold, or len(values) if none does. A binary search of the
+    # cumulative sum decides, except for segments whose total is within
+    # the tolerance of the threshold: for those the running total is
+    # summed in the same order as adding the segments one at a time, as
+    # rounding may put them on either side.
+    base = cumulative[first - 1] if first else 0
+    if not tolerance:
+        return bisect.bisect_left(cumulative, base + threshold, first)
+    low = bisect.bisect_left(cumulative, base + threshold - tolerance, first)
+    high = bisect.bisect_right(cumulative, base + threshold + tolerance, low)
+    if high == low:
+        return low
+    running = 0.0
+    for index in range(first, high):
+        running += values[index]
+        if running >= threshold:
+            return index
+    return high
+
+
+def _ends_by_threshold(values: np.ndarray, threshold: float) -> List[int]:
+    # The last segment of each group is the first whose running total since
+    # the group started reaches the threshold
+    cumulative = np.cumsum(values)
+    tolerance = _tolerance(values, cumulative)
+    values, cumulative = values.tolist(), cumulative.tolist()
+    last = len(values) - 1
+    group_ends = []
+    first = 0
+    while True:
+        end = _reaching(values, cumulative, tolerance, first, threshold)
+        if end >= last:
+            group_ends.append(last)
+            return group_ends
+        group_ends.append(end)
+        first = end + 1
+
+
+def _ends_by_sentence(
+    values: np.ndarray,
+    sentences: np.ndarray,
+    min_length: float,
+    max_length: float,
+) -> List[int]:
+    cumulative = np.cumsum(values)
+    tolerance = _tolerance(values, cumulative)
+    values, cumulative = values.tolist(), cumulative.tolist()
+    sentences = sentences.tolist()
+    last = len(values) - 1
+    group_ends = []
+    first = 0
+    while True:
+        earliest = _reaching(values, cumulative, tolerance, first, min_length)
+        end = _reaching(values, cumulative, tolerance, first, max_length)
+        position = bisect.bisect_left(sentences, earliest)
+        if position < len(sentences):
+            end = min(end, sentences[position])
+        end = max(end, earliest)
+        if end >= last:
+            group_ends.append(last)
+            return group_ends
+        group_ends.append(end)
+        first = end + 1
+
+
+def _display_time(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+POLICIES = ["duration", "characters", "sentence"]
+
+
+def condense(
+    segments: Iterable[dict],
+    policy: str = "duration",
+    min_length: float = DEFAULT_MIN_SECONDS,
+    min_characters: int = DEFAULT_MIN_CHARACTERS,
+    find_sentence_ends: Callable[[List[str]], np.ndarray] = sentence_ends,
+) -> Tuple[List[TranscriptEntry], List[float]]:
+    """Condense transcript segments into longer entries
+
+    Policies:
+
+    * duration: a group ends at the first segment that brings its total
+      duration to ``min_length`` seconds
+    * characters: a group ends at the first segment that brings its text
+      to ``min_characters`` characters
+    * sentence: a group ends at the first sentence end after it reaches
+      ``min_length`` seconds, or at three times ``min_length`` if no
+      sentence ends by then
+
+    The last segment always ends a group. A segment whose end is before
+    its start has a negative duration, as it did when segments were added
+    up one at a time.
+
+    :param segments: a ``CaptionTrack`` or dictionaries with "start",
+        "end", and "text" keys
+    :type segments: Iterable[dict]
+    :param policy: one of ``POLICIES``, defaults to "duration"
+    :type policy: str, optional
+    :param min_length: minimum group length in seconds, defaults to 23.0
+    :type min_length: float, optional
+    :param min_characters: minimum group length in characters for the
+        characters policy, defaults to 400
+    :type min_characters: int, optional
+    :param find_sentence_ends: gives the indices of the texts that end a
+        sentence, for the sentence policy
+    :type find_sentence_ends: Callable[[List[str]], numpy.ndarray], optional
+    :return: entries with "start", "start_display", "text", and "duration"
+        keys, and the start time of each entry
+    :rtype: Tuple[List[TranscriptEntry], List[float]]
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown condensing policy {policy}")
+    starts, ends, texts = _columns(segments)
+    if not texts:
+        return [], []
+    texts = [text.replace("\n", " ").lstrip() for text in texts]
+    durations = ends - starts
+
+    if policy == "characters":
+        # Count the space that joins each text to the one before
+        lengths = np.fromiter((len(text) + 1 for text in texts), np.int64)
+        group_ends = _ends_by_threshold(lengths, min_characters)
+    elif policy == "sentence":
+        sentences = np.asarray(find_sentence_ends(texts), dtype=np.intp)
+        group_ends = _ends_by_sentence(
+            durations, sentences, min_length, 3 * min_length
+        )
+    else:
+        group_ends = _ends_by_threshold(durations, min_length)
+
+    # Each group's duration is added up one segment at a time as well
+    duration_list = durations.tolist()
+    condensed_transcript: List[TranscriptEntry] = []
+    first = 0
+    for last in group_ends:
+        start = float(starts[first])
+        condensed_transcript.append(
+            {
+                "start": start,
+                "start_display": _display_time(start),
+                "text": " ".join(texts[first : last + 1]),
+                "duration": functools.reduce(
+                    operator.add, duration_list[first : last + 1]
+                ),
+            }
+        )
+        first = last + 1
+    start_times = [entry["start"] for entry in condensed_transcript]
+    return condensed_transcript, start_times
@@ -0,0 +1,301 @@
+"""Watch podcast feeds and queue jobs for new episodes"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from unchecked_transcript.batch import validate_entry
+from unchecked_transcript.media_cache import get_session
+
+log = logging.getLogger()
+
+TIMEOUT = 30
+CHUNK_SIZE = 64 << 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS feeds (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    checked REAL
+);
+CREATE TABLE IF NOT EXISTS feed_items (
+    feed_url TEXT NOT NULL,
+    guid TEXT NOT NULL,
+    job_id INTEGER,
+    seen REAL NOT NULL,
+    PRIMARY KEY (feed_url, guid)
+);
+"""
+
+
+def _local_name(tag: str) -> str:
+    return tag.rpartition("}")[2]
+
+
+def parse_feed(
+    chunks: Iterable[bytes], podcast_title: Optional[str] = None
+) -> Iterator[Dict[str, str]]:
+    """Parse an RSS feed incrementally into podcast manifest entries
+
+    The feed is fed to a pull parser a chunk at a time and each item is
+    discarded once read, so memory use does not grow with the feed.
+    Items without an enclosure are skipped. An item without a link gets
+    the channel's link, or failing that its enclosure URL, as its episode
+    URL. Each entry also has a "guid" key: the item's guid, or its
+    enclosure URL if it has none.
+
+    :param chunks: the feed document, in pieces
+    :type chunks: Iterable[bytes]
+    :param podcast_title: use this instead of the channel title
+    :type podcast_title: str, optional
+    :raises ValueError: if the document is not an RSS feed
+    :return: manifest entries, in feed order
+    :rtype: Iterator[Dict[str, str]]
+    """
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    path: List[str] = []
+    channel = None
+    channel_link = ""
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            name = _local_name(element.tag)
+            if event == "start":
+                path.append(name)
+                if path == ["rss", "channel"]:
+                    channel = element
+                continue
+            path.pop()
+            if path == ["rss", "channel"] and name == "title":
+                if podcast_title is None:
+                    podcast_title = (element.text or "").strip()
+            elif path == ["rss", "channel"] and element.tag == "link":
+                # Not atom:link, which shares the local name
+                channel_link = (element.text or "").strip()
+            elif path == ["rss", "channel"] and name == "item":
+                enclosure = element.find("enclosure")
+                if enclosure is not None and enclosure.get("url"):
+                    yield {
+                        "type": "podcast",
+                        "audio_url": enclosure.get("url"),
+                        "episode_title": element.findtext(
+                            "title", default=""
+                        ).strip(),
+                        "episode_url": element.findtext(
+                            "link", default=""
+                        ).strip()
+                        or channel_link
+                        or enclosure.get("url"),
+                        "podcast_title": podcast_title or "",
+                        "guid": element.findtext("guid", default="").strip()
+                        or enclosure.get("url"),
+                    }
+                channel.remove(element)
+    parser.close()
+    if channel is None:
+        raise ValueError("Not an RSS feed")
+
+
+class FeedState:
+    """The validators and already-seen items of each watched feed
+
+    Kept in SQLite, by default in the same database as the job queue.
+    """
+
+    path: str
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_SCHEMA)
+
+    def validators(self, url: str) -> Dict[str, str]:
+        """Get the conditional request headers for a feed
+
+        :param url: the feed URL
+        :type url: str
+        :return: If-None-Match and If-Modified-Since headers, where known
+        :rtype: Dict[str, str]
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT etag, last_modified FROM feeds WHERE url = ?", (url,)
+            ).fetchone()
+        headers = {}
+        if row is not None and row[0]:
+            headers["If-None-Match"] = row[0]
+        if row is not None and row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def is_known(self, url: str) -> bool:
+        """Whether a feed has been checked before
+
+        :param url: the feed URL
+        :type url: str
+        :return: True if the feed has been checked
+        :rtype: bool
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM feeds WHERE url = ?", (url,)
+            ).fetchone()
+        return row is not None
+
+    def checked(self, url: str, headers: Dict[str, str]) -> None:
+        """Record a successful check of a feed
+
+        :param url: the feed URL
+        :type url: str
+        :param headers: the response headers; their validators replace
+            the stored ones
+        :type headers: Dict[str, str]
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO feeds (url, etag, last_modified, checked)"
+                " VALUES (?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET"
+                " etag = COALESCE(excluded.etag, etag),"
+                " last_modified ="
+                " COALESCE(excluded.last_modified, last_modified),"
+                " checked = excluded.checked",
+                (
+                    url,
+                    headers.get("ETag"),
+                    headers.get("Last-Modified"),
+                    time.time(),
+                ),
+            )
+
+    def seen(self, url: str) -> set:
+        """Get the GUIDs already seen in a feed
+
+        :param url: the feed URL
+        :type url: str
+        :return: the GUIDs
+        :rtype: set
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT guid FROM feed_items WHERE feed_url = ?", (url,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def add(self, url: str, guid: str, job_id: Optional[int]) -> None:
+        """Record an item as seen
+
+        :param url: the feed URL
+        :type url: str
+        :param guid: the item's GUID
+        :type guid: str
+        :param job_id: the job queued for the item, or None if skipped
+        :type job_id: int, optional
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO feed_items"
+                " (feed_url, guid, job_id, seen) VALUES (?, ?, ?, ?)",
+                (url, guid, job_id, time.time()),
+            )
+
+    def close(self) -> None:
+        """Close the database connection"""
+        with self._lock:
+            self._connection.close()
+
+
+class FeedWatcher:
+    """Queue a job for each episode of a feed not seen before
+
+    Jobs are submitted to a ``service.JobQueue``.
+    """
+
+    state: FeedState
+
+    def __init__(self, job_queue, state: FeedState) -> None:
+        self.job_queue = job_queue
+        self.state = state
+
+    def check(
+        self,
+        url: str,
+        podcast_title: Optional[str] = None,
+        skip_existing: bool = False,
+    ) -> List[int]:
+        """Check one feed
+
+        The feed is requested with the validators from the last check, so
+        an unchanged feed costs one request and a 304 response.
+
+        :param url: the feed URL
+        :type url: str
+        :param podcast_title: use this instead of the channel title
+        :type podcast_title: str, optional
+        :param skip_existing: the first time a feed is checked, mark its
+            episodes as seen without queueing them
+        :type skip_existing: bool, optional
+        :return: IDs of the jobs queued
+        :rtype: List[int]
+        """
+        backfill = not (skip_existing and not self.state.is_known(url))
+        with get_session().get(
+            url,
+            headers=self.state.validators(url),
+            stream=True,
+            timeout=TIMEOUT,
+        ) as response:
+            if response.status_code == 304:
+                log.info("%s is unchanged", url)
+                self.state.checked(url, response.headers)
+                return []
+            response.raise_for_status()
+            seen = self.state.seen(url)
+            job_ids = []
+            for entry in parse_feed(
+                response.iter_content(CHUNK_SIZE), podcast_title
+            ):
+                guid = entry.pop("guid")
+                if guid in seen:
+                    continue
+                job_id = None
+                try:
+                    validate_entry(entry)
+                except ValueError as error:
+                    # Still recorded as seen, so it is not retried each check
+                    log.warning("Skipping %s in %s: %s", guid, url, error)
+                else:
+                    if backfill:
+                        job_id = self.job_queue.submit(entry)
+                        job_ids.append(job_id)
+                        log.info("Queued job %d for %s", job_id, guid)
+                self.state.add(url, guid, job_id)
+                seen.add(guid)
+            headers = response.headers
+        self.state.checked(url, headers)
+        return job_ids
+
+    def check_all(self, urls: Iterable[str], **options) -> List[int]:
+        """Check several feeds, logging rather than raising errors
+
+        :param urls: the feed URLs
+        :type urls: Iterable[str]
+        :return: IDs of the jobs queued
+        :rtype: List[int]
+        """
+        job_ids = []
+        for url in urls:
+            try:
+                job_ids.extend(self.check(url, **options))
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Failed to check %s", url)
+        return job_ids
@@ -0,0 +1,374 @@
+"""Timing and resource spans for each stage of a run"""
+
+import contextlib
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, Iterator, List, Optional
+
+log = logging.getLogger()
+
+PROMETHEUS_PREFIX = "unchecked_transcript"
+
+# Spans kept by commands that run until stopped, such as serve and watch
+LONG_RUNNING_MAX_SPANS = 10000
+
+
+def audio_duration(path: str) -> Optional[float]:
+    """Get the length of an audio file with ffprobe
+
+    :param path: the audio file
+    :type path: str
+    :return: duration in seconds, or None if ffprobe cannot tell
+    :rtype: float, optional
+    """
+    try:
+        probe = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-show_entries",
+                "format=duration",
+                "-of",
+                "default=noprint_wrappers=1:nokey=1",
+                path,
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        return float(probe.stdout.strip())
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def _peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Fields of /proc/<pid>/smaps_rollup and /proc/<pid>/status, in kB
+_MEMORY_FIELDS = {
+    "Rss": "rss_bytes",
+    "Pss": "pss_bytes",
+    "Shared_Clean": "shared_bytes",
+    "Shared_Dirty": "shared_bytes",
+    "Private_Clean": "private_bytes",
+    "Private_Dirty": "private_bytes",
+    "VmHWM": "peak_rss_bytes",
+}
+
+
+def process_memory(pid: Optional[int] = None) -> Dict[str, int]:
+    """Get the memory use of a process, from /proc on Linux
+
+    PSS (proportional set size) splits each shared page between the
+    processes sharing it, so the PSS of workers sharing a model adds up to
+    the memory they actually use, where their RSS counts it once each.
+
+    :param pid: the process, defaults to this one
+    :type pid: int, optional
+    :return: "rss_bytes", "pss_bytes", "shared_bytes", "private_bytes",
+        and "peak_rss_bytes", or an empty dictionary where /proc is not
+        available
+    :rtype: Dict[str, int]
+    """
+    directory = f"/proc/{pid or 'self'}"
+    memory = defaultdict(int)
+    for name in ("smaps_rollup", "status"):
+        try:
+            with open(f"{directory}/{name}", encoding="ascii") as file:
+                lines = file.readlines()
+        except OSError:
+            continue
+        for line in lines:
+            field, _, value = line.partition(":")
+            if field in _MEMORY_FIELDS and value.strip().endswith("kB"):
+                memory[_MEMORY_FIELDS[field]] += int(value.split()[0]) * 1024
+    return dict(memory)
+
+
+class Span:
+    """One timed stage of the work on one item"""
+
+    name: str
+    attributes: Dict[str, object]
+    started: float
+    duration: float = None
+    peak_rss_bytes: int = None
+
+    def __init__(self, name: str, **attributes) -> None:
+        self.name = name
+        self.attributes = attributes
+        self.started = time.time()
+
+    def set(self, **attributes) -> None:
+        """Record attributes learned during the stage
+
+        ``bytes`` (data moved) and ``audio_seconds`` (audio processed) are
+        totalled in the report; ``audio_seconds`` also gives the span a
+        real-time factor.
+        """
+        self.attributes.update(attributes)
+
+    @property
+    def rtf(self) -> Optional[float]:
+        """The real-time factor: audio seconds processed per wall second
+
+        :return: the real-time factor, if the span processed audio
+        :rtype: float, optional
+        """
+        audio_seconds = self.attributes.get("audio_seconds")
+        if not audio_seconds or not self.duration:
+            return None
+        return audio_seconds / self.duration
+
+    def as_dict(self) -> Dict[str, object]:
+        """Get the span as a JSON-serializable dictionary
+
+        :return: the span record
+        :rtype: Dict[str, object]
+        """
+        record = {
+            "name": self.name,
+            "started": self.started,
+            "duration": self.duration,
+            "peak_rss_bytes": self.peak_rss_bytes,
+            **self.attributes,
+        }
+        if self.rtf is not None:
+            record["rtf"] = self.rtf
+        return record
+
+
+def _empty_total() -> Dict[str, float]:
+    return {"count": 0, "seconds": 0.0, "bytes": 0, "audio_seconds": 0.0}
+
+
+class RunReport:
+    """The spans recorded during one run, from any thread
+
+    Per-stage totals are kept as spans are recorded. With ``max_spans``,
+    only that many of the most recent spans are kept, so a process that
+    runs until stopped does not grow without bound; the totals still
+    count every span.
+    """
+
+    spans: Deque[Span]
+    workers: List[Dict[str, int]]
+    dropped: int
+
+    def __init__(self, max_spans: Optional[int] = None) -> None:
+        self.spans = deque(maxlen=max_spans)
+        self.workers = []
+        self.dropped = 0
+        self.started = time.time()
+        self._totals: Dict[str, Dict[str, float]] = defaultdict(_empty_total)
+        self._lock = threading.Lock()
+
+    def limit_spans(self, max_spans: Optional[int]) -> None:
+        """Keep only the most recent spans from now on
+
+        :param max_spans: spans to keep, or None to keep them all
+        :type max_spans: int, optional
+        """
+        with self._lock:
+            kept = deque(self.spans, maxlen=max_spans)
+            self.dropped += len(self.spans) - len(kept)
+            self.spans = kept
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Time the enclosed block as a span
+
+        The span is recorded even if the block raises, with an ``error``
+        attribute.
+
+        :param name: stage name
+        :type name: str
+        :return: the span, to record attributes on
+        :rtype: Iterator[Span]
+        """
+        thread = threading.current_thread().name
+        span = Span(name, thread=thread, **attributes)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as error:
+            span.set(error=f"{type(error).__name__}: {error}")
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            span.peak_rss_bytes = _peak_rss()
+            with self._lock:
+                if len(self.spans) == self.spans.maxlen:
+                    self.dropped += 1
+                self.spans.append(span)
+                total = self._totals[name]
+                total["count"] += 1
+                total["seconds"] += span.duration
+                total["bytes"] += span.attributes.get("bytes") or 0
+                total["audio_seconds"] += (
+                    span.attributes.get("audio_seconds") or 0
+                )
+            log.debug("%s took %.3fs %s", name, span.duration, span.attributes)
+
+    def totals(self) -> Dict[str, Dict[str, float]]:
+        """Sum the spans of each stage, including spans no longer kept
+
+        :return: per stage, the span count, seconds, bytes, and audio seconds
+        :rtype: Dict[str, Dict[str, float]]
+        """
+        with self._lock:
+            return {name: dict(total) for name, total in self._totals.items()}
+
+    def set_workers(self, workers: List[Dict[str, int]]) -> None:
+        """Record the memory use of worker processes
+
+        :param workers: a "pid" key and the ``process_memory`` of each
+            worker, e.g. from ``WhisperWorkerPool.memory``
+        :type workers: List[Dict[str, int]]
+        """
+        with self._lock:
+            self.workers = list(workers)
+
+    def as_dict(self) -> Dict[str, object]:
+        """Get the report as a JSON-serializable dictionary
+
+        :return: run metadata, per-stage totals, worker memory, and the
+            spans kept, with the number dropped
+        :rtype: Dict[str, object]
+        """
+        with self._lock:
+            spans = [span.as_dict() for span in self.spans]
+            workers = list(self.workers)
+            dropped = self.dropped
+        return {
+            "started": self.started,
+            "duration": time.time() - self.started,
+            "pid": os.getpid(),
+            "argv": sys.argv,
+            "peak_rss_bytes": _peak_rss(),
+            "stages": self.totals(),
+            "workers": workers,
+            "spans_dropped": dropped,
+            "spans": spans,
+        }
+
+    def write_json(self, path: str) -> None:
+        """Write the report as JSON
+
+        :param path: file to write
+        :type path: str
+        """
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.as_dict(), file, indent=2, default=str)
+
+    def write_prometheus(self, path: str) -> None:
+        """Write per-stage totals in the Prometheus text exposition format
+
+        The file is written atomically, so it can be picked up by the node
+        exporter's textfile collector.
+
+        :param path: file to write
+        :type path: str
+        """
+        metrics = [
+            ("stage_seconds_total", "seconds", "Seconds spent in the stage"),
+            ("stage_runs_total", "count", "Times the stage ran"),
+            ("stage_bytes_total", "bytes", "Bytes moved by the stage"),
+            (
+                "stage_audio_seconds_total",
+                "audio_seconds",
+                "Seconds of audio processed by the stage",
+            ),
+        ]
+        totals = self.totals()
+        lines = []
+        for metric, key, description in metrics:
+            name = f"{PROMETHEUS_PREFIX}_{metric}"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for stage, total in sorted(totals.items()):
+                lines.append(f'{name}{{stage="{stage}"}} {total[key]}')
+        name = f"{PROMETHEUS_PREFIX}_peak_rss_bytes"
+        lines.append(f"# HELP {name} Peak resident set size of the run")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_peak_rss()}")
+        with self._lock:
+            workers = list(self.workers)
+        for key, description in (
+            ("rss_bytes", "Resident set size of each worker process"),
+            ("pss_bytes", "Proportional set size of each worker process"),
+        ):
+            if not any(key in worker for worker in workers):
+                continue
+            name = f"{PROMETHEUS_PREFIX}_worker_{key}"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            for worker in workers:
+                if key in worker:
+                    labels = f'pid="{worker["pid"]}"'
+                    lines.append(f"{name}{{{labels}}} {worker[key]}")
+
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+
+    def log_summary(self) -> None:
+        """Log one line per stage at INFO level"""
+        for stage, total in self.totals().items():
+            rtf = ""
+            if total["audio_seconds"] and total["seconds"]:
+                factor = total["audio_seconds"] / total["seconds"]
+                rtf = f", {factor:.1f}x real time"
+            log.info(
+                "%s: %d in %.2fs, %d bytes%s",
+                stage,
+                total["count"],
+                total["seconds"],
+                total["bytes"],
+                rtf,
+            )
+        with self._lock:
+            workers = list(self.workers)
+        for worker in workers:
+            log.info(
+                "worker %d: %.0f MiB resident, %.0f MiB proportional,"
+                " %.0f MiB shared",
+                worker["pid"],
+                worker.get("rss_bytes", 0) / (1 << 20),
+                worker.get("pss_bytes", 0) / (1 << 20),
+                worker.get("shared_bytes", 0) / (1 << 20),
+            )
+
+
+_report = RunReport()
+
+
+def get_report() -> RunReport:
+    """Get the report for this run
+
+    :return: the process-wide report
+    :rtype: RunReport
+    """
+    return _report
+
+
+def span(name: str, **attributes):
+    """Time the enclosed block as a span of this run's report
+
+    :param name: stage name
+    :type name: str
+    :return: context manager yielding the ``Span``
+    """
+    return _report.span(name, **attributes)
@@ -0,0 +1,339 @@
+"""Resumable audio downloads and a persistent cache of downloaded media"""
+
+import contextlib
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+from . import get_config
+
+log = logging.getLogger()
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "unchecked-transcript", "media"
+)
+DEFAULT_MAX_MB = 4096
+
+CHUNK_SIZE = 1 << 20
+ATTEMPTS = 5
+TIMEOUT = (10, 60)
+
+
+@functools.lru_cache(maxsize=None)
+def get_session():
+    """Get the HTTP session shared by all downloads in this process
+
+    The session keeps connections to each host alive between requests and
+    retries failed connections and 429/5xx responses with backoff.
+
+    :return: the shared session
+    :rtype: requests.Session
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=ATTEMPTS,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "HEAD"],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=8, pool_maxsize=16, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _range_validator(headers) -> Optional[str]:
+    # If-Range only accepts a strong ETag or a Last-Modified date
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified")
+
+
+def _range_length(headers) -> Optional[int]:
+    # A 416 reply gives the complete length as "Content-Range: bytes */N"
+    match = re.fullmatch(
+        r"bytes \*/(\d+)", headers.get("Content-Range", "").strip()
+    )
+    return int(match.group(1)) if match else None
+
+
+def download(
+    url: str,
+    path: str,
+    if_range: Optional[str] = None,
+    on_response: Optional[Callable[[Dict[str, str]], None]] = None,
+) -> None:
+    """Stream a URL into a file, resuming from the bytes already there
+
+    Interrupted transfers are retried from where they stopped with an HTTP
+    Range request. ``if_range`` makes the server send the whole resource
+    again if it changed since the partial file was written; without it an
+    existing partial file is discarded before the download starts.
+
+    :param url: the URL to download
+    :type url: str
+    :param path: the file to write; existing content is resumed
+    :type path: str
+    :param if_range: ETag or Last-Modified of the partial file's source
+    :type if_range: str, optional
+    :param on_response: called with the response headers before the body
+        of each response is written
+    :type on_response: Callable[[Dict[str, str]], None], optional
+    """
+    import requests
+
+    if if_range is None and os.path.exists(path):
+        os.remove(path)
+    for attempt in range(1, ATTEMPTS + 1):
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            if if_range:
+                headers["If-Range"] = if_range
+        try:
+            with get_session().get(
+                url, headers=headers, stream=True, timeout=TIMEOUT
+            ) as response:
+                if offset and response.status_code == 416:
+                    if _range_length(response.headers) == offset:
+                        # The partial file already holds the whole resource
+                        return
+                    # The resource is shorter than the partial file, so
+                    # the partial file is not a prefix of it
+                    log.warning("Restarting the download of %s", url)
+                    os.remove(path)
+                    continue
+                response.raise_for_status()
+                if on_response is not None:
+                    on_response(response.headers)
+                if_range = _range_validator(response.headers)
+                mode = "ab" if response.status_code == 206 else "wb"
+                with open(path, mode) as file:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        file.write(chunk)
+            return
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ) as error:
+            if attempt == ATTEMPTS:
+                raise
+            log.warning(
+                "Download of %s interrupted (%s); resuming, attempt %d",
+                url,
+                error,
+                attempt + 1,
+            )
+            time.sleep(min(2**attempt, 30))
+
+
+class MediaCache:
+    """Downloaded media files kept between runs, keyed by URL
+
+    A cached file is revalidated with a conditional request (ETag and
+    Last-Modified) instead of being fetched again, a partial download left
+    by an interrupted run is resumed, and the least recently used files are
+    removed once the cache is bigger than ``max_bytes``. Files handed out
+    by ``fetch`` are pinned until ``release`` is called and are never
+    removed while pinned.
+    """
+
+    directory: str
+    max_bytes: int
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Per-path fetch locks and the number of threads using each
+        self._locks: Dict[str, Tuple[threading.Lock, int]] = {}
+        self._locks_lock = threading.Lock()
+        self._pins: Dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def _lock(self, key: str) -> Iterator[None]:
+        # A path's lock is dropped once no thread uses it, so that a
+        # long-running process does not keep one per URL it has fetched
+        with self._locks_lock:
+            lock, users = self._locks.get(key, (threading.Lock(), 0))
+            self._locks[key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_lock:
+                lock, users = self._locks[key]
+                if users == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, users - 1)
+
+    def path_for(self, url: str) -> str:
+        """Get the path a URL is cached at
+
+        :param url: the media URL
+        :type url: str
+        :return: file system path, which may not exist yet
+        :rtype: str
+        """
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        extension = os.path.splitext(urlparse(url).path)[1][:5]
+        return os.path.join(self.directory, key + extension)
+
+    @staticmethod
+    def _read_metadata(path: str) -> dict:
+        try:
+            with open(f"{path}.json", encoding="utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_metadata(path: str, metadata: dict) -> None:
+        with open(f"{path}.json", "w", encoding="utf-8") as file:
+            json.dump(metadata, file)
+
+    def _is_fresh(self, url: str, metadata: dict) -> bool:
+        headers = {}
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+        if not headers:
+            return False
+        with get_session().get(
+            url, headers=headers, stream=True, timeout=TIMEOUT
+        ) as response:
+            return response.status_code == 304
+
+    def _pin(self, path: str) -> None:
+        with self._locks_lock:
+            self._pins[path] = self._pins.get(path, 0) + 1
+
+    def release(self, path: str) -> None:
+        """Allow a file handed out by ``fetch`` to be evicted again
+
+        Each ``fetch`` pins its file once; the file can be evicted when
+        every fetch of it has been released. Paths that are not pinned are
+        ignored.
+
+        :param path: a path returned by ``fetch``
+        :type path: str
+        """
+        with self._locks_lock:
+            count = self._pins.get(path, 0) - 1
+            if count > 0:
+                self._pins[path] = count
+            else:
+                self._pins.pop(path, None)
+
+    def fetch(self, url: str) -> str:
+        """Get a local copy of a URL, downloading only what is needed
+
+        The file is pinned until it is passed to ``release``, so that
+        fetching other media cannot evict it while it is still in use.
+
+        :param url: the media URL
+        :type url: str
+        :return: path to the cached file
+        :rtype: str
+        """
+        path = self.path_for(url)
+        self._pin(path)
+        try:
+            self._fetch(url, path)
+        except BaseException:
+            self.release(path)
+            raise
+        self.evict()
+        return path
+
+    def _fetch(self, url: str, path: str) -> None:
+        with self._lock(path):
+            os.makedirs(self.directory, exist_ok=True)
+            metadata = self._read_metadata(path)
+            if metadata.get("complete") and os.path.exists(path):
+                if self._is_fresh(url, metadata):
+                    log.debug("Media cache hit for %s", url)
+                    os.utime(path)
+                    return
+                log.debug("Cached copy of %s is stale", url)
+
+            partial = f"{path}.part"
+            if_range = metadata.get("validator")
+            metadata = {"url": url, "complete": False}
+
+            def remember(headers) -> None:
+                metadata["etag"] = headers.get("ETag")
+                metadata["last_modified"] = headers.get("Last-Modified")
+                metadata["validator"] = _range_validator(headers)
+                self._write_metadata(path, metadata)
+
+            download(url, partial, if_range=if_range, on_response=remember)
+            os.replace(partial, path)
+            metadata["complete"] = True
+            self._write_metadata(path, metadata)
+
+    def evict(self) -> int:
+        """Remove least recently used files until under the size limit
+
+        Only complete media files count towards the limit; each is removed
+        with its metadata. Pinned files are kept, even if the cache stays
+        over the limit.
+
+        :return: number of files removed
+        :rtype: int
+        """
+        with self._locks_lock:
+            pinned = set(self._pins)
+        media = [
+            entry
+            for entry in os.scandir(self.directory)
+            if entry.is_file() and not entry.name.endswith((".json", ".part"))
+        ]
+        total = sum(entry.stat().st_size for entry in media)
+        files = [entry for entry in media if entry.path not in pinned]
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        removed = 0
+        for entry in files:
+            if total <= self.max_bytes:
+                break
+            total -= entry.stat().st_size
+            os.remove(entry.path)
+            if os.path.exists(f"{entry.path}.json"):
+                os.remove(f"{entry.path}.json")
+            removed += 1
+        return removed
+
+
+@functools.lru_cache(maxsize=None)
+def get_media_cache() -> Optional[MediaCache]:
+    """Get the media cache configured in config.yml
+
+    ``media_cache_dir`` sets the cache location and ``media_cache_max_mb``
+    its size; a size of 0 turns the cache off.
+
+    :return: the cache, or None if it is turned off
+    :rtype: MediaCache, optional
+    """
+    config = get_config()
+    max_mb = config.get("media_cache_max_mb", DEFAULT_MAX_MB)
+    if not max_mb:
+        return None
+    directory = config.get("media_cache_dir", DEFAULT_CACHE_DIR)
+    return MediaCache(os.path.expanduser(directory), int(max_mb) << 20)
@@ -1,40 +1,28 @@
 """A piece of media with an audio track"""
 
-import json
 import logging
 import os
 import re
-import subprocess
-import sys
+import tempfile
 from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import Dict, List, Tuple
-
-import pytubefix
-import requests
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, TypeVar
 
+from .captions import CaptionTrack, load_cached_track, store_track
+from .instrumentation import span
+from .media_cache import download, get_media_cache
 from .util import extract_video_id, get_temp_dir, remove_stop_words
+from .youtube_tokens import get_token_provider
+
+if TYPE_CHECKING:
+    import pytubefix
 
 log = logging.getLogger()
 
+# Caption tracks to use, in order of preference
+CAPTION_LANGUAGES = ("en", "en-US", "en-GB")
 
-def _generate_youtube_tokens() -> Tuple[str, str]:
-    command = "node scripts/youtube-token-generator.js"
-    try:
-        shell_result = subprocess.run(
-            command,
-            check=True,
-            shell=True,
-            capture_output=True,
-            text=True,
-        )
-    except subprocess.CalledProcessError as error:
-        log.critical(f"{command} STDOUT: {error.stdout}\n")
-        log.critical(f"{command} STDERR: {error.stderr}\n")
-        sys.exit(1)
-    token_object = json.loads(shell_result.stdout)
-    log.debug(f"Result: {token_object=}")
-    return token_object["visitorData"], token_object["poToken"]
+T = TypeVar("T")
 
 
 class MediaContent(ABC):
@@ -42,6 +30,7 @@ class MediaContent(ABC):
 
     source_url: str
     _slug: str = None
+    _audio_file: str = None
 
     def __init__(
         self,
@@ -139,6 +128,50 @@ class MediaContent(ABC):
         :rtype: str
         """
 
+    @property
+    def compact_template(self) -> Optional[str]:
+        """Get the filename of the template for compact pages, if there is one
+
+        A compact page puts each line's timestamp in a data attribute
+        styled by one rule, rather than generating a CSS rule per line.
+
+        :return: the template filename, or None to use ``html_template``
+        :rtype: str, optional
+        """
+        return None
+
+    @property
+    def shell_template(self) -> Optional[str]:
+        """Get the filename of the template for sidecar mode, if there is one
+
+        The shell page loads its transcript from ``sidecar.SIDECAR_NAME``.
+
+        :return: the template filename, or None if this media has no shell
+            page and is always rendered inline
+        :rtype: str, optional
+        """
+        return None
+
+    def discard_audio_file(self) -> None:
+        """Remove the downloaded audio file, if there is one
+
+        Long-running processes call this once an item has been transcribed
+        so that the temporary directory does not grow without bound. Files
+        in the media cache are left for the cache to manage, and released so
+        that it may evict them.
+        """
+        media_cache = get_media_cache()
+        if self._audio_file is not None and media_cache is not None:
+            media_cache.release(self._audio_file)
+        if (
+            self._audio_file is not None
+            and os.path.exists(self._audio_file)
+            and os.path.commonpath([self._audio_file, get_temp_dir()])
+            == get_temp_dir()
+        ):
+            os.remove(self._audio_file)
+        self._audio_file = None
+
     @property
     def s3_path(self) -> str:
         """Get the s3 path to store the HTML file
@@ -156,6 +189,9 @@ class MediaContent(ABC):
         the media identifier (if appropriate), and the title with stop words
         removed. Elements of the slug are separated by dashes.
 
+        Because of the timestamp, each run publishes to a new folder unless
+        a fixed slug is set, as re-publishing over an existing page needs.
+
         :return: the media slug
         :rtype: str
         """
@@ -169,6 +205,10 @@ class MediaContent(ABC):
             self._slug = "-".join(slug_elements)
         return self._slug
 
+    @slug.setter
+    def slug(self, value: str) -> None:
+        self._slug = value
+
 
 class PodcastEpisode(MediaContent):
     """A podcast episode"""
@@ -205,12 +245,15 @@ class PodcastEpisode(MediaContent):
     @property
     def audio_file(self) -> str:
         if self._audio_file is None:
-            self._audio_file = os.path.join(get_temp_dir(), "audio.mp3")
-            response = requests.get(self.audio_url, stream=True, timeout=10)
-            response.raise_for_status()
-            with open(self._audio_file, "wb") as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
+            with span("download", url=self.audio_url) as download_span:
+                media_cache = get_media_cache()
+                if media_cache is not None:
+                    self._audio_file = media_cache.fetch(self.audio_url)
+                else:
+                    download_dir = tempfile.mkdtemp(dir=get_temp_dir())
+                    self._audio_file = os.path.join(download_dir, "audio.mp3")
+                    download(self.audio_url, self._audio_file)
+                download_span.set(bytes=os.path.getsize(self._audio_file))
         return self._audio_file
 
     @property
@@ -244,6 +287,10 @@ class PodcastEpisode(MediaContent):
     def html_template(self) -> str:
         return "podcast_template.html.j2"
 
+    @property
+    def compact_template(self) -> str:
+        return "podcast_compact.html.j2"
+
 
 class YouTubeVideo(MediaContent):
     """A YouTube audio file"""
@@ -251,102 +298,102 @@ class YouTubeVideo(MediaContent):
     _title: str = None
     _creator: str = None
     youtube_id: str
-    pytube_object: pytubefix.YouTube
-    _audio_stream: pytubefix.streams.Stream = None
+    pytube_object: "pytubefix.YouTube"
+    _audio_stream: "pytubefix.streams.Stream" = None
     _audio_file: str = None
+    _captions: CaptionTrack = None
+    _captions_loaded: bool = False
 
     def __init__(
         self, source_url: str, title: str = None, creator: str = None
     ) -> None:
         super().__init__(source_url=source_url)
         self.youtube_id = extract_video_id(self.source_url)
-        self.pytube_object = pytubefix.YouTube(
-            source_url,
-        )
+        self.pytube_object = self._make_pytube_object()
         self._title = title
         self._creator = creator
 
-    @staticmethod
-    def _convert_to_seconds(time_str):
-        """
-        Converts a time string from SRT format (hh:mm:ss,ms) to seconds.
+    def _make_pytube_object(self) -> "pytubefix.YouTube":
+        import pytubefix
 
-        This function parses a time string from the SRT format, splitting into
-        hours, minutes, seconds, and milliseconds, and converts it into a floating
-        point number representing the equivalent time in seconds.
+        token_provider = get_token_provider()
+        if token_provider is None:
+            return pytubefix.YouTube(self.source_url)
+        return pytubefix.YouTube(
+            self.source_url,
+            use_po_token=True,
+            po_token_verifier=token_provider.tokens,
+        )
 
-        Args:
-            time_str (str): Time string in the format "hh:mm:ss,ms".
+    def _youtube(self, read: Callable[["pytubefix.YouTube"], T]) -> T:
+        """Read from the pytubefix object, renewing rejected tokens once
 
-        Returns:
-            float: The time in seconds.
+        When YouTube flags the request as a bot or asks for a PO token, the
+        shared tokens are invalidated and the read is retried with a new
+        pytubefix object, which asks the provider for fresh tokens.
 
-        Example:
-            seconds = convert_to_seconds("00:00:10,160")
-            # Output: 10.16
+        :param read: called with the pytubefix object
+        :type read: Callable[[pytubefix.YouTube], T]
+        :return: what ``read`` returns
+        :rtype: T
         """
-        hours, minutes, seconds_ms = time_str.split(":")
-        seconds, milliseconds = seconds_ms.split(",")
-        return (
-            int(hours) * 3600
-            + int(minutes) * 60
-            + int(seconds)
-            + int(milliseconds) / 1000.0
-        )
-
-    def _parse_srt(self, lang="en"):
+        from pytubefix.exceptions import BotDetection, PoTokenRequired
+
+        try:
+            return read(self.pytube_object)
+        except (BotDetection, PoTokenRequired) as error:
+            token_provider = get_token_provider()
+            if token_provider is None:
+                raise
+            log.warning("YouTube rejected the tokens (%s); renewing", error)
+            token_provider.invalidate()
+            self.pytube_object = self._make_pytube_object()
+            return read(self.pytube_object)
+
+    def _parse_srt(self, lang: str = "en") -> CaptionTrack:
+        """Download and parse one of the video's caption tracks
+
+        :param lang: caption language code, defaults to "en"
+        :type lang: str, optional
+        :return: the parsed track
+        :rtype: CaptionTrack
         """
-        Parses SRT (SubRip Subtitle) contents into a list of subtitle entries.
-
-        Each entry in the returned list is a dictionary containing the start time,
-        end time, and text of the subtitle. The times are converted to seconds with
-        milliseconds.
+        srt_content = self._youtube(
+            lambda video: video.captions[lang].generate_srt_captions()
+        )
+        return CaptionTrack.from_srt(srt_content)
 
-        Args:
-            srt_content (str): The content of the SRT file as a string.
+    @property
+    def captions(self) -> Optional[CaptionTrack]:
+        """The first English caption track, fetched and parsed once
 
-        Returns:
-            list: A list of dictionaries, each with 'start' (float), 'end' (float),
-                and 'text' (str) keys representing the timecoded subtitle entries.
-
-        Example:
-            srt_content = \"\"\"
-            1
-            00:00:10,160 --> 00:00:19,360
-            Example subtitle text.
-
-            2
-            00:00:19,360 --> 00:00:26,480
-            Another subtitle entry.
-            \"\"\"
-            result = parse_srt(srt_content)
-            # Output: [{'start': 10.16, 'end': 19.36, 'text': 'Example subtitle text.'}, ...]
+        Parsed tracks are also kept in the result cache, keyed by video ID
+        and language, so later runs skip the download.
 
+        :return: the caption track, or None if the video has no English
+            captions
+        :rtype: CaptionTrack, optional
         """
-        subtitles = []
-        srt_content = self.pytube_object.captions[lang].generate_srt_captions()
-        blocks = srt_content.strip().split(
-            "\n\n"
-        )  # Split the input into blocks
-
-        for block in blocks:
-            lines = block.split("\n")
-            if len(lines) >= 3:
-                _, timecode, *text = lines
-                start_str, end_str = map(str.strip, timecode.split("-->"))
-
-                start_seconds = self._convert_to_seconds(start_str)
-                end_seconds = self._convert_to_seconds(end_str)
-                text_content = " ".join(text).strip()
-
-                subtitle = {
-                    "start": start_seconds,
-                    "end": end_seconds,
-                    "text": text_content,
-                }
-                subtitles.append(subtitle)
-
-        return subtitles
+        if not self._captions_loaded:
+            with span("captions", video=self.youtube_id) as captions_span:
+                self._captions = self._load_captions(captions_span)
+            self._captions_loaded = True
+        return self._captions
+
+    def _load_captions(self, captions_span) -> Optional[CaptionTrack]:
+        for lang in CAPTION_LANGUAGES:
+            track = load_cached_track(self.youtube_id, lang)
+            if track is not None:
+                captions_span.set(language=lang, cached=True)
+                return track
+        available = self._youtube(lambda video: video.captions)
+        for lang in CAPTION_LANGUAGES:
+            if lang in available:
+                track = self._parse_srt(lang)
+                store_track(self.youtube_id, lang, track)
+                captions_span.set(language=lang, cached=False)
+                return track
+        return None
 
     @property
     def media_key(self) -> str:
@@ -355,13 +402,13 @@ class YouTubeVideo(MediaContent):
     @property
     def title(self) -> str:
         if self._title is None:
-            self._title = self.pytube_object.title
+            self._title = self._youtube(lambda video: video.title)
         return self._title
 
     @property
     def creator(self) -> str:
         if self._creator is None:
-            self._creator = self.pytube_object.author
+            self._creator = self._youtube(lambda video: video.author)
         return self._creator
 
     @property
@@ -371,25 +418,24 @@ class YouTubeVideo(MediaContent):
     @property
     def audio_file(self) -> str:
         if self._audio_file is None:
-            audio_stream = self._get_audio_stream()
-            self._audio_file = audio_stream.download(get_temp_dir())
+            with span("download", url=self.source_url) as download_span:
+                audio_stream = self._get_audio_stream()
+                self._audio_file = audio_stream.download(
+                    tempfile.mkdtemp(dir=get_temp_dir())
+                )
+                download_span.set(bytes=os.path.getsize(self._audio_file))
         return self._audio_file
 
     @property
     def text(self):
-        if self.segments:
-            only_text = "\n".join([x.text for x in self.segments])
-            return only_text
+        if self.captions:
+            return self.captions.text
         return None
 
     @property
-    def segments(self) -> list:
-        if "en" in self.pytube_object.captions:
-            return self._parse_srt("en")
-        if "en-US" in self.pytube_object.captions:
-            return self._parse_srt("en-US")
-        if "en-GB" in self.pytube_object.captions:
-            return self._parse_srt("en-GB")
+    def segments(self) -> Optional[CaptionTrack]:
+        if self.captions:
+            return self.captions
         return None
 
     @property
@@ -400,6 +446,14 @@ class YouTubeVideo(MediaContent):
     def html_template(self) -> str:
         return "youtube_template.html.j2"
 
+    @property
+    def compact_template(self) -> str:
+        return "youtube_compact.html.j2"
+
+    @property
+    def shell_template(self) -> str:
+        return "youtube_shell.html.j2"
+
     @property
     def media_metadata(self) -> List[Dict[str, str]]:
         iframe_source = f"https://www.youtube.com/embed/{self.youtube_id}"
@@ -413,7 +467,9 @@ class YouTubeVideo(MediaContent):
         }
         return metadata
 
-    def _get_audio_stream(self) -> pytubefix.streams.Stream:
+    def _get_audio_stream(self) -> "pytubefix.streams.Stream":
         if self._audio_stream is None:
-            self._audio_stream = self.pytube_object.streams.get_audio_only()
+            self._audio_stream = self._youtube(
+                lambda video: video.streams.get_audio_only()
+            )
         return self._audio_stream
@@ -0,0 +1,262 @@
+"""On-disk cache of decoded audio, read back as memory-mapped arrays
+
+Whisper decodes every file with ffmpeg to 16 kHz mono samples each time it
+is given a path. This cache does that once per file: the samples are
+written as raw little-endian float32, keyed by a hash of the file's
+contents, and later reads map the file instead of decoding it again.
+Chunked and parallel passes slice the mapped array, so they only read the
+pages they use.
+"""
+
+import collections
+import contextlib
+import functools
+import logging
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from . import get_config
+from .instrumentation import span
+from .result_cache import hash_file
+
+log = logging.getLogger()
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "unchecked-transcript", "pcm"
+)
+DEFAULT_MAX_MB = 4096
+
+# whisper.audio.SAMPLE_RATE, without importing torch
+SAMPLE_RATE = 16000
+DTYPE = np.dtype("<f4")
+EXTENSION = ".f32"
+# Number of file versions whose hash is remembered
+HASH_MEMORY = 1024
+
+
+class PcmCache:
+    """Decoded audio stored as raw float32 files
+
+    Entries are keyed by a SHA-256 hash of the encoded file, so a file
+    downloaded again or under another name is not decoded again. Reads
+    refresh an entry's modification time and writes evict the least
+    recently used entries until the cache fits in ``max_bytes``.
+
+    Within a process, opening an entry and evicting entries hold the same
+    lock. Other processes sharing the directory, such as the workers of a
+    ``WhisperWorkerPool``, may remove an entry at any moment, so an entry
+    that vanishes while being opened is decoded again, and one already
+    removed by another process is skipped by ``evict``.
+    """
+
+    directory: str
+    max_bytes: int
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._hashes: Dict[Tuple[str, int, int], str] = (
+            collections.OrderedDict()
+        )
+        # Per-key decode locks and the number of threads using each
+        self._locks: Dict[str, Tuple[threading.Lock, int]] = {}
+        self._locks_lock = threading.Lock()
+        self._open_lock = threading.RLock()
+
+    @contextlib.contextmanager
+    def _lock(self, key: str) -> Iterator[None]:
+        # A key's lock is dropped once no thread uses it, so that a
+        # long-running process does not keep one per file it has seen
+        with self._locks_lock:
+            lock, users = self._locks.get(key, (threading.Lock(), 0))
+            self._locks[key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_lock:
+                lock, users = self._locks[key]
+                if users == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, users - 1)
+
+    def _hash(self, path: str) -> str:
+        # Hashing a long episode takes a while; remember it per file version
+        stat = os.stat(path)
+        version = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._locks_lock:
+            digest = self._hashes.get(version)
+            if digest is not None:
+                self._hashes.move_to_end(version)
+        if digest is None:
+            digest = hash_file(path)
+            with self._locks_lock:
+                self._hashes[version] = digest
+                while len(self._hashes) > HASH_MEMORY:
+                    self._hashes.popitem(last=False)
+        return digest
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + EXTENSION)
+
+    def _decode(self, audio_file: str, path: str) -> str:
+        # Returns the decoded temporary file, for the caller to move to path
+        from unchecked_transcript.streaming import decode_pcm
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        samples = 0
+        with span("pcm_decode") as decode_span:
+            try:
+                with open(temp_path, "wb") as file:
+                    for block in decode_pcm(audio_file, block_seconds=30):
+                        file.write(block.astype(DTYPE, copy=False).tobytes())
+                        samples += len(block)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+            decode_span.set(
+                audio_seconds=samples / SAMPLE_RATE,
+                bytes=samples * DTYPE.itemsize,
+            )
+        return temp_path
+
+    def _open(self, path: str) -> Optional[np.ndarray]:
+        # Call with _open_lock held; once mapped, eviction cannot hurt it.
+        # Another process may still remove the file before then.
+        try:
+            os.utime(path)
+            if not os.path.getsize(path):
+                # An empty file cannot be mapped
+                return np.zeros(0, dtype=DTYPE)
+            return np.memmap(path, dtype=DTYPE, mode="c")
+        except FileNotFoundError:
+            return None
+
+    def load(self, audio_file: str) -> np.ndarray:
+        """Get the 16 kHz mono samples of an audio file
+
+        The array maps the cached file copy-on-write: pages are read as
+        they are used, and writes to the array do not reach the cache.
+
+        :param audio_file: path to the audio file
+        :type audio_file: str
+        :raises RuntimeError: if ffmpeg cannot decode the file
+        :return: float32 samples in [-1, 1), as whisper's ``load_audio``
+            would return them
+        :rtype: numpy.ndarray
+        """
+        key = self._hash(audio_file)
+        path = self._path(key)
+        with self._lock(key):
+            with self._open_lock:
+                samples = self._open(path)
+            if samples is not None:
+                log.debug("PCM cache hit for %s", audio_file)
+                return samples
+            while samples is None:
+                log.debug("Decoding %s into the PCM cache", audio_file)
+                temp_path = self._decode(audio_file, path)
+                with self._open_lock:
+                    os.replace(temp_path, path)
+                    samples = self._open(path)
+                    self.evict(keep=path)
+        return samples
+
+    def entries(self) -> List[Dict[str, object]]:
+        """List the cache entries, least recently used first
+
+        :return: dictionaries with "key", "size", and "used" (epoch) keys
+        :rtype: List[Dict[str, object]]
+        """
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            for item in os.scandir(entry.path):
+                if not item.name.endswith(EXTENSION):
+                    continue
+                try:
+                    stat = item.stat()
+                except FileNotFoundError:
+                    # Evicted by another process
+                    continue
+                found.append(
+                    {
+                        "key": item.name[: -len(EXTENSION)],
+                        "size": stat.st_size,
+                        "used": stat.st_mtime,
+                    }
+                )
+        found.sort(key=lambda item: item["used"])
+        return found
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Remove least recently used entries until under the size limit
+
+        A removed entry stays readable through arrays already mapping it.
+        Entries another process removes first are skipped.
+
+        :param keep: a path never to remove, such as the file just decoded
+        :type keep: str, optional
+        :return: number of entries removed
+        :rtype: int
+        """
+        with self._open_lock:
+            entries = self.entries()
+            total = sum(entry["size"] for entry in entries)
+            removed = 0
+            for entry in entries:
+                if total <= self.max_bytes:
+                    break
+                path = self._path(entry["key"])
+                if path == keep:
+                    continue
+                total -= entry["size"]
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+            return removed
+
+
+@functools.lru_cache(maxsize=None)
+def get_pcm_cache() -> Optional[PcmCache]:
+    """Get the PCM cache configured in config.yml
+
+    ``pcm_cache_dir`` sets the cache location and ``pcm_cache_max_mb``
+    its size; a size of 0 turns the cache off. An hour of audio takes
+    about 230 MB.
+
+    :return: the cache, or None if it is turned off
+    :rtype: PcmCache, optional
+    """
+    config = get_config()
+    max_mb = config.get("pcm_cache_max_mb", DEFAULT_MAX_MB)
+    if not max_mb:
+        return None
+    directory = config.get("pcm_cache_dir", DEFAULT_CACHE_DIR)
+    return PcmCache(os.path.expanduser(directory), int(max_mb) << 20)
+
+
+def load_pcm(audio_file: str) -> np.ndarray:
+    """Get the 16 kHz mono samples of an audio file, through the cache
+
+    :param audio_file: path to the audio file
+    :type audio_file: str
+    :return: float32 samples, memory-mapped if the cache is on
+    :rtype: numpy.ndarray
+    """
+    cache = get_pcm_cache()
+    if cache is None:
+        from whisper.audio import load_audio
+
+        return load_audio(audio_file)
+    return cache.load(audio_file)
@@ -0,0 +1,213 @@
+"""Overlap downloading, transcribing, and uploading of many media items"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+from unchecked_transcript.batch import (
+    BatchResult,
+    ManifestEntry,
+    make_media_content,
+)
+from unchecked_transcript.mediacontent import MediaContent
+from unchecked_transcript.transcription import Transcription, get_engine
+from unchecked_transcript.upload_html import upload_transcription
+
+log = logging.getLogger()
+
+# Placed on a stage's inbox to tell one of its threads to stop
+_DONE = object()
+
+
+class _Job:
+    """One manifest entry as it moves through the pipeline"""
+
+    result: BatchResult
+    started: float
+    media_content: MediaContent = None
+    transcription: Transcription = None
+
+    def __init__(self, entry: ManifestEntry) -> None:
+        self.result = BatchResult(entry)
+        self.started = time.perf_counter()
+
+    def fail(self, error: Exception) -> None:
+        """Record an error; later stages pass the job through untouched
+
+        :param error: the exception that stopped the job
+        :type error: Exception
+        """
+        log.error("Failed to process %s", self.result.entry, exc_info=error)
+        self.result.status = "error"
+        self.result.error = f"{type(error).__name__}: {error}"
+
+
+class Pipeline:
+    """A staged download → transcribe → render/upload pipeline
+
+    Downloads and uploads are network-bound and run on their own thread
+    pools. Transcription is CPU-bound and runs on dedicated workers, one
+    per transcription the engine can run at once (a single worker for the
+    in-process engine, one per process for a worker pool), so that Whisper
+    has the machine to itself. Bounded queues between the stages let the
+    next items' audio be prefetched while the current item is transcribed
+    and the previous one is uploaded, without downloading the whole backlog
+    ahead of the transcriber.
+    """
+
+    download_workers: int
+    upload_workers: int
+    prefetch: int
+    stdout: bool
+
+    def __init__(
+        self,
+        download_workers: int = 2,
+        upload_workers: int = 2,
+        prefetch: int = 2,
+        stdout: bool = False,
+    ) -> None:
+        if min(download_workers, upload_workers, prefetch) < 1:
+            raise ValueError("Worker counts and prefetch must be at least 1")
+        self.download_workers = download_workers
+        self.upload_workers = upload_workers
+        self.prefetch = prefetch
+        self.stdout = stdout
+        self._print_lock = threading.Lock()
+
+    def _download_stage(self, inbox: queue.Queue, outbox: queue.Queue) -> None:
+        while True:
+            job = inbox.get()
+            if job is _DONE:
+                break
+            try:
+                job.media_content = make_media_content(job.result.entry)
+                job.transcription = Transcription(job.media_content)
+                job.transcription.prefetch()
+            except Exception as error:  # pylint: disable=broad-except
+                job.fail(error)
+            outbox.put(job)
+
+    def _transcribe_stage(
+        self, inbox: queue.Queue, outbox: queue.Queue
+    ) -> None:
+        while True:
+            job = inbox.get()
+            if job is _DONE:
+                break
+            if job.result.status == "pending":
+                try:
+                    # Runs Whisper when the media has no captions
+                    _ = job.transcription.segments
+                except Exception as error:  # pylint: disable=broad-except
+                    job.fail(error)
+            outbox.put(job)
+
+    def _upload_stage(
+        self,
+        inbox: queue.Queue,
+        on_result: Callable[[BatchResult], None],
+    ) -> None:
+        while True:
+            job = inbox.get()
+            if job is _DONE:
+                break
+            if job.result.status == "pending":
+                try:
+                    if self.stdout:
+                        # Render first so pages are not interleaved
+                        transcription_html = job.transcription.html()
+                        with self._print_lock:
+                            print(transcription_html)
+                    else:
+                        job.result.url = upload_transcription(
+                            job.transcription,
+                            folder=job.media_content.s3_path,
+                        )
+                    job.result.status = "ok"
+                except Exception as error:  # pylint: disable=broad-except
+                    job.fail(error)
+            self._finish(job, on_result)
+
+    @staticmethod
+    def _finish(job: _Job, on_result: Callable[[BatchResult], None]) -> None:
+        # The upload threads must keep draining their inbox whatever goes
+        # wrong here, or the earlier stages block on the full queues
+        if job.media_content is not None:
+            try:
+                job.media_content.discard_audio_file()
+            except Exception:  # pylint: disable=broad-except
+                log.exception(
+                    "Could not remove the audio of %s", job.result.entry
+                )
+        job.result.elapsed = time.perf_counter() - job.started
+        try:
+            on_result(job.result)
+        except Exception:  # pylint: disable=broad-except
+            log.exception(
+                "Could not record the result of %s", job.result.entry
+            )
+
+    def run(
+        self,
+        entries: List[ManifestEntry],
+        on_result: Optional[Callable[[BatchResult], None]] = None,
+    ) -> List[BatchResult]:
+        """Process the entries through the pipeline
+
+        :param entries: manifest entries to process
+        :type entries: List[ManifestEntry]
+        :param on_result: called (from an upload thread) as each entry
+            finishes
+        :type on_result: Callable[[BatchResult], None], optional
+        :return: the result of each entry, in manifest order
+        :rtype: List[BatchResult]
+        """
+        jobs = [_Job(entry) for entry in entries]
+        if on_result is None:
+            on_result = lambda result: None  # noqa: E731
+        transcribe_workers = get_engine().concurrency
+
+        to_download: queue.Queue = queue.Queue()
+        to_transcribe: queue.Queue = queue.Queue(maxsize=self.prefetch)
+        to_upload: queue.Queue = queue.Queue(maxsize=self.upload_workers)
+        for job in jobs:
+            to_download.put(job)
+
+        stages = [
+            (self._download_stage, (to_download, to_transcribe), "download"),
+            (self._transcribe_stage, (to_transcribe, to_upload), "transcribe"),
+            (self._upload_stage, (to_upload, on_result), "upload"),
+        ]
+        counts = [
+            self.download_workers,
+            transcribe_workers,
+            self.upload_workers,
+        ]
+        inboxes = [to_download, to_transcribe, to_upload]
+
+        stage_threads = []
+        for (target, args, name), count in zip(stages, counts):
+            threads = [
+                threading.Thread(
+                    target=target,
+                    args=args,
+                    name=f"{name}-{index}",
+                    daemon=True,
+                )
+                for index in range(count)
+            ]
+            for thread in threads:
+                thread.start()
+            stage_threads.append(threads)
+
+        # Shut the stages down in order: once every thread of one stage has
+        # finished, nothing more can arrive in the next stage's inbox.
+        for inbox, threads, count in zip(inboxes, stage_threads, counts):
+            for _ in range(count):
+                inbox.put(_DONE)
+            for thread in threads:
+                thread.join()
+        return [job.result for job in jobs]
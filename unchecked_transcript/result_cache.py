@@ -0,0 +1,191 @@
+"""On-disk cache of Whisper results, keyed by audio content"""
+
+import functools
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from . import get_config
+
+log = logging.getLogger()
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "unchecked-transcript", "results"
+)
+DEFAULT_MAX_MB = 1024
+
+
+def hash_file(path: str, block_size: int = 1 << 20) -> str:
+    """Get the SHA-256 hex digest of a file's contents
+
+    :param path: the file to hash
+    :type path: str
+    :param block_size: bytes read at a time, defaults to 1 MiB
+    :type block_size: int, optional
+    :return: hex digest
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Whisper results stored as gzip-compressed JSON files
+
+    Entries are keyed by a hash of the audio bytes, the engine identity
+    (backend, model, and compute settings), and the transcribe options, so
+    any change to one of them is a cache miss. Reads refresh an entry's
+    modification time and writes evict the least recently used entries
+    until the cache fits in ``max_bytes``.
+    """
+
+    directory: str
+    max_bytes: int
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(audio_hash: str, identity: str, options: dict) -> str:
+        """Build the cache key for a transcription
+
+        :param audio_hash: SHA-256 hex digest of the audio file
+        :type audio_hash: str
+        :param identity: the engine identity
+        :type identity: str
+        :param options: the options passed to transcribe
+        :type options: dict
+        :return: cache key
+        :rtype: str
+        """
+        material = json.dumps(
+            [audio_hash, identity, options], sort_keys=True, default=str
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json.gz")
+
+    def get(self, key: str) -> Optional[dict]:
+        """Get a cached result
+
+        :param key: cache key
+        :type key: str
+        :return: the Whisper result, or None if it is not cached
+        :rtype: dict, optional
+        """
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                result = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            log.warning("Discarding unreadable cache entry %s", path)
+            os.remove(path)
+            return None
+        os.utime(path)
+        log.debug("Result cache hit %s", key)
+        return result
+
+    def put(self, key: str, result: dict) -> None:
+        """Store a result, evicting old entries if the cache is too big
+
+        :param key: cache key
+        :type key: str
+        :param result: the Whisper result
+        :type result: dict
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as file:
+            json.dump(result, file, separators=(",", ":"), default=float)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def entries(self) -> List[Dict[str, object]]:
+        """List the cache entries, least recently used first
+
+        :return: dictionaries with "key", "size", and "used" (epoch) keys
+        :rtype: List[Dict[str, object]]
+        """
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            for item in os.scandir(entry.path):
+                if not item.name.endswith(".json.gz"):
+                    continue
+                stat = item.stat()
+                found.append(
+                    {
+                        "key": item.name[: -len(".json.gz")],
+                        "size": stat.st_size,
+                        "used": stat.st_mtime,
+                    }
+                )
+        found.sort(key=lambda item: item["used"])
+        return found
+
+    def evict(self) -> int:
+        """Remove least recently used entries until under the size limit
+
+        :return: number of entries removed
+        :rtype: int
+        """
+        entries = self.entries()
+        total = sum(entry["size"] for entry in entries)
+        removed = 0
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(self._path(entry["key"]))
+            total -= entry["size"]
+            removed += 1
+        return removed
+
+    def purge(self, older_than: Optional[float] = None) -> int:
+        """Remove entries from the cache
+
+        :param older_than: only remove entries unused for this many seconds
+        :type older_than: float, optional
+        :return: number of entries removed
+        :rtype: int
+        """
+        cutoff = time.time() - older_than if older_than is not None else None
+        removed = 0
+        for entry in self.entries():
+            if cutoff is not None and entry["used"] >= cutoff:
+                continue
+            os.remove(self._path(entry["key"]))
+            removed += 1
+        return removed
+
+
+@functools.lru_cache(maxsize=None)
+def get_result_cache() -> Optional[ResultCache]:
+    """Get the result cache configured in config.yml
+
+    ``result_cache_dir`` sets the cache location and
+    ``result_cache_max_mb`` its size; a size of 0 turns the cache off.
+
+    :return: the cache, or None if it is turned off
+    :rtype: ResultCache, optional
+    """
+    config = get_config()
+    max_mb = config.get("result_cache_max_mb", DEFAULT_MAX_MB)
+    if not max_mb:
+        return None
+    directory = config.get("result_cache_dir", DEFAULT_CACHE_DIR)
+    return ResultCache(os.path.expanduser(directory), int(max_mb) << 20)
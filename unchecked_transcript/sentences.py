@@ -0,0 +1,140 @@
+"""Find sentence ends in transcript segments with spaCy
+
+Segments are joined into documents of a few hundred segments each and
+run through ``nlp.pipe`` in batches, so multi-hour transcripts are never
+one enormous document, and each sentence end is mapped back to the
+segment boundary nearest to it.
+"""
+
+import bisect
+import functools
+import logging
+import re
+from typing import Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+log = logging.getLogger()
+
+# The rule-based sentencizer: no model to load
+SENTENCIZER = "sentencizer"
+
+# Segments joined into each document given to spaCy
+SEGMENTS_PER_DOC = 256
+
+# Documents given to each spaCy worker at a time
+BATCH_SIZE = 32
+
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*$")
+
+
+@functools.lru_cache(maxsize=None)
+def get_pipeline(model: str = SENTENCIZER):
+    """Get a spaCy pipeline that only finds sentence boundaries, on first use
+
+    With "sentencizer", a blank English pipeline with the rule-based
+    sentencizer. Otherwise a trained pipeline such as "en_core_web_lg" is
+    loaded with only its "senter" component enabled (or its parser, if it
+    has no senter); the tagger, lemmatizer, and entity recognizer are not
+    loaded at all.
+
+    :param model: "sentencizer" or the name of an installed pipeline,
+        defaults to "sentencizer"
+    :type model: str, optional
+    :return: the pipeline
+    :rtype: spacy.language.Language
+    """
+    import spacy
+
+    if model == SENTENCIZER:
+        nlp = spacy.blank("en")
+        nlp.add_pipe(SENTENCIZER)
+        return nlp
+
+    nlp = spacy.load(
+        model, exclude=["tagger", "attribute_ruler", "lemmatizer", "ner"]
+    )
+    if "senter" in nlp.component_names:
+        nlp.select_pipes(enable=["senter"])
+        nlp.enable_pipe("senter")
+    else:
+        nlp.select_pipes(
+            enable=[
+                name
+                for name in ("tok2vec", "parser")
+                if name in nlp.pipe_names
+            ]
+        )
+    log.debug("Sentence pipeline %s: %s", model, nlp.pipe_names)
+    return nlp
+
+
+def _documents(
+    texts: Sequence[str], per_doc: int
+) -> Iterator[Tuple[str, int, List[int]]]:
+    # Yields each document's text, first segment, and the character offset
+    # where each of its segments ends
+    for first in range(0, len(texts), per_doc):
+        pieces = []
+        ends = []
+        length = 0
+        for text in texts[first : first + per_doc]:
+            text = text.strip()
+            if pieces:
+                length += 1
+            pieces.append(text)
+            length += len(text)
+            ends.append(length)
+        yield " ".join(pieces), first, ends
+
+
+def spacy_sentence_ends(
+    texts: List[str],
+    model: str = SENTENCIZER,
+    n_process: int = 1,
+    per_doc: int = SEGMENTS_PER_DOC,
+) -> np.ndarray:
+    """Find the segments that end a sentence, with spaCy
+
+    A sentence ending inside a segment is moved to whichever end of that
+    segment is closer. Documents are cut every ``per_doc`` segments; the
+    sentence running across a cut is only ended there if the text before
+    the cut ends in sentence punctuation.
+
+    :param texts: segment texts
+    :type texts: List[str]
+    :param model: the pipeline for ``get_pipeline``, defaults to
+        "sentencizer"
+    :type model: str, optional
+    :param n_process: spaCy worker processes, defaults to 1
+    :type n_process: int, optional
+    :param per_doc: segments in each document, defaults to 256
+    :type per_doc: int, optional
+    :return: indices of segments ending a sentence, ascending
+    :rtype: numpy.ndarray
+    """
+    nlp = get_pipeline(model)
+    documents = list(_documents(texts, per_doc))
+    found = set()
+    docs = nlp.pipe(
+        (text for text, _, _ in documents),
+        batch_size=BATCH_SIZE,
+        n_process=n_process,
+    )
+    for doc, (text, first, ends) in zip(docs, documents):
+        starts = [0] + [end + 1 for end in ends[:-1]]
+        last_document = first + len(ends) >= len(texts)
+        for sentence in doc.sents:
+            boundary = sentence.end_char
+            if (
+                boundary >= len(text.rstrip())
+                and not last_document
+                and not _SENTENCE_END.search(text.rstrip())
+            ):
+                continue
+            index = min(bisect.bisect_left(ends, boundary), len(ends) - 1)
+            if boundary - starts[index] < ends[index] - boundary:
+                index -= 1
+            if first + index >= 0:
+                found.add(first + index)
+    return np.fromiter(sorted(found), dtype=np.intp, count=len(found))
@@ -0,0 +1,450 @@
+"""A long-running transcription service with a persistent job queue
+
+Jobs are manifest entries (see ``batch.read_manifest``) submitted over a
+small HTTP/JSON API and kept in SQLite, so they survive restarts. Worker
+threads take jobs from the queue and process them with the process-wide
+transcription engine, whose model stays loaded between jobs.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from unchecked_transcript.batch import (
+    BatchResult,
+    ManifestEntry,
+    process_entry,
+    validate_entry,
+)
+from unchecked_transcript.transcription import get_engine
+
+log = logging.getLogger()
+
+DEFAULT_QUEUE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "unchecked-transcript", "jobs.sqlite3"
+)
+
+JOB_STATUSES = ["queued", "running", "ok", "error"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    url TEXT,
+    error TEXT,
+    elapsed REAL,
+    claimed_by TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+
+# Tells this run's claims apart from those of an earlier run that had the
+# same PID, as a restarted container's PID 1 does
+_RUN_ID = uuid.uuid4().hex
+
+
+def _worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{_RUN_ID}"
+
+
+def _is_abandoned(claimed_by: Optional[str]) -> bool:
+    # Claims made before run IDs were added have only a host and a PID
+    claim_host, pid, run_id = ((claimed_by or "").split(":") + ["", ""])[:3]
+    if claim_host != socket.gethostname():
+        return False
+    if int(pid or 0) == os.getpid():
+        return run_id != _RUN_ID
+    return not _pid_alive(int(pid or 0))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Transcription jobs stored in a SQLite database
+
+    Several processes may share one database; a job is claimed inside an
+    immediate transaction, so each job goes to exactly one worker.
+    """
+
+    path: str
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_SCHEMA)
+
+    @staticmethod
+    def _as_dict(row: sqlite3.Row) -> Dict[str, object]:
+        job = dict(row)
+        job["entry"] = json.loads(job["entry"])
+        del job["claimed_by"]
+        return job
+
+    def submit(self, entry: ManifestEntry) -> int:
+        """Add a job to the end of the queue
+
+        :param entry: the manifest entry to process
+        :type entry: ManifestEntry
+        :raises ValueError: if the entry is missing fields
+        :return: the job ID
+        :rtype: int
+        """
+        validate_entry(entry)
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO jobs (entry, created) VALUES (?, ?)",
+                (json.dumps(entry), time.time()),
+            )
+        return cursor.lastrowid
+
+    def claim(self) -> Optional[Dict[str, object]]:
+        """Take the oldest queued job and mark it running
+
+        :return: the job, or None if the queue is empty
+        :rtype: Dict[str, object], optional
+        """
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued'"
+                    " ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE jobs SET status = 'running', started = ?,"
+                        " claimed_by = ? WHERE id = ?",
+                        (time.time(), _worker_name(), row["id"]),
+                    )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = self._as_dict(row)
+        job["status"] = "running"
+        return job
+
+    def complete(self, job_id: int, result: BatchResult) -> None:
+        """Record the outcome of a job
+
+        :param job_id: the job ID
+        :type job_id: int
+        :param result: the outcome of processing the job's entry
+        :type result: BatchResult
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, url = ?, error = ?, elapsed = ?,"
+                " finished = ? WHERE id = ?",
+                (
+                    result.status,
+                    result.url,
+                    result.error,
+                    result.elapsed,
+                    time.time(),
+                    job_id,
+                ),
+            )
+
+    def get(self, job_id: int) -> Optional[Dict[str, object]]:
+        """Get a job
+
+        :param job_id: the job ID
+        :type job_id: int
+        :return: the job, or None if there is no such job
+        :rtype: Dict[str, object], optional
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._as_dict(row) if row is not None else None
+
+    def jobs(
+        self, status: str = None, limit: int = 100
+    ) -> List[Dict[str, object]]:
+        """List jobs, most recent first
+
+        :param status: only list jobs with this status
+        :type status: str, optional
+        :param limit: most jobs to list, defaults to 100
+        :type limit: int, optional
+        :return: the jobs
+        :rtype: List[Dict[str, object]]
+        """
+        query = "SELECT * FROM jobs"
+        parameters = []
+        if status is not None:
+            query += " WHERE status = ?"
+            parameters.append(status)
+        query += " ORDER BY id DESC LIMIT ?"
+        parameters.append(limit)
+        with self._lock:
+            rows = self._connection.execute(query, parameters).fetchall()
+        return [self._as_dict(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        """Count the jobs in each status
+
+        :return: number of jobs per status
+        :rtype: Dict[str, int]
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def requeue_abandoned(self) -> int:
+        """Put back jobs left running by a process on this host that died
+
+        That includes an earlier run of a service that was restarted with
+        the same PID as this process.
+
+        :return: number of jobs requeued
+        :rtype: int
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, claimed_by FROM jobs WHERE status = 'running'"
+            ).fetchall()
+            abandoned = [
+                (job_id,)
+                for job_id, claimed_by in rows
+                if _is_abandoned(claimed_by)
+            ]
+            self._connection.executemany(
+                "UPDATE jobs SET status = 'queued', started = NULL,"
+                " claimed_by = NULL WHERE id = ?",
+                abandoned,
+            )
+        return len(abandoned)
+
+    def close(self) -> None:
+        """Close the database connection"""
+        with self._lock:
+            self._connection.close()
+
+
+class TranscriptionService:
+    """Worker threads that process jobs from a queue until stopped
+
+    There is one worker per transcription the engine can run at once, and
+    the model is loaded before the first job arrives.
+    """
+
+    queue: JobQueue
+    stdout: bool
+    poll_seconds: float
+
+    def __init__(
+        self, queue: JobQueue, stdout: bool = False, poll_seconds: float = 5.0
+    ) -> None:
+        self.queue = queue
+        self.stdout = stdout
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def notify(self) -> None:
+        """Wake a worker to look for a newly submitted job"""
+        with self._wake:
+            self._wake.notify()
+
+    def _fail(self, job: Dict[str, object], error: Exception) -> None:
+        result = BatchResult(job["entry"])
+        result.status = "error"
+        result.error = f"{type(error).__name__}: {error}"
+        try:
+            self.queue.complete(job["id"], result)
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Could not mark job %d failed", job["id"])
+
+    def _work(self) -> None:
+        # A failure is logged and the worker carries on with the next job,
+        # so that one bad job or a locked database does not stop the service
+        while not self._stopping.is_set():
+            job = None
+            try:
+                job = self.queue.claim()
+                if job is None:
+                    # Other processes may add jobs too, so look again now
+                    # and then
+                    with self._wake:
+                        self._wake.wait(self.poll_seconds)
+                    continue
+                log.info("Starting job %d", job["id"])
+                result = process_entry(job["entry"], stdout=self.stdout)
+                self.queue.complete(job["id"], result)
+                log.info("Finished job %d: %s", job["id"], result.status)
+            except Exception as error:  # pylint: disable=broad-except
+                if job is None:
+                    log.exception("Could not claim a job")
+                else:
+                    log.exception("Job %d failed", job["id"])
+                    self._fail(job, error)
+                # Give a failing database time to recover
+                self._stopping.wait(self.poll_seconds)
+
+    def start(self) -> None:
+        """Load the model and start the workers"""
+        requeued = self.queue.requeue_abandoned()
+        if requeued:
+            log.warning("Requeued %d jobs of a stopped process", requeued)
+        engine = get_engine()
+        backend = getattr(engine, "backend", None)
+        if backend is not None:
+            _ = backend.model
+        for index in range(engine.concurrency):
+            thread = threading.Thread(
+                target=self._work, name=f"service-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Stop the workers once their current jobs finish"""
+        self._stopping.set()
+        with self._wake:
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "ServiceServer"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        log.debug("%s %s", self.address_string(), format % args)
+
+    def _send(self, status: HTTPStatus, body: object) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Get the service health, a list of jobs, or one job"""
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        job_queue = self.server.service.queue
+        if parts == ["health"]:
+            self._send(
+                HTTPStatus.OK, {"status": "ok", "jobs": job_queue.counts()}
+            )
+        elif parts == ["jobs"]:
+            query = parse_qs(url.query)
+            status = query.get("status", [None])[0]
+            try:
+                limit = int(query.get("limit", ["100"])[0])
+            except ValueError:
+                self._send(HTTPStatus.BAD_REQUEST, {"error": "Bad limit"})
+                return
+            self._send(HTTPStatus.OK, job_queue.jobs(status, limit))
+        elif len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            job = job_queue.get(int(parts[1]))
+            if job is None:
+                self._send(HTTPStatus.NOT_FOUND, {"error": "No such job"})
+            else:
+                self._send(HTTPStatus.OK, job)
+        else:
+            self._send(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """Submit a job, given a manifest entry as a JSON object"""
+        if urlparse(self.path).path.rstrip("/") != "/jobs":
+            self._send(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            entry = json.loads(self.rfile.read(length))
+            if not isinstance(entry, dict):
+                raise ValueError("Job must be a JSON object")
+            job_id = self.server.service.queue.submit(entry)
+        except ValueError as error:
+            self._send(HTTPStatus.BAD_REQUEST, {"error": str(error)})
+            return
+        self.server.service.notify()
+        self._send(
+            HTTPStatus.ACCEPTED,
+            {"id": job_id, "status": "queued", "href": f"/jobs/{job_id}"},
+        )
+
+
+class ServiceServer(ThreadingHTTPServer):
+    """The HTTP/JSON API of a transcription service
+
+    * ``POST /jobs`` with a manifest entry as a JSON object queues a job
+    * ``GET /jobs/<id>`` gets a job's status and result
+    * ``GET /jobs?status=<status>&limit=<n>`` lists jobs, newest first
+    * ``GET /health`` counts the jobs in each status
+    """
+
+    daemon_threads = True
+    service: TranscriptionService
+
+    def __init__(self, address, service: TranscriptionService) -> None:
+        super().__init__(address, _Handler)
+        self.service = service
+
+
+def serve(host: str, port: int, queue_path: str, stdout: bool = False) -> None:
+    """Run the service until interrupted
+
+    :param host: address to listen on
+    :type host: str
+    :param port: port to listen on
+    :type port: int
+    :param queue_path: SQLite database holding the job queue
+    :type queue_path: str
+    :param stdout: print the HTML instead of uploading it to S3
+    :type stdout: bool, optional
+    """
+    job_queue = JobQueue(queue_path)
+    service = TranscriptionService(job_queue, stdout=stdout)
+    service.start()
+    server = ServiceServer((host, port), service)
+    log.warning("Listening on http://%s:%d", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.warning("Stopping; waiting for running jobs to finish")
+    finally:
+        server.server_close()
+        service.stop()
+        job_queue.close()
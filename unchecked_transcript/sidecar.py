@@ -0,0 +1,89 @@
+"""Transcript data kept outside the page, with a prebuilt search index
+
+In sidecar mode a page is a small shell that loads ``transcript.json``
+from its own folder. The file holds the condensed transcript as parallel
+arrays and an inverted index from each term to the entries containing it,
+so the page can search without scanning its DOM.
+"""
+
+import gzip
+import io
+import json
+import re
+import unicodedata
+from typing import BinaryIO, Dict, List
+
+SIDECAR_NAME = "transcript.json"
+
+PAGE_MODES = ["inline", "compact", "sidecar"]
+
+# Bumped when the layout of the document changes
+SIDECAR_VERSION = 1
+
+# The page's search box matches terms with [\p{L}\p{N}_]+, the same
+# characters as \w: letters, digits, and underscores, but not marks
+_TERM = re.compile(r"\w+")
+
+
+def terms(text: str) -> List[str]:
+    """Split text into the terms used by the search index
+
+    The page's search box splits queries the same way. Text is normalized
+    to NFC first, so that an accented letter written with a combining mark
+    is one term, as in the query.
+
+    :param text: the text
+    :type text: str
+    :return: lowercase runs of letters, digits, and underscores
+    :rtype: List[str]
+    """
+    return _TERM.findall(unicodedata.normalize("NFC", text).lower())
+
+
+def build_sidecar(entries: List[dict], start_times: List[float]) -> dict:
+    """Build the sidecar document for a condensed transcript
+
+    :param entries: condensed entries, from
+        ``Transcription.condense_segments``
+    :type entries: List[dict]
+    :param start_times: the start time of each entry
+    :type start_times: List[float]
+    :return: a document with "start_times", "start_display", and "text"
+        arrays, the text normalized to NFC as the page searches it, and
+        the index as a sorted "terms" array with a "postings" array of the
+        ascending entry numbers for each term
+    :rtype: dict
+    """
+    postings: Dict[str, List[int]] = {}
+    for number, entry in enumerate(entries):
+        for term in set(terms(entry["text"])):
+            postings.setdefault(term, []).append(number)
+    index_terms = sorted(postings)
+    return {
+        "version": SIDECAR_VERSION,
+        "start_times": list(start_times),
+        "start_display": [entry["start_display"] for entry in entries],
+        "text": [
+            unicodedata.normalize("NFC", entry["text"]) for entry in entries
+        ],
+        "terms": index_terms,
+        "postings": [postings[term] for term in index_terms],
+    }
+
+
+def write_sidecar(document: dict, file: BinaryIO) -> None:
+    """Write a sidecar document as gzip-compressed JSON
+
+    ``file`` is left open.
+
+    :param document: from ``build_sidecar``
+    :type document: dict
+    :param file: binary file to write to
+    :type file: BinaryIO
+    """
+    # mtime=0 makes the output depend only on the document
+    with gzip.GzipFile(fileobj=file, mode="wb", mtime=0) as compressed:
+        text = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+        json.dump(document, text, ensure_ascii=False, separators=(",", ":"))
+        text.flush()
+        text.detach()
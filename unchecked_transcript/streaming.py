@@ -0,0 +1,280 @@
+"""Transcribe audio as it is downloaded and decoded, window by window"""
+
+import logging
+import queue
+import subprocess
+import threading
+from typing import Iterator, Tuple
+
+import numpy as np
+from whisper.audio import SAMPLE_RATE
+
+from unchecked_transcript.chunking import (
+    FRAME_SECONDS,
+    _frame_energy,
+    stitch_results,
+)
+from unchecked_transcript.media_cache import get_session
+
+log = logging.getLogger()
+
+CHUNK_SIZE = 64 << 10
+TIMEOUT = 30
+
+# Decoded windows allowed to wait for the model
+WINDOW_QUEUE_SIZE = 2
+
+_END = object()
+
+
+def _is_url(audio: str) -> bool:
+    return audio.lower().startswith(("http://", "https://"))
+
+
+def _feed(url: str, stdin, errors: list) -> None:
+    try:
+        with get_session().get(url, stream=True, timeout=TIMEOUT) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(CHUNK_SIZE):
+                stdin.write(chunk)
+    except BrokenPipeError:
+        # ffmpeg stopped reading; its exit status reports why
+        pass
+    except Exception as error:  # pylint: disable=broad-except
+        errors.append(error)
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+
+def decode_pcm(
+    source: str, block_seconds: float = 1.0
+) -> Iterator[np.ndarray]:
+    """Decode audio to 16 kHz mono float32 samples as it arrives
+
+    A URL is downloaded on a background thread and piped into ffmpeg, so
+    decoding starts with the first bytes; a path is read by ffmpeg itself.
+
+    :param source: URL or path of the audio
+    :type source: str
+    :param block_seconds: length of each block of samples, defaults to 1.0
+    :type block_seconds: float, optional
+    :raises RuntimeError: if the download or ffmpeg fails
+    :return: consecutive blocks of samples
+    :rtype: Iterator[np.ndarray]
+    """
+    url = _is_url(source)
+    command = [
+        "ffmpeg",
+        "-nostdin",
+        "-loglevel",
+        "error",
+        "-i",
+        "pipe:0" if url else source,
+        "-f",
+        "s16le",
+        "-ac",
+        "1",
+        "-ar",
+        str(SAMPLE_RATE),
+        "pipe:1",
+    ]
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE if url else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    errors = []
+    feeder = None
+    if url:
+        feeder = threading.Thread(
+            target=_feed,
+            args=(source, process.stdin, errors),
+            name="stream-download",
+            daemon=True,
+        )
+        feeder.start()
+    block_bytes = int(block_seconds * SAMPLE_RATE) * 2
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            samples = np.frombuffer(data[: len(data) // 2 * 2], np.int16)
+            yield samples.astype(np.float32) / 32768.0
+    finally:
+        process.stdout.close()
+        if feeder is not None:
+            feeder.join()
+        stderr = process.stderr.read().decode("utf-8", "replace")
+        process.stderr.close()
+        status = process.wait()
+    if errors:
+        raise RuntimeError(f"Failed to download {source}") from errors[0]
+    if status != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {source}: {stderr}")
+
+
+def windows(
+    blocks: Iterator[np.ndarray],
+    window_seconds: float = 30.0,
+    overlap_seconds: float = 2.0,
+    search_seconds: float = 5.0,
+) -> Iterator[Tuple[Tuple[int, int, int], np.ndarray]]:
+    """Gather decoded blocks into windows cut at quiet points
+
+    Each window ends at the quietest frame in its last ``search_seconds``
+    and runs ``overlap_seconds`` past that cut, in the same (start, cut,
+    end) form as ``chunking.find_chunks``. No more than one window and one
+    block of samples are held at a time.
+
+    :param blocks: consecutive blocks of 16 kHz samples
+    :type blocks: Iterator[np.ndarray]
+    :param window_seconds: longest window, defaults to 30.0 (Whisper's
+        context length)
+    :type window_seconds: float, optional
+    :param overlap_seconds: audio shared by adjacent windows, defaults to 2.0
+    :type overlap_seconds: float, optional
+    :param search_seconds: how far before the window's end a cut may move,
+        defaults to 5.0
+    :type search_seconds: float, optional
+    :return: (start, cut, end) sample offsets in the whole stream, and the
+        window's samples
+    :rtype: Iterator[Tuple[Tuple[int, int, int], np.ndarray]]
+    """
+    frame = int(FRAME_SECONDS * SAMPLE_RATE)
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+    length = int(window_seconds * SAMPLE_RATE) - overlap
+    search = int(search_seconds * SAMPLE_RATE)
+    buffer = np.zeros(0, dtype=np.float32)
+    offset = 0
+    for block in blocks:
+        buffer = np.concatenate((buffer, block))
+        while len(buffer) >= length + overlap:
+            low = max(frame, length - search)
+            energy = _frame_energy(buffer, low, length)
+            cut = low + int(np.argmin(energy)) * frame
+            end = cut + overlap
+            yield (offset, offset + cut, offset + end), buffer[:end]
+            buffer = buffer[cut:]
+            offset += cut
+    if len(buffer):
+        end = offset + len(buffer)
+        yield (offset, end, end), buffer
+
+
+class StreamingTranscriber:
+    """Transcription engine that transcribes audio while it downloads
+
+    Wraps another engine. Given a URL or path, the audio is decoded by
+    ffmpeg into windows of at most ``window_seconds`` that are transcribed
+    one after another while later windows download and decode, and the
+    results are stitched into the segment shape of a single Whisper call.
+    Memory use depends on the window length, not on the length of the
+    episode. Waveforms are passed straight to the wrapped engine.
+
+    A download is paced by transcription: while the model works, at most
+    a couple of decoded windows wait for it.
+    """
+
+    window_seconds: float
+    overlap_seconds: float
+    accepts_urls = True
+
+    def __init__(
+        self,
+        engine,
+        window_seconds: float = 30.0,
+        overlap_seconds: float = 2.0,
+    ) -> None:
+        self._engine = engine
+        self.window_seconds = window_seconds
+        self.overlap_seconds = overlap_seconds
+
+    @property
+    def identity(self) -> str:
+        """The wrapped engine's identity and the window length
+
+        :return: what produces the results
+        :rtype: str
+        """
+        return f"{self._engine.identity}:stream={self.window_seconds:g}"
+
+    @property
+    def concurrency(self) -> int:
+        """The number of transcriptions the wrapped engine runs at once
+
+        :return: the wrapped engine's concurrency
+        :rtype: int
+        """
+        return self._engine.concurrency
+
+    def _decode(
+        self,
+        source: str,
+        out: queue.Queue,
+        stop: threading.Event,
+        errors: list,
+    ) -> None:
+        blocks = decode_pcm(source)
+        try:
+            for window in windows(
+                blocks,
+                window_seconds=self.window_seconds,
+                overlap_seconds=self.overlap_seconds,
+            ):
+                if stop.is_set():
+                    break
+                out.put(window)
+        except Exception as error:  # pylint: disable=broad-except
+            errors.append(error)
+        finally:
+            # Stops ffmpeg and the download if transcription gave up early
+            blocks.close()
+            out.put(_END)
+
+    def transcribe(self, audio, **options) -> dict:
+        """Transcribe audio window by window as it arrives
+
+        :param audio: URL or path of the audio, or a 16 kHz waveform
+        :type audio: str or np.ndarray
+        :return: the Whisper result, with "text", "segments", and
+            "language" keys
+        :rtype: dict
+        """
+        if not isinstance(audio, str):
+            return self._engine.transcribe(audio, **options)
+
+        decoded = queue.Queue(maxsize=WINDOW_QUEUE_SIZE)
+        stop = threading.Event()
+        errors = []
+        decoder = threading.Thread(
+            target=self._decode,
+            args=(audio, decoded, stop, errors),
+            name="stream-decode",
+            daemon=True,
+        )
+        decoder.start()
+        results, chunks = [], []
+        window = None
+        try:
+            while True:
+                window = decoded.get()
+                if window is _END:
+                    break
+                chunk, samples = window
+                log.debug("Transcribing samples %d-%d", chunk[0], chunk[2])
+                results.append(self._engine.transcribe(samples, **options))
+                chunks.append(chunk)
+        finally:
+            if window is not _END:
+                stop.set()
+                while decoded.get() is not _END:
+                    pass
+        decoder.join()
+        if errors:
+            raise errors[0]
+        return stitch_results(results, chunks)
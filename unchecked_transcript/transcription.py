@@ -1,36 +1,237 @@
 """A Transcription"""
 
+import functools
 import logging
-import time
-from typing import Dict, List, Tuple, Union
-
-import jinja2
-import whisper
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+from unchecked_transcript import get_config
+from unchecked_transcript.backends import (
+    TranscriptionBackend,
+    backend_settings,
+    get_backend,
+)
+from unchecked_transcript.instrumentation import audio_duration, span
 from unchecked_transcript.mediacontent import MediaContent
+from unchecked_transcript.result_cache import get_result_cache, hash_file
 
 TranscriptEntry = Dict[str, Union[float, str]]
 
 log = logging.getLogger()
 
+DEFAULT_TEMPLATE_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "unchecked-transcript", "templates"
+)
+
+
+@functools.lru_cache(maxsize=None)
+def get_jinja_env():
+    """Get the Jinja environment shared by every page rendered in this process
+
+    Templates are compiled once per process and kept in memory. Compiled
+    bytecode is also written to ``template_cache_dir`` in config.yml
+    (default ~/.cache/unchecked-transcript/templates), so later processes
+    skip compiling; an empty ``template_cache_dir`` turns that off.
+
+    :return: the environment
+    :rtype: jinja2.Environment
+    """
+    import jinja2
+
+    directory = get_config().get(
+        "template_cache_dir", DEFAULT_TEMPLATE_CACHE_DIR
+    )
+    bytecode_cache = None
+    if directory:
+        directory = os.path.expanduser(directory)
+        os.makedirs(directory, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(directory)
+    return jinja2.Environment(
+        loader=jinja2.PackageLoader("unchecked_transcript"),
+        autoescape=jinja2.select_autoescape(),
+        bytecode_cache=bytecode_cache,
+        # The templates ship with the package and do not change while
+        # a process runs
+        auto_reload=False,
+    )
+
+
+class InProcessEngine:
+    """Transcription engine that runs a backend in the calling process"""
+
+    backend: TranscriptionBackend
+    concurrency: int = 1
+
+    def __init__(self, backend: TranscriptionBackend) -> None:
+        self.backend = backend
+
+    @property
+    def identity(self) -> str:
+        """What produces this engine's results, for the result cache
+
+        :return: the backend's identity
+        :rtype: str
+        """
+        return self.backend.identity
+
+    def transcribe(self, audio, **options) -> dict:
+        """Transcribe an audio file
+
+        :param audio: path to the audio file, or a 16 kHz waveform
+        :type audio: str or numpy.ndarray
+        :return: the Whisper result, with "text" and "segments" keys
+        :rtype: dict
+        """
+        return self.backend.transcribe(audio, **options)
+
+
+_engine = None
+
+
+def get_engine():
+    """Get the engine used by every Transcription in this process
+
+    :return: the engine set with ``set_engine``, or an in-process engine
+        for the backend configured in config.yml
+    :rtype: InProcessEngine or WhisperWorkerPool
+    """
+    global _engine  # pylint: disable=global-statement
+    if _engine is None:
+        settings = backend_settings()
+        _engine = InProcessEngine(get_backend(**settings))
+    return _engine
+
+
+def set_engine(engine) -> None:
+    """Set the engine used by every Transcription in this process
+
+    An engine is any object with a ``transcribe(audio, **options)`` method
+    returning a Whisper result, an ``identity`` attribute naming what
+    produces the results, and a ``concurrency`` attribute giving the number
+    of transcriptions it can run at once. An engine whose ``accepts_urls``
+    attribute is true is given the media's audio URL instead of a
+    downloaded file.
+
+    :param engine: the engine, or None to go back to the default engine
+    :type engine: InProcessEngine or WhisperWorkerPool
+    """
+    global _engine  # pylint: disable=global-statement
+    _engine = engine
+
+
+def minify_lines(
+    chunks: Iterable[str], block_size: int = 64 << 10
+) -> Iterator[str]:
+    """Strip the indentation and blank lines from rendered HTML
+
+    Line breaks are kept, so inline scripts with ``//`` comments or
+    without semicolons still work. The templates have no ``<pre>`` or
+    ``<textarea>`` elements, whose whitespace would matter. Chunks are
+    gathered into blocks of about ``block_size`` characters, so a page
+    is still never held whole.
+
+    :param chunks: the page, in pieces
+    :type chunks: Iterable[str]
+    :param block_size: characters gathered before minifying, defaults to
+        64 KiB
+    :type block_size: int, optional
+    :return: the minified page, in pieces
+    :rtype: Iterator[str]
+    """
+    pending = []
+    size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        size += len(chunk)
+        if size < block_size:
+            continue
+        lines = "".join(pending).split("\n")
+        pending, size = [lines[-1]], len(lines[-1])
+        text = "\n".join(filter(None, map(str.strip, lines[:-1])))
+        if text:
+            yield text + "\n"
+    lines = "".join(pending).split("\n")
+    text = "\n".join(filter(None, map(str.strip, lines)))
+    if text:
+        yield text
+
 
 class Transcription:
     """A transcription"""
 
     _media_content: MediaContent
     _result = None
+    _condensed = None
 
     def __init__(self, media_content: MediaContent) -> None:
         self._media_content = media_content
 
     def _whisper_results(self) -> dict:
         if self._result is None:
-            model = whisper.load_model("base")
-            self._result = model.transcribe(
-                self._media_content.audio_file, language="en", fp16=False
-            )
+            engine = get_engine()
+            if getattr(engine, "accepts_urls", False):
+                self._result = self._streamed_results(engine)
+                return self._result
+            audio_file = self._media_content.audio_file
+            options = {"language": "en"}
+            cache = get_result_cache()
+            key = None
+            if cache is not None:
+                key = cache.make_key(
+                    hash_file(audio_file), engine.identity, options
+                )
+                self._result = cache.get(key)
+            if self._result is None:
+                with span(
+                    "transcribe",
+                    engine=engine.identity,
+                    audio_seconds=audio_duration(audio_file),
+                ):
+                    self._result = engine.transcribe(audio_file, **options)
+                if cache is not None:
+                    cache.put(key, self._result)
         return self._result
 
+    def _streamed_results(self, engine) -> dict:
+        # Nothing is downloaded before transcribing, so results are cached
+        # by the media's URL rather than a hash of the audio
+        options = {"language": "en"}
+        cache = get_result_cache()
+        key = None
+        if cache is not None:
+            key = cache.make_key(
+                "url:" + self._media_content.source_url,
+                engine.identity,
+                options,
+            )
+            result = cache.get(key)
+            if result is not None:
+                return result
+        with span("transcribe", engine=engine.identity) as transcribe_span:
+            result = engine.transcribe(
+                self._media_content.audio_url, **options
+            )
+            if result["segments"]:
+                transcribe_span.set(
+                    audio_seconds=result["segments"][-1]["end"]
+                )
+        if cache is not None:
+            cache.put(key, result)
+        return result
+
+    def prefetch(self) -> None:
+        """Fetch the inputs the transcription needs without transcribing
+
+        Caption-supplied media needs nothing more; otherwise the audio file
+        is downloaded so a later call to Whisper does not wait on the
+        network. An engine that streams audio from its URL needs no
+        download.
+        """
+        if self._media_content.segments:
+            return
+        if not getattr(get_engine(), "accepts_urls", False):
+            _ = self._media_content.audio_file
+
     @property
     def text(self) -> str:
         """The plaintext transcript
@@ -64,77 +265,129 @@ class Transcription:
         return self._whisper_results()["segments"]
 
     def condense_segments(
-        self, min_length: float = 23.0
+        self, min_length: float = 23.0, policy: str = None
     ) -> Tuple[List[TranscriptEntry], List[float]]:
         """Condense the transcript entries to a minimum length
 
-        :param min_length: minimum length, defaults to 23.0
+        :param min_length: minimum length in seconds, defaults to 23.0
         :type min_length: float, optional
-        :return: _description_
+        :param policy: how to group entries, one of
+            ``condense.POLICIES``; defaults to ``condense_policy`` in
+            config.yml, or "duration". For the sentence policy,
+            ``sentence_boundaries: spacy`` in config.yml finds sentences
+            with ``sentences.spacy_sentence_ends`` instead of punctuation
+        :type policy: str, optional
+        :return: the condensed entries and the start time of each
         :rtype: Tuple[List[TranscriptEntry], List[float]]
         """
-        condensed_transcript: List[TranscriptEntry] = []
-        start_times: List[float] = []
-        condensed_entry: TranscriptEntry = None
+        from unchecked_transcript import condense
 
+        config = get_config()
+        if policy is None:
+            policy = config.get("condense_policy", "duration")
+        find_sentence_ends = condense.sentence_ends
+        if config.get("sentence_boundaries", "punctuation") == "spacy":
+            from unchecked_transcript import sentences
+
+            find_sentence_ends = functools.partial(
+                sentences.spacy_sentence_ends,
+                model=config.get("sentence_model", sentences.SENTENCIZER),
+                n_process=config.get("sentence_processes", 1),
+            )
         video_segments = self.segments
-        for entry in video_segments:
-            try:
-                start = float(entry.get("start"))
-                duration = float(entry.get("end") - start)
-                text = entry.get("text", "")
-            except ValueError:
-                continue
-
-            text = text.replace("\n", " ").lstrip()
-
-            if condensed_entry is None:
-                condensed_entry = {
-                    "start": start,
-                    "start_display": time.strftime(
-                        "%H:%M:%S",
-                        time.gmtime(entry.get("start", 0)),
-                    ),
-                    "text": text,
-                    "duration": duration,
-                }
-            else:
-                condensed_entry["duration"] += duration
-                condensed_entry["text"] += " " + text
-
-            # If the length of the condensed entry is over the minimum length in seconds _or_
-            # this is the last segment of the transcript, append the condensed entry to the list.
-            if (
-                condensed_entry.get("duration", 0) >= min_length
-                or entry == video_segments[-1]
-            ):
-                condensed_start = condensed_entry.get("start", 0)
-                start_times.append(condensed_start)
-
-                condensed_transcript.append(condensed_entry)
-                condensed_entry = None
-        return condensed_transcript, start_times
+        with span("condense", segments=len(video_segments), policy=policy):
+            return condense.condense(
+                video_segments,
+                policy=policy,
+                min_length=min_length,
+                min_characters=config.get(
+                    "condense_min_characters", condense.DEFAULT_MIN_CHARACTERS
+                ),
+                find_sentence_ends=find_sentence_ends,
+            )
 
-    def html(self) -> str:
-        """Render HTML page using Jinja2 template specified by MediaContent
+    def _condensed_transcript(
+        self,
+    ) -> Tuple[List[TranscriptEntry], List[float]]:
+        # Shared by the page and its sidecar so segments are condensed once
+        if self._condensed is None:
+            self._condensed = self.condense_segments()
+        return self._condensed
 
-        :return: the HTML page
-        :rtype: str
+    @property
+    def has_shell(self) -> bool:
+        """Whether the media can be rendered as a shell page with a sidecar
+
+        :return: True if the MediaContent has a shell template
+        :rtype: bool
+        """
+        return self._media_content.shell_template is not None
+
+    def sidecar(self) -> dict:
+        """Build the transcript data and search index loaded by the shell page
+
+        :return: the document, from ``sidecar.build_sidecar``
+        :rtype: dict
         """
-        jinja_env = jinja2.Environment(
-            loader=jinja2.PackageLoader("unchecked_transcript"),
-            autoescape=jinja2.select_autoescape(),
-        )
-        template = jinja_env.get_template(self._media_content.html_template)
+        from unchecked_transcript.sidecar import build_sidecar
+
+        condensed_transcript, start_times = self._condensed_transcript()
+        with span("sidecar", entries=len(condensed_transcript)):
+            return build_sidecar(condensed_transcript, start_times)
+
+    def html_chunks(
+        self, sidecar_url: Optional[str] = None, compact: bool = None
+    ) -> Iterator[str]:
+        """Render the HTML page in pieces, using the MediaContent's template
+
+        The page is generated as it is consumed, so it never has to be held
+        in memory as a whole; the render span covers the consumer's work
+        on the pieces too.
 
+        :param sidecar_url: render the MediaContent's shell template, which
+            loads the transcript from this URL, instead of the full page
+        :type sidecar_url: str, optional
+        :param compact: render the MediaContent's compact template and
+            minify the page; defaults to whether ``page_mode`` in
+            config.yml is "compact"
+        :type compact: bool, optional
+        :return: the HTML page, in order
+        :rtype: Iterator[str]
+        """
+        if compact is None:
+            compact = get_config().get("page_mode", "inline") == "compact"
         media_metadata = self._media_content.media_metadata
-        condensed_transcript, start_times = self.condense_segments()
+        if sidecar_url is None:
+            template_name = self._media_content.html_template
+            if compact:
+                template_name = (
+                    self._media_content.compact_template or template_name
+                )
+            condensed_transcript, start_times = self._condensed_transcript()
+            placeholders = {
+                **media_metadata,
+                "transcript": condensed_transcript,
+                "start_times": f"[ {','.join(str(x) for x in start_times)} ]",
+            }
+        else:
+            template_name = self._media_content.shell_template
+            placeholders = {**media_metadata, "sidecar_url": sidecar_url}
+        template = get_jinja_env().get_template(template_name)
+        chunks = template.generate(placeholders)
+        if compact:
+            chunks = minify_lines(chunks)
+
+        with span("render", template=template_name) as render_span:
+            size = 0
+            for chunk in chunks:
+                size += len(chunk.encode("utf-8"))
+                yield chunk
+            render_span.set(bytes=size)
 
-        placeholders = {
-            **media_metadata,
-            "transcript": condensed_transcript,
-            "start_times": f"[ {','.join(str(x) for x in start_times)} ]",
-        }
+    def html(self) -> str:
+        """Render HTML page using Jinja2 template specified by MediaContent
 
-        html = template.render(placeholders)
-        return html
+        :return: the HTML page
+        :rtype: str
+        """
+        return "".join(self.html_chunks())
@@ -1,33 +1,310 @@
 """Upload HTML to S3"""
 
+import functools
+import gzip
+import hashlib
+import io
 import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterable, List, Tuple, Union
 
-from . import aws_session, config
+from . import get_aws_session, get_config
+from .instrumentation import span
+from .sidecar import PAGE_MODES, SIDECAR_NAME, write_sidecar
 
 log = logging.getLogger()
 
+CONTENT_ENCODINGS = ["identity", "gzip", "br"]
 
-def upload_html(html_string: str, folder: str) -> str:
+# Pages up to this size are buffered in memory; larger ones spill to disk
+SPOOL_BYTES = 8 << 20
+
+DEFAULT_MAX_POOL_CONNECTIONS = 32
+
+# Object metadata holding the SHA-256 of the stored body
+HASH_METADATA_KEY = "content-sha256"
+
+
+@functools.lru_cache(maxsize=None)
+def get_s3_client():
+    """Get the S3 client shared by every upload in this process
+
+    boto3 clients are thread-safe, so upload threads share this one and
+    its connection pool. ``s3_max_pool_connections`` in config.yml sizes
+    the pool (default 32); failed requests are retried with backoff.
+
+    :return: the client
+    :rtype: botocore.client.S3
+    """
+    from botocore.config import Config
+
+    max_pool_connections = get_config().get(
+        "s3_max_pool_connections", DEFAULT_MAX_POOL_CONNECTIONS
+    )
+    return get_aws_session().client(
+        "s3",
+        config=Config(
+            max_pool_connections=max_pool_connections,
+            retries={"max_attempts": 5, "mode": "adaptive"},
+        ),
+    )
+
+
+def _hash_file(file: BinaryIO, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    file.seek(0)
+    for block in iter(lambda: file.read(block_size), b""):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def _stored_hash(client, bucket: str, key: str) -> str:
+    from botocore.exceptions import ClientError
+
+    try:
+        response = client.head_object(Bucket=bucket, Key=key)
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+    return response.get("Metadata", {}).get(HASH_METADATA_KEY)
+
+
+class _BrotliWriter(io.RawIOBase):
+    """Brotli-compress everything written, into another binary file
+
+    Requires the optional ``brotli`` package.
+    """
+
+    def __init__(self, file: BinaryIO) -> None:
+        import brotli
+
+        super().__init__()
+        self._file = file
+        self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._file.write(self._compressor.process(bytes(data)))
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.write(self._compressor.finish())
+        super().close()
+
+
+def write_html(
+    chunks: Iterable[str], file: BinaryIO, content_encoding: str = "identity"
+) -> None:
+    """Encode HTML as UTF-8 and compress it into a binary file, chunk by chunk
+
+    Only a small write buffer is held at a time, so a page never has to be
+    in memory as a whole. ``file`` is left open.
+
+    :param chunks: the page, in pieces, e.g. from ``Transcription.html_chunks``
+    :type chunks: Iterable[str]
+    :param file: binary file to write to
+    :type file: BinaryIO
+    :param content_encoding: one of ``CONTENT_ENCODINGS``, defaults to
+        "identity" (no compression)
+    :type content_encoding: str, optional
+    """
+    if content_encoding == "gzip":
+        # mtime=0 makes the output depend only on the page
+        sink = gzip.GzipFile(fileobj=file, mode="wb", mtime=0)
+    elif content_encoding == "br":
+        sink = io.BufferedWriter(_BrotliWriter(file))
+    elif content_encoding == "identity":
+        sink = None
+    else:
+        raise ValueError(f"Unknown content encoding {content_encoding}")
+
+    text = io.TextIOWrapper(sink or file, encoding="utf-8", newline="")
+    text.writelines(chunks)
+    text.flush()
+    text.detach()
+    if sink is not None:
+        sink.close()
+
+
+def _upload_body(
+    body: BinaryIO,
+    key: str,
+    content_type: str,
+    content_encoding: str,
+    force: bool,
+) -> str:
+    # Uploads a spooled body unless the stored object has the same hash;
+    # returns the hash
+    config = get_config()
+    client = get_s3_client()
+    size = body.tell()
+    content_hash = _hash_file(body)
+    extra_args = {
+        "ACL": "public-read",
+        "ContentType": content_type,
+        "Metadata": {HASH_METADATA_KEY: content_hash},
+    }
+    if content_encoding != "identity":
+        extra_args["ContentEncoding"] = content_encoding
+    with span(
+        "upload",
+        key=key,
+        content_encoding=content_encoding,
+    ) as upload_span:
+        if not force and content_hash == _stored_hash(
+            client, config.bucket, key
+        ):
+            upload_span.set(skipped=True)
+            log.debug("%s is unchanged", key)
+        else:
+            client.upload_fileobj(
+                body, config.bucket, key, ExtraArgs=extra_args
+            )
+            upload_span.set(bytes=size)
+            log.debug("Uploaded %s (%d bytes)", key, size)
+    return content_hash
+
+
+def _folder_prefix(folder: str) -> str:
+    if not folder.endswith("/"):
+        folder = folder + "/"
+    return folder
+
+
+def upload_html(
+    html_string: Union[str, Iterable[str]],
+    folder: str,
+    content_encoding: str = None,
+    force: bool = False,
+) -> str:
     """Upload an HTML file to S3
 
-    :param html_string: the HTML to upload
-    :type html_string: str
+    The page is compressed into a spooled temporary file and sent with a
+    managed transfer, which switches to a multipart upload for large pages,
+    so memory use stays bounded however long the transcript is.
+
+    The SHA-256 of the body is stored in the object's metadata. Unless
+    ``force`` is set, the object is checked with a HEAD request first, and
+    a page identical to the one already stored is not sent again.
+
+    :param html_string: the HTML to upload, whole or in chunks
+    :type html_string: str or Iterable[str]
     :param folder: the path to upload the file to
     :type folder: str
+    :param content_encoding: one of ``CONTENT_ENCODINGS``; defaults to
+        ``upload_content_encoding`` in config.yml, or "identity"
+    :type content_encoding: str, optional
+    :param force: upload even if the stored page is identical
+    :type force: bool, optional
     :return: URL to the transcript file
     :rtype: str
     """
-    s3 = aws_session.resource("s3")
-    if not folder.endswith("/"):
-        folder = folder + "/"
+    config = get_config()
+    if content_encoding is None:
+        content_encoding = config.get("upload_content_encoding", "identity")
+    if isinstance(html_string, str):
+        html_string = [html_string]
 
-    full_path = f"{folder}index.html"
-    s3_object = s3.Object(config.bucket, full_path)
-    response = s3_object.put(
-        Body=html_string,
-        ACL="public-read",
-        ContentType="text/html",
-    )
-    log.debug("Transcript put; response=%s", response)
+    full_path = f"{_folder_prefix(folder)}index.html"
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as body:
+        write_html(html_string, body, content_encoding)
+        _upload_body(body, full_path, "text/html", content_encoding, force)
 
     return f"https://{config.bucket}/{full_path}"
+
+
+def upload_sidecar(document: dict, folder: str, force: bool = False) -> str:
+    """Upload a transcript sidecar to S3, next to the page in ``folder``
+
+    The document is stored gzip-compressed with a gzip Content-Encoding,
+    which browsers undo transparently. As with pages, an identical
+    sidecar is not sent again unless ``force`` is set.
+
+    :param document: from ``Transcription.sidecar``
+    :type document: dict
+    :param folder: the path the page is uploaded to
+    :type folder: str
+    :param force: upload even if the stored sidecar is identical
+    :type force: bool, optional
+    :return: the SHA-256 of the stored body, for versioning its URL
+    :rtype: str
+    """
+    full_path = f"{_folder_prefix(folder)}{SIDECAR_NAME}"
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as body:
+        write_sidecar(document, body)
+        return _upload_body(body, full_path, "application/json", "gzip", force)
+
+
+def upload_transcription(
+    transcription,
+    folder: str,
+    page_mode: str = None,
+    force: bool = False,
+    **options,
+) -> str:
+    """Upload a transcription's page, and its sidecar in sidecar mode
+
+    The page is rendered inline, as a minified compact page, or as a
+    shell that loads a sidecar, depending on ``page_mode``.
+
+    In sidecar mode the sidecar is uploaded first and the shell page
+    links to it with its hash in the query string, so a page is never
+    published before its data and cached copies of an old sidecar are not
+    used. Media without a shell template is uploaded inline.
+
+    :param transcription: the transcription
+    :type transcription: Transcription
+    :param folder: the path to upload the files to
+    :type folder: str
+    :param page_mode: one of ``sidecar.PAGE_MODES``; defaults to
+        ``page_mode`` in config.yml, or "inline"
+    :type page_mode: str, optional
+    :param force: upload even if the stored files are identical
+    :type force: bool, optional
+    :return: URL to the transcript file
+    :rtype: str
+    """
+    if page_mode is None:
+        page_mode = get_config().get("page_mode", "inline")
+    if page_mode not in PAGE_MODES:
+        raise ValueError(f"Unknown page mode {page_mode}")
+    if page_mode == "sidecar" and transcription.has_shell:
+        content_hash = upload_sidecar(
+            transcription.sidecar(), folder, force=force
+        )
+        html = transcription.html_chunks(
+            sidecar_url=f"{SIDECAR_NAME}?v={content_hash[:16]}"
+        )
+    else:
+        html = transcription.html_chunks(compact=page_mode == "compact")
+    return upload_html(html, folder, force=force, **options)
+
+
+def upload_pages(
+    pages: Iterable[Tuple[Union[str, Iterable[str]], str]],
+    max_workers: int = 8,
+    **options,
+) -> List[str]:
+    """Upload many pages in parallel over the shared client
+
+    :param pages: (html, folder) pairs, as for ``upload_html``
+    :type pages: Iterable[Tuple[Union[str, Iterable[str]], str]]
+    :param max_workers: uploads in flight at once, defaults to 8
+    :type max_workers: int, optional
+    :return: the URL of each page, in order
+    :rtype: List[str]
+    """
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="upload"
+    ) as executor:
+        futures = [
+            executor.submit(upload_html, html, folder, **options)
+            for html, folder in pages
+        ]
+        return [future.result() for future in futures]
@@ -4,10 +4,12 @@ import atexit
 import re
 import shutil
 import tempfile
+import threading
 from typing import List
 
-# Create a temporary directory
-TEMP_DIR = tempfile.mkdtemp()
+# The temporary directory, created on first use by get_temp_dir
+TEMP_DIR: str = None
+_TEMP_DIR_LOCK = threading.Lock()
 
 STOP_WORDS = [
     "a",
@@ -92,19 +94,22 @@ STOP_WORDS = [
 
 def cleanup() -> None:
     """Remove the temporary directory"""
-    shutil.rmtree(TEMP_DIR)
-
-
-# Register cleanup function to be called on program exit
-atexit.register(cleanup)
+    if TEMP_DIR is not None:
+        shutil.rmtree(TEMP_DIR, ignore_errors=True)
 
 
 def get_temp_dir() -> str:
-    """Get the temporary directory
+    """Get the temporary directory, creating it on first use
 
     :return: the path to the temporary directory
     :rtype: str
     """
+    global TEMP_DIR  # pylint: disable=global-statement
+    with _TEMP_DIR_LOCK:
+        if TEMP_DIR is None:
+            TEMP_DIR = tempfile.mkdtemp()
+            # Remove it on program exit
+            atexit.register(cleanup)
     return TEMP_DIR
 
 
@@ -0,0 +1,210 @@
+"""Skip silence before transcription with voice activity detection"""
+
+import logging
+from typing import List, Tuple
+
+import numpy as np
+from whisper.audio import SAMPLE_RATE
+
+from unchecked_transcript.instrumentation import span
+from unchecked_transcript.pcm_cache import load_pcm
+
+log = logging.getLogger()
+
+# Length of the frames whose loudness is compared with the threshold
+FRAME_SECONDS = 0.03
+
+# Frames this far above the noise floor are speech
+DEFAULT_MARGIN_DB = 10.0
+
+# Frames quieter than this are never speech
+SILENCE_DB = -60.0
+
+# Skip detection if it would remove less than this share of the audio
+MIN_SKIPPED = 0.05
+
+
+def _frame_db(audio: np.ndarray) -> np.ndarray:
+    frame = int(FRAME_SECONDS * SAMPLE_RATE)
+    frames = audio[: len(audio) // frame * frame].reshape(-1, frame)
+    # einsum sums the squares without a temporary the size of the audio
+    power = np.einsum("ij,ij->i", frames, frames) / frame
+    return 10.0 * np.log10(power + 1e-10)
+
+
+def speech_regions(
+    audio: np.ndarray,
+    margin_db: float = DEFAULT_MARGIN_DB,
+    min_silence_seconds: float = 1.0,
+    min_speech_seconds: float = 0.25,
+    pad_seconds: float = 0.25,
+) -> List[Tuple[int, int]]:
+    """Find the parts of a waveform that may hold speech
+
+    A frame is loud enough to be speech if it is ``margin_db`` above the
+    noise floor, taken as the tenth percentile of frame loudness. Pauses
+    shorter than ``min_silence_seconds`` are kept so sentences are not
+    split, bursts shorter than ``min_speech_seconds`` are dropped, and
+    each region is widened by ``pad_seconds`` to keep word onsets.
+
+    Only loudness is measured: silence and quiet music beds are skipped,
+    but music as loud as the speakers is kept.
+
+    :param audio: 16 kHz mono waveform
+    :type audio: np.ndarray
+    :param margin_db: loudness above the noise floor that counts as
+        speech, defaults to 10.0
+    :type margin_db: float, optional
+    :param min_silence_seconds: shortest pause that separates regions,
+        defaults to 1.0
+    :type min_silence_seconds: float, optional
+    :param min_speech_seconds: shortest region kept, defaults to 0.25
+    :type min_speech_seconds: float, optional
+    :param pad_seconds: audio kept either side of each region, defaults to
+        0.25
+    :type pad_seconds: float, optional
+    :return: (start, end) sample offsets of each region, in order and not
+        overlapping
+    :rtype: List[Tuple[int, int]]
+    """
+    frame = int(FRAME_SECONDS * SAMPLE_RATE)
+    loudness = _frame_db(audio)
+    if not len(loudness):
+        return []
+    threshold = max(np.percentile(loudness, 10) + margin_db, SILENCE_DB)
+    voiced = np.concatenate(([False], loudness > threshold, [False]))
+    edges = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+    pad = int(pad_seconds * SAMPLE_RATE)
+    min_silence = int(min_silence_seconds * SAMPLE_RATE)
+    min_speech = int(min_speech_seconds * SAMPLE_RATE)
+
+    regions: List[Tuple[int, int]] = []
+    for start_frame, end_frame in zip(edges[::2], edges[1::2]):
+        start = int(start_frame) * frame
+        end = int(end_frame) * frame
+        if regions and start - regions[-1][1] < min_silence:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    return [
+        (max(0, start - pad), min(len(audio), end + pad))
+        for start, end in regions
+        if end - start >= min_speech
+    ]
+
+
+def remap_result(
+    result: dict, regions: List[Tuple[int, int]], offsets: np.ndarray
+) -> dict:
+    """Move the times in a result for joined regions back to the original
+
+    :param result: Whisper result for the regions joined end to end
+    :type result: dict
+    :param regions: (start, end) sample offsets of each region in the
+        original audio
+    :type regions: List[Tuple[int, int]]
+    :param offsets: where each region starts in the joined audio, in
+        samples
+    :type offsets: np.ndarray
+    :return: the result, with times on the original timeline
+    :rtype: dict
+    """
+    starts = np.asarray([start for start, _ in regions]) / SAMPLE_RATE
+    joined = offsets / SAMPLE_RATE
+
+    def original(seconds: float, side: str) -> float:
+        # An end on a join belongs to the region before it
+        index = max(int(np.searchsorted(joined, seconds, side)) - 1, 0)
+        return float(starts[index] + seconds - joined[index])
+
+    segments = []
+    for segment in result["segments"]:
+        segment = dict(segment)
+        segment["start"] = original(segment["start"], "right")
+        segment["end"] = max(
+            original(segment["end"], "left"), segment["start"]
+        )
+        if segment.get("words"):
+            segment["words"] = [
+                dict(
+                    word,
+                    start=original(word["start"], "right"),
+                    end=original(word["end"], "left"),
+                )
+                for word in segment["words"]
+            ]
+        segments.append(segment)
+    return dict(result, segments=segments)
+
+
+class VadTranscriber:
+    """Transcription engine that only transcribes the audio with speech
+
+    Wraps another engine. The speech regions found by ``speech_regions``
+    are joined end to end and transcribed in one call, so Whisper keeps
+    its context across pauses, and segment times are moved back to the
+    original timeline. Audio that is nearly all speech is passed through
+    unchanged.
+    """
+
+    min_silence_seconds: float
+
+    def __init__(self, engine, min_silence_seconds: float = 1.0) -> None:
+        self._engine = engine
+        self.min_silence_seconds = min_silence_seconds
+
+    @property
+    def identity(self) -> str:
+        """The wrapped engine's identity and the pause length
+
+        :return: what produces the results
+        :rtype: str
+        """
+        return f"{self._engine.identity}:vad={self.min_silence_seconds:g}"
+
+    @property
+    def concurrency(self) -> int:
+        """The number of transcriptions the wrapped engine runs at once
+
+        :return: the wrapped engine's concurrency
+        :rtype: int
+        """
+        return self._engine.concurrency
+
+    def transcribe(self, audio, **options) -> dict:
+        """Transcribe the speech in audio
+
+        :param audio: path to the audio file, or a 16 kHz waveform
+        :type audio: str or np.ndarray
+        :return: the Whisper result, with "text", "segments", and
+            "language" keys
+        :rtype: dict
+        """
+        if isinstance(audio, str):
+            audio = load_pcm(audio)
+        with span("vad", audio_seconds=len(audio) / SAMPLE_RATE) as vad_span:
+            regions = speech_regions(
+                audio, min_silence_seconds=self.min_silence_seconds
+            )
+            lengths = np.asarray(
+                [end - start for start, end in regions], dtype=np.int64
+            )
+            speech = int(lengths.sum())
+            vad_span.set(
+                regions=len(regions), speech_seconds=speech / SAMPLE_RATE
+            )
+        if not regions:
+            log.debug("No speech found")
+            return {"text": "", "segments": [], "language": "en"}
+        if speech >= (1 - MIN_SKIPPED) * len(audio):
+            return self._engine.transcribe(audio, **options)
+
+        log.debug(
+            "Transcribing %d speech regions, %.0f%% of the audio",
+            len(regions),
+            100 * speech / len(audio),
+        )
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        joined = np.concatenate([audio[start:end] for start, end in regions])
+        result = self._engine.transcribe(joined, **options)
+        return remap_result(result, regions, offsets)
@@ -0,0 +1,185 @@
+"""A pool of worker processes, each holding a loaded transcription model"""
+
+import gc
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from typing import Dict, List
+
+from unchecked_transcript.backends import (
+    TranscriptionBackend,
+    create_backend,
+)
+from unchecked_transcript.instrumentation import process_memory
+
+log = logging.getLogger()
+
+# The backend held by a worker process; set by _init_worker
+_worker_backend: TranscriptionBackend = None
+
+
+def _init_worker(name: str, settings: dict, pids) -> None:
+    global _worker_backend  # pylint: disable=global-statement
+    pids.put(os.getpid())
+    _worker_backend = create_backend(name, **settings)
+    _ = _worker_backend.model
+    log.debug("Worker %d loaded %s", os.getpid(), _worker_backend.identity)
+
+
+def _init_forked_worker(
+    backend: TranscriptionBackend, threads: int, pids
+) -> None:
+    global _worker_backend  # pylint: disable=global-statement
+    pids.put(os.getpid())
+    _worker_backend = backend
+    _worker_backend.limit_threads(threads)
+    log.debug("Worker %d shares %s", os.getpid(), backend.identity)
+
+
+def _transcribe_in_worker(audio, options: dict) -> dict:
+    return _worker_backend.transcribe(audio, **options)
+
+
+class WhisperWorkerPool:
+    """Transcription engine that spreads jobs over worker processes
+
+    Each of the ``processes`` workers loads the backend's model once and
+    limits it to ``threads_per_worker`` threads, so that jobs scheduled
+    onto the workers together use the machine's cores instead of
+    contending for them. Install the pool with ``transcription.set_engine``
+    to have every ``Transcription`` use it.
+
+    With ``share_model``, the model is instead loaded once in this process
+    and the workers are forked from it, so they share its weights
+    copy-on-write rather than each holding a copy. This needs a backend
+    whose model survives a fork (``forkable``) and a platform with fork.
+    The workers are started as the pool is created, while this process has
+    few threads, so create the pool before starting other work.
+    """
+
+    backend: TranscriptionBackend
+    processes: int
+    threads_per_worker: int
+    share_model: bool
+
+    def __init__(
+        self,
+        backend: TranscriptionBackend,
+        processes: int,
+        threads_per_worker: int = None,
+        share_model: bool = False,
+    ) -> None:
+        if processes < 1:
+            raise ValueError("A worker pool needs at least one process")
+        if share_model and not backend.forkable:
+            raise ValueError(
+                f"The {backend.name} backend cannot share its model with"
+                " forked workers"
+            )
+        forking = "fork" in multiprocessing.get_all_start_methods()
+        if share_model and not forking:
+            raise ValueError("Sharing a model needs fork, not available here")
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // processes)
+        self.backend = backend
+        self.processes = processes
+        self.threads_per_worker = threads_per_worker
+        self.share_model = share_model
+        self._pids: List[int] = []
+        if share_model:
+            context = multiprocessing.get_context("fork")
+            self._pid_queue = context.SimpleQueue()
+            _ = backend.model
+            initializer = _init_forked_worker
+            initargs = (backend, threads_per_worker, self._pid_queue)
+        else:
+            context = multiprocessing.get_context("spawn")
+            self._pid_queue = context.SimpleQueue()
+            settings = {**backend.settings, "threads": threads_per_worker}
+            initializer = _init_worker
+            initargs = (backend.name, settings, self._pid_queue)
+        self._executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=context,
+            initializer=initializer,
+            initargs=initargs,
+        )
+        if share_model:
+            # Keep the collector in the workers from touching (and so
+            # copying) every object inherited from this process. Only the
+            # workers need that: this process collects them again once the
+            # workers have forked.
+            gc.freeze()
+            try:
+                # A fork context starts every worker on the first submit
+                wait([self._executor.submit(os.getpid)])
+            finally:
+                gc.unfreeze()
+
+    @property
+    def identity(self) -> str:
+        """What produces this engine's results, for the result cache
+
+        :return: the backend's identity
+        :rtype: str
+        """
+        return self.backend.identity
+
+    @property
+    def concurrency(self) -> int:
+        """The number of transcriptions the pool runs at once
+
+        :return: number of worker processes
+        :rtype: int
+        """
+        return self.processes
+
+    def submit(self, audio, **options) -> Future:
+        """Schedule a transcription onto the next free worker
+
+        :param audio: path to the audio file, or a waveform array
+        :type audio: str or numpy.ndarray
+        :return: future resolving to the Whisper result
+        :rtype: Future
+        """
+        return self._executor.submit(_transcribe_in_worker, audio, options)
+
+    def transcribe(self, audio, **options) -> dict:
+        """Transcribe on a worker, waiting for the result
+
+        Calls from several threads run on different workers at once.
+
+        :param audio: path to the audio file, or a waveform array
+        :type audio: str or numpy.ndarray
+        :return: the Whisper result, with "text" and "segments" keys
+        :rtype: dict
+        """
+        return self.submit(audio, **options).result()
+
+    def memory(self) -> List[Dict[str, int]]:
+        """Get the current memory use of each worker process
+
+        Workers that have not started yet are left out. With
+        ``share_model``, "shared_bytes" is mostly the model's weights and
+        the sum of "pss_bytes" is what the workers use together.
+
+        :return: a "pid" key and the ``instrumentation.process_memory`` of
+            each worker, by pid
+        :rtype: List[Dict[str, int]]
+        """
+        while not self._pid_queue.empty():
+            self._pids.append(self._pid_queue.get())
+        return [
+            {"pid": pid, **process_memory(pid)} for pid in sorted(self._pids)
+        ]
+
+    def close(self) -> None:
+        """Shut down the worker processes"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> "WhisperWorkerPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,246 @@
+"""Proof-of-origin tokens for YouTube, cached on disk and shared by videos"""
+
+import atexit
+import functools
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Optional, Tuple
+
+from . import get_config
+
+log = logging.getLogger()
+
+DEFAULT_SCRIPT = os.path.join("scripts", "youtube-token-generator.js")
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"),
+    ".cache",
+    "unchecked-transcript",
+    "youtube-tokens.json",
+)
+DEFAULT_TTL_HOURS = 6
+
+GENERATORS = ["node", "stub"]
+
+
+class TokenError(RuntimeError):
+    """Tokens could not be generated"""
+
+
+class NodeTokenGenerator:
+    """Generate tokens with a long-lived Node helper
+
+    The helper script is started once with ``--serve`` and asked for a
+    token with each line written to its stdin, so Node's startup is paid
+    only once per process. A helper that has exited is restarted on the
+    next request.
+    """
+
+    script: str
+
+    def __init__(self, script: str = DEFAULT_SCRIPT) -> None:
+        self.script = script
+        self._process: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+
+    def _start(self) -> subprocess.Popen:
+        if self._process is None or self._process.poll() is not None:
+            log.debug("Starting %s", self.script)
+            try:
+                self._process = subprocess.Popen(
+                    ["node", self.script, "--serve"],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    text=True,
+                    bufsize=1,
+                )
+            except OSError as error:
+                raise TokenError(f"Cannot run {self.script}") from error
+        return self._process
+
+    def generate(self) -> Tuple[str, str]:
+        """Get a new visitor data string and PO token
+
+        :raises TokenError: if the helper fails or gives no token
+        :return: visitorData and poToken
+        :rtype: Tuple[str, str]
+        """
+        with self._lock:
+            process = self._start()
+            try:
+                process.stdin.write("\n")
+                process.stdin.flush()
+                line = process.stdout.readline()
+            except BrokenPipeError:
+                line = ""
+            if not line:
+                self._process = None
+                raise TokenError(f"{self.script} exited without a token")
+        try:
+            token_object = json.loads(line)
+            if "error" in token_object:
+                raise TokenError(f"{self.script}: {token_object['error']}")
+            return token_object["visitorData"], token_object["poToken"]
+        except (ValueError, KeyError, TypeError) as error:
+            raise TokenError(
+                f"{self.script} gave an unexpected reply: {line.strip()!r}"
+            ) from error
+
+    def close(self) -> None:
+        """Stop the helper, if it is running"""
+        with self._lock:
+            if self._process is not None:
+                self._process.stdin.close()
+                self._process.wait()
+                self._process.stdout.close()
+                self._process = None
+
+
+class StubTokenGenerator:
+    """Return fixed tokens without Node or the network, for offline tests"""
+
+    def __init__(
+        self,
+        visitor_data: str = "stub-visitor-data",
+        po_token: str = "stub-po-token",
+    ) -> None:
+        self.visitor_data = visitor_data
+        self.po_token = po_token
+
+    def generate(self) -> Tuple[str, str]:
+        """Get the fixed tokens
+
+        :return: visitorData and poToken
+        :rtype: Tuple[str, str]
+        """
+        return self.visitor_data, self.po_token
+
+    def close(self) -> None:
+        """Nothing to stop"""
+
+
+class TokenProvider:
+    """Hand out tokens until they expire, then generate new ones
+
+    Tokens are kept in memory and in a JSON file, so other processes and
+    later runs reuse them until ``ttl_seconds`` after they were generated.
+    One provider is shared by every ``YouTubeVideo`` in a process; it is
+    safe to use from several threads.
+    """
+
+    path: Optional[str]
+    ttl_seconds: float
+
+    def __init__(
+        self,
+        generator,
+        path: Optional[str] = DEFAULT_CACHE_PATH,
+        ttl_seconds: float = DEFAULT_TTL_HOURS * 3600,
+    ) -> None:
+        self.generator = generator
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._tokens: Optional[Tuple[str, str]] = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                stored = json.load(file)
+            tokens = (stored["visitorData"], stored["poToken"])
+            expires = float(stored["expires"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if expires > time.time():
+            self._tokens, self._expires = tokens, expires
+
+    def _store(self) -> None:
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "visitorData": self._tokens[0],
+                    "poToken": self._tokens[1],
+                    "expires": self._expires,
+                },
+                file,
+            )
+        os.replace(temporary, self.path)
+
+    def tokens(self) -> Tuple[str, str]:
+        """Get current tokens, generating them if there are none
+
+        Usable as pytubefix's ``po_token_verifier``.
+
+        :raises TokenError: if new tokens are needed and cannot be made
+        :return: visitorData and poToken
+        :rtype: Tuple[str, str]
+        """
+        with self._lock:
+            now = time.time()
+            if self._tokens is None or self._expires <= now:
+                self._tokens = None
+                if self.path:
+                    self._load()
+            if self._tokens is None:
+                log.debug("Generating YouTube tokens")
+                self._tokens = self.generator.generate()
+                self._expires = now + self.ttl_seconds
+                if self.path:
+                    self._store()
+            return self._tokens
+
+    def invalidate(self) -> None:
+        """Forget the current tokens, e.g. after YouTube rejected them"""
+        with self._lock:
+            self._tokens = None
+            self._expires = 0.0
+            if self.path:
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+
+
+@functools.lru_cache(maxsize=None)
+def get_token_provider() -> Optional[TokenProvider]:
+    """Get the token provider shared by every video in this process
+
+    ``youtube_token_generator`` in config.yml picks the generator: "node"
+    for the Node helper (``youtube_token_script``, default
+    scripts/youtube-token-generator.js) or "stub" for fixed tokens. Tokens
+    are cached in ``youtube_token_cache`` for ``youtube_token_ttl_hours``
+    (default 6); stub tokens are not cached on disk unless
+    ``youtube_token_cache`` is set.
+
+    :return: the provider, or None if no generator is configured
+    :rtype: TokenProvider, optional
+    """
+    config = get_config()
+    name = config.get("youtube_token_generator", None)
+    if not name:
+        return None
+    if name not in GENERATORS:
+        raise ValueError(f"Unknown YouTube token generator {name}")
+    path = DEFAULT_CACHE_PATH
+    if name == "node":
+        generator = NodeTokenGenerator(
+            config.get("youtube_token_script", DEFAULT_SCRIPT)
+        )
+        atexit.register(generator.close)
+    else:
+        generator = StubTokenGenerator()
+        path = None
+    ttl_hours = config.get("youtube_token_ttl_hours", DEFAULT_TTL_HOURS)
+    return TokenProvider(
+        generator,
+        path=config.get("youtube_token_cache", path) or None,
+        ttl_seconds=ttl_hours * 3600,
+    )